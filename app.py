@@ -4,93 +4,182 @@ import logging
 import time
 from datetime import datetime, timedelta
 from typing import List, Optional
-from contextlib import contextmanager
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.requests import Request
 from pydantic import BaseModel
 import jwt
-from passlib.context import CryptContext
 import asyncio
 import threading
 
 from image_processor import ImageProcessor
-from models import User, ProcessedImage, get_db, init_db
+from processors import progress, encoding
+from processors.instrumentation import timer_step, render_prometheus, collect_stages
+from processors.background_remover import OUTPUT_MODES as BACKGROUND_OUTPUT_MODES
+from processors import storage
+from processors.storage import result_store
+from request_logging import configure_logging, log_request_summary
+import request_profiler
+from loop_monitor import loop_monitor
+import image_delivery
+from models import (User, ProcessedImage, init_db, run_db, saved_filenames, user_images_page,
+                    GALLERY_PAGE_SIZE, GALLERY_MAX_PAGE_SIZE)
+from history_recorder import history_recorder
+from auth_cache import token_cache
+from passwords import password_hasher, PasswordHasherBusy
 # Telegram bot временно отключен для отладки
 # from telegram_bot import TelegramBot
 
-# Configure detailed logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s:%(lineno)d] - %(message)s'
-)
+# Configure logging (LOG_FORMAT=text|json, queue-based, see request_logging.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create a performance logger
 perf_logger = logging.getLogger("performance")
 perf_logger.setLevel(logging.INFO)
 
-# Helper function for timing operations
-@contextmanager
-def timer(operation_name: str, request_id: str = None):
-    """
-    Context manager for timing and logging operations.
-    
-    Automatically logs the start and completion of operations with execution time.
-    Useful for performance monitoring and debugging slow operations.
-    
-    Args:
-        operation_name (str): Descriptive name of the operation being timed
-        request_id (str, optional): Unique identifier for request tracking
-        
-    Yields:
-        None: Context for the timed operation
-        
-    Example:
-        with timer("Image processing", "req_123"):
-            # Your code here
-            process_image()
-    """
-    start_time = time.time()
-    request_prefix = f"[{request_id}] " if request_id else ""
-    logger.info(f"{request_prefix}🚀 STARTING: {operation_name}")
-    try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ COMPLETED: {operation_name} - Duration: {duration:.2f}s")
-
 app = FastAPI(title="Photo Processor API", description="Automatic photo processing service")
 
 # Add middleware for logging all requests
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    logger.info(f"🌐 INCOMING HTTP REQUEST: {request.method} {request.url}")
-    logger.info(f"📋 Headers: {dict(request.headers)}")
-    
-    response = await call_next(request)
-    
-    duration = time.time() - start_time
-    logger.info(f"📤 HTTP RESPONSE: {response.status_code} - Duration: {duration:.2f}s")
+    # One sampled summary line per request with total time and per-stage timings
+    start_time = time.perf_counter()
+    status_code = 500
+    with collect_stages() as stages:
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            log_request_summary(request, status_code, time.perf_counter() - start_time, stages)
     
     return response
 
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    # Opt-in profiling: X-Profile: 1 or ?profile=1 from an admin, or random sampling (PROFILE_SAMPLE_RATE)
+    if request_profiler.profile_requested(request):
+        user = await get_current_user_optional(request)
+        if user and user.username in ADMIN_USERNAMES:
+            return await request_profiler.profile_request(request, call_next, explicit=True)
+    elif request_profiler.should_sample():
+        return await request_profiler.profile_request(request, call_next, explicit=False)
+    
+    return await call_next(request)
+
+@app.middleware("http")
+async def select_encoder_profile(request: Request, call_next):
+    # Encoder profile (fast|balanced|small) for every image saved while handling this request
+    profile_name = request.headers.get("X-Encoder-Profile") or request.query_params.get("encoding")
+    if profile_name and profile_name not in encoding.PROFILES:
+        return JSONResponse(status_code=400, content={
+            "detail": f"Unknown encoder profile. Available: {', '.join(encoding.PROFILES)}"})
+    with encoding.use_profile(profile_name):
+        return await call_next(request)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    # Loop lag histogram at /metrics; with LOOP_BLOCK_DEBUG=1 stalls are attributed to the blocking function
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+
+@app.on_event("startup")
+async def start_result_storage():
+    # TTL/quota sweeper for processed/ and uploads/; results in a user's history are never expired
+    result_store.set_retention_filter(saved_filenames)
+    if image_delivery.THUMBNAILS_ON_STORE:
+        result_store.add_commit_hook(image_delivery.pregenerate_thumbnails)  # previews for /thumbs/
+    result_store.start()
+
+@app.on_event("shutdown")
+async def stop_result_storage():
+    await result_store.stop()
+
+@app.on_event("startup")
+async def start_history_recorder():
+    # ProcessedImage rows are buffered and written in batches (history_recorder.py)
+    history_recorder.start()
+
+@app.on_event("shutdown")
+async def stop_history_recorder():
+    await history_recorder.stop()
+
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Users allowed to profile requests and read profiles (comma separated usernames)
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
 
 # Static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/processed", StaticFiles(directory="processed"), name="processed")
 templates = Jinja2Templates(directory="templates")
 
+@app.api_route("/processed/{filename}", methods=["GET", "HEAD"])
+async def serve_processed(request: Request, filename: str):
+    """
+    Serve a processed image, as AVIF/WebP when the client's Accept header allows it.
+
+    Variants are encoded once per result and encoder profile and cached on disk;
+    the original JPEG/PNG is served otherwise. Responses are immutable with a
+    content-hash ETag (304 on If-None-Match) and support byte ranges; see
+    image_delivery.py. Links handed out by the API are signed and expire
+    (processors/storage.py); with REQUIRE_SIGNED_URLS=true unsigned requests get 403.
+    """
+    expires, signature = request.query_params.get("expires"), request.query_params.get("sig")
+    if signature or storage.REQUIRE_SIGNED_URLS:
+        if not storage.verify_signature(filename, expires, signature, prefix=storage.URL_PATH_PREFIX):
+            raise HTTPException(status_code=403, detail="Link is invalid or has expired")
+    source_path = await image_delivery.resolve_processed(filename)
+    if source_path is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    path, media_type = await image_delivery.negotiate(source_path, request.headers.get("accept", ""))
+    # A signed link must not outlive its signature in shared caches
+    max_age = int(expires) - int(time.time()) if signature else None
+    return await image_delivery.file_response(request, path, media_type, max_age=max_age)
+
+@app.api_route("/thumbs/{size}/{filename}", methods=["GET", "HEAD"])
+async def serve_thumbnail(request: Request, size: int, filename: str):
+    """
+    Serve a fixed-size preview of a processed image (WebP, or JPEG for clients without WebP).
+
+    Sizes are THUMBNAIL_SIZES (longest side in px); previews are rendered when the
+    result is stored or on the first request, then cached next to it and served
+    with the same immutable caching and signed-link rules as /processed/.
+
+    Example:
+        GET /thumbs/480/uuid_retouched.jpg?expires=1760000000&sig=...
+    """
+    expires, signature = request.query_params.get("expires"), request.query_params.get("sig")
+    if signature or storage.REQUIRE_SIGNED_URLS:
+        if not storage.verify_signature(filename, expires, signature, prefix=f"/thumbs/{size}/"):
+            raise HTTPException(status_code=403, detail="Link is invalid or has expired")
+    if size not in image_delivery.THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail="Not Found")
+    source_path = await image_delivery.resolve_processed(filename)
+    if source_path is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    format = image_delivery.thumbnail_format(request.headers.get("accept", ""))
+    path = await image_delivery.thumbnail_cache.get(source_path, size, format)
+    max_age = int(expires) - int(time.time()) if signature else None
+    return await image_delivery.file_response(request, path, image_delivery.MEDIA_TYPES[format], max_age=max_age)
+
+async def result_url(path: str) -> str:
+    # Signed, expiring link to a stored result: presigned bucket URL or /processed/...?expires=&sig=
+    return await result_store.url(os.path.basename(path))
+
+async def result_links(path: str) -> dict:
+    # Full-size link for downloads plus a preview for display on the upload page
+    return {"output_path": await result_url(path),
+            "thumbnail_url": image_delivery.thumbnail_url(os.path.basename(path), max(image_delivery.THUMBNAIL_SIZES))}
+
 # Initialize components
 image_processor = ImageProcessor()
 # telegram_bot = TelegramBot()  # Временно отключен
@@ -134,42 +223,48 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_password_hash(password):
-    """
-    Hashes a plain text password using bcrypt.
-    
-    Securely hashes passwords before storing in database. Uses bcrypt
-    algorithm with automatic salt generation for maximum security.
-    
-    Args:
-        password (str): Plain text password to hash
-        
-    Returns:
-        str: Securely hashed password
-        
-    Example:
-        hashed = get_password_hash("my_password123")
-    """
-    return pwd_context.hash(password)
+# Queries run through models.run_db (own session, off the event loop)
+def find_user(db, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+def create_user(db, username: str, email: str, password_hash: str):
+    if db.query(User).filter(User.username == username).first():
+        raise HTTPException(status_code=400, detail="Username already registered")
+    if db.query(User).filter(User.email == email).first():
+        raise HTTPException(status_code=400, detail="Email already registered")
+    db_user = User(username=username, email=email, password_hash=password_hash)
+    db.add(db_user)
+    return db_user
+
+def update_password_hash(db, user_id: int, password_hash: str):
+    db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
 
-def verify_password(plain_password, hashed_password):
+def auth_busy() -> HTTPException:
+    # Password hashing pool is saturated (passwords.py): shed the request instead of queueing CPU work
+    return HTTPException(status_code=429, detail="Too many authentication requests, try again later",
+                         headers={"Retry-After": "1"})
+
+async def user_from_token(token: str):
     """
-    Verifies a plain text password against its hash.
-    
-    Safely compares user input password with stored hash during login.
-    Uses constant-time comparison to prevent timing attacks.
-    
-    Args:
-        plain_password (str): User input password
-        hashed_password (str): Stored password hash from database
-        
-    Returns:
-        bool: True if password matches, False otherwise
-        
-    Example:
-        is_valid = verify_password("user_input", stored_hash)
+    User of a valid access token, None when the user does not exist.
+
+    Verified tokens are cached with their user (auth_cache.py), so repeated
+    requests with the same token skip both jwt.decode and the DB lookup.
+
+    Raises:
+        jwt.PyJWTError: token is malformed, badly signed, expired or has no subject
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    username = payload.get("sub")
+    if username is None:
+        raise jwt.InvalidTokenError("Token has no subject")
+    user = await run_db(find_user, username)
+    if user is not None:
+        token_cache.put(token, user, payload["exp"])
+    return user
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
@@ -193,15 +288,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             return {"user": user.username}
     """
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Could not validate credentials")
+        user = await user_from_token(credentials.credentials)
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
     
-    db = get_db()
-    user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     return user
@@ -234,17 +324,23 @@ async def get_current_user_optional(request: Request):
     
     try:
         token = auth_header.split(" ")[1]
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        
-        db = get_db()
-        user = db.query(User).filter(User.username == username).first()
-        return user
+        return await user_from_token(token)
     except:
         return None
 
+async def get_admin_user(user: User = Depends(get_current_user)):
+    """
+    Retrieves current user and requires admin rights.
+    
+    Admins are configured with the ADMIN_USERNAMES environment variable.
+    
+    Raises:
+        HTTPException: 401 if not authenticated, 403 if user is not an admin
+    """
+    if user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
 # Web routes
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -255,10 +351,16 @@ async def upload_page(request: Request):
     return templates.TemplateResponse("upload.html", {"request": request})
 
 @app.get("/gallery", response_class=HTMLResponse)
-async def gallery_page(request: Request, user: User = Depends(get_current_user)):
-    db = get_db()
-    images = db.query(ProcessedImage).filter(ProcessedImage.user_id == user.id).order_by(ProcessedImage.created_at.desc()).all()
-    return templates.TemplateResponse("gallery.html", {"request": request, "images": images, "user": user})
+async def gallery_page(request: Request, processing_type: Optional[str] = Query(None, alias="type"),
+                       user: User = Depends(get_current_user)):
+    # First page only; gallery.html fetches the next ones from /api/my-images with next_cursor
+    await history_recorder.flush()  # rows of the user's last requests may still be buffered
+    images, next_cursor = await run_db(user_images_page, user.id, GALLERY_PAGE_SIZE, None, processing_type)
+    urls = {img.id: await result_url(img.processed_filename) for img in images}
+    thumbnails = {img.id: image_delivery.thumbnail_url(img.processed_filename) for img in images}
+    return templates.TemplateResponse("gallery.html", {"request": request, "images": images, "urls": urls,
+                                                       "thumbnails": thumbnails, "user": user,
+                                                       "next_cursor": next_cursor, "processing_type": processing_type})
 
 @app.get("/docs", response_class=HTMLResponse)
 async def documentation_page(request: Request):
@@ -298,7 +400,8 @@ async def register(user: UserCreate):
         Token: JWT access token and token type for authentication
         
     Raises:
-        HTTPException: 400 if username or email already exists
+        HTTPException: 400 if username or email already exists, 429 if too many
+            password hashes are already pending
         
     Example:
         POST /api/register
@@ -308,20 +411,11 @@ async def register(user: UserCreate):
             "password": "secure_password123"
         }
     """
-    db = get_db()
-    
-    # Check if user exists
-    if db.query(User).filter(User.username == user.username).first():
-        raise HTTPException(status_code=400, detail="Username already registered")
-    if db.query(User).filter(User.email == user.email).first():
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create user
-    hashed_password = get_password_hash(user.password)
-    db_user = User(username=user.username, email=user.email, password_hash=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise auth_busy()
+    await run_db(create_user, user.username, user.email, hashed_password)
     
     # Create token
     access_token = create_access_token(data={"sub": user.username})
@@ -342,7 +436,8 @@ async def login(user: UserLogin):
         Token: JWT access token and token type for API authentication
         
     Raises:
-        HTTPException: 401 if credentials are invalid
+        HTTPException: 401 if credentials are invalid, 429 if too many password
+            hashes are already pending
         
     Example:
         POST /api/login
@@ -351,18 +446,27 @@ async def login(user: UserLogin):
             "password": "secure_password123"
         }
     """
-    db = get_db()
-    db_user = db.query(User).filter(User.username == user.username).first()
-    
-    if not db_user or not verify_password(user.password, db_user.password_hash):
+    db_user = await run_db(find_user, user.username)
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    try:
+        matches, new_hash = await password_hasher.verify(user.password, db_user.password_hash)
+    except PasswordHasherBusy:
+        raise auth_busy()
+    if not matches:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        # Stored with an older BCRYPT_ROUNDS: upgrade while the plain password is at hand
+        await run_db(update_password_hash, db_user.id, new_hash)
+        token_cache.invalidate_user(db_user.username)  # cached User rows still carry the old hash
     
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Image processing endpoints
 @app.post("/api/remove-background")
-async def remove_background(request: Request, file: UploadFile = File(...), method: str = Form("rembg")):
+async def remove_background(request: Request, file: UploadFile = File(...), method: str = Form("rembg"),
+                            output: str = Form("png")):
     """
     Remove background from uploaded image using AI.
     
@@ -373,26 +477,32 @@ async def remove_background(request: Request, file: UploadFile = File(...), meth
     Args:
         request (Request): HTTP request object for user detection
         file (UploadFile): Image file to process (JPG, PNG, etc.)
-        method (str): Background removal method ("rembg" or "lbm")
+        method (str): Background removal method ("rembg", "rembg_lowres" or "lbm")
+        output (str): Output mode - "png" (default), "png_fast", "cutout_webp",
+            "mask" (alpha only) or "bbox_cropped" (cropped to the subject)
         
     Returns:
         dict: Success status and URL path to processed image
         
     Raises:
-        HTTPException: 400 if file is not an image, 500 if processing fails
+        HTTPException: 400 if file is not an image or output mode is unknown, 500 if processing fails
         
     Example:
         POST /api/remove-background
         Content-Type: multipart/form-data
         - file: image.jpg
         - method: rembg
+        - output: cutout_webp
         
-        Response: {"success": true, "output_path": "/processed/uuid_no_bg.png"}
+        Response: {"success": true, "output_path": "/processed/uuid_no_bg.webp?expires=...&sig=...",
+                   "thumbnail_url": "/thumbs/1280/uuid_no_bg.webp?expires=...&sig=..."}
     """
     user = await get_current_user_optional(request)
     
     if not file.content_type or not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
+    if output not in BACKGROUND_OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown output mode. Available: {', '.join(BACKGROUND_OUTPUT_MODES)}")
     
     try:
         # Save uploaded file
@@ -404,24 +514,21 @@ async def remove_background(request: Request, file: UploadFile = File(...), meth
             buffer.write(content)
         
         # Process image with selected method
-        output_path = await image_processor.remove_background(upload_path, file_id, method=method)
+        output_path = await image_processor.remove_background(upload_path, file_id, method=method, output=output)
         
         # Save to database if user is authenticated
         if user:
-            db = get_db()
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(output_path),
                 processing_type=f"remove_background_{method}"
             )
-            db.add(processed_image)
-            db.commit()
         
         # Clean up upload
         os.remove(upload_path)
         
-        return {"success": True, "output_path": f"/processed/{os.path.basename(output_path)}"}
+        return {"success": True, **await result_links(output_path)}
     
     except Exception as e:
         logger.error(f"Error removing background: {e}")
@@ -431,7 +538,8 @@ async def remove_background(request: Request, file: UploadFile = File(...), meth
 async def person_swap(
     request: Request,
     person_files: List[UploadFile] = File(...),
-    background_files: List[UploadFile] = File(...)
+    background_files: List[UploadFile] = File(...),
+    progress_id: Optional[str] = Form(None)
 ):
     user = await get_current_user_optional(request)
     
@@ -465,26 +573,24 @@ async def person_swap(
                 buffer.write(content)
             background_paths.append(upload_path)
         
-        # Process person swap
-        output_paths = await image_processor.person_swap_separate(person_paths, background_paths, file_id)
+        # Process person swap (progress and each finished composite go to /api/progress/{progress_id})
+        with progress.track(progress_id):
+            output_paths = await image_processor.person_swap_separate(person_paths, background_paths, file_id)
         
         # Save to database if user is authenticated
         results = []
         for i, output_path in enumerate(output_paths):
             if user:
-                db = get_db()
-                processed_image = ProcessedImage(
+                history_recorder.record(
                     user_id=user.id,
                     original_filename=f"person_swap_{i+1}",
                     processed_filename=os.path.basename(output_path),
                     processing_type="person_swap"
                 )
-                db.add(processed_image)
-                db.commit()
             
             results.append({
                 "success": True,
-                "output_path": f"/processed/{os.path.basename(output_path)}"
+                **await result_links(output_path)
             })
         
         # Clean up uploads
@@ -535,21 +641,18 @@ async def create_collage(
         
         # Save to database if user is authenticated
         if user:
-            db = get_db()
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=f"{collage_type}_collage",
                 processed_filename=os.path.basename(output_path),
                 processing_type=f"collage_{collage_type}"
             )
-            db.add(processed_image)
-            db.commit()
         
         # Clean up uploads
         for path in upload_paths:
             os.remove(path)
         
-        return {"success": True, "output_path": f"/processed/{os.path.basename(output_path)}"}
+        return {"success": True, **await result_links(output_path)}
     
     except Exception as e:
         logger.error(f"Error creating collage: {e}")
@@ -601,20 +704,17 @@ async def add_frame(
         
         # Save to database if user is authenticated
         if user:
-            db = get_db()
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(output_path),
                 processing_type=processing_type
             )
-            db.add(processed_image)
-            db.commit()
         
         # Clean up upload
         os.remove(upload_path)
         
-        return {"success": True, "output_path": f"/processed/{os.path.basename(output_path)}"}
+        return {"success": True, **await result_links(output_path)}
     
     except Exception as e:
         logger.error(f"Error adding frame: {e}")
@@ -645,27 +745,24 @@ async def smart_crop(
         
         # Save to database if user is authenticated
         if user:
-            db = get_db()
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(output_path),
                 processing_type=f"smart_crop_{aspect_ratio.replace(':', 'x')}"
             )
-            db.add(processed_image)
-            db.commit()
         
         # Clean up upload
         os.remove(upload_path)
         
-        return {"success": True, "output_path": f"/processed/{os.path.basename(output_path)}"}
+        return {"success": True, **await result_links(output_path)}
     
     except Exception as e:
         logger.error(f"Error in smart crop: {e}")
         raise HTTPException(status_code=500, detail="Error processing image")
 
 @app.post("/api/social-media-optimize")
-async def optimize_for_social_media(request: Request, file: UploadFile = File(...)):
+async def optimize_for_social_media(request: Request, file: UploadFile = File(...), progress_id: Optional[str] = Form(None)):
     """One-click social media optimization - creates versions for all major platforms"""
     user = await get_current_user_optional(request)
     
@@ -681,26 +778,25 @@ async def optimize_for_social_media(request: Request, file: UploadFile = File(..
             content = await file.read()
             buffer.write(content)
         
-        # Process image for all social media platforms
-        result = await image_processor.optimize_for_social_media(upload_path, file_id)
+        # Process image for all social media platforms (each platform image is pushed as it completes)
+        with progress.track(progress_id):
+            result = await image_processor.optimize_for_social_media(upload_path, file_id)
         
         if result["success"]:
             # Save to database if user is authenticated
             if user:
-                db = get_db()
                 for platform, info in result["optimized_versions"].items():
-                    processed_image = ProcessedImage(
+                    history_recorder.record(
                         user_id=user.id,
                         original_filename=file.filename,
                         processed_filename=os.path.basename(info["path"]),
                         processing_type=f"social_media_{platform}"
                     )
-                    db.add(processed_image)
-                db.commit()
             
             # Convert paths to web-accessible URLs
             for platform, info in result["optimized_versions"].items():
-                info["path"] = f"/processed/{os.path.basename(info['path'])}"
+                info["thumbnail_url"] = image_delivery.thumbnail_url(os.path.basename(info["path"]))
+                info["path"] = await result_url(info["path"])
         
         # Clean up upload
         os.remove(upload_path)
@@ -732,30 +828,154 @@ async def retouch_image(request: Request, file: UploadFile = File(...)):
         
         # Save to database if user is authenticated
         if user:
-            db = get_db()
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(output_path),
                 processing_type="retouch"
             )
-            db.add(processed_image)
-            db.commit()
         
         # Clean up upload
         os.remove(upload_path)
         
-        return {"success": True, "output_path": f"/processed/{os.path.basename(output_path)}"}
+        return {"success": True, **await result_links(output_path)}
     
     except Exception as e:
         logger.error(f"Error retouching image: {e}")
         raise HTTPException(status_code=500, detail="Error processing image")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Export per-operation and per-stage latency histograms in Prometheus text format.
+
+    Series are labelled by operation, method, image megapixel bucket and (for
+    stages) the timer_step name, so percentiles can be aggregated per processor.
+    Event-loop lag and blocking-call counts per function come from loop_monitor.
+
+    Returns:
+        PlainTextResponse: Prometheus exposition format (text/plain; version=0.0.4)
+
+    Example:
+        GET /metrics
+        photo_stage_duration_seconds_bucket{operation="retouch",method="",megapixels="12-24MP",stage="Applying enhancement filters",le="2.5"} 7
+        event_loop_blocked_total{function="app.send_telegram_message"} 12
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/profiles")
+async def list_profiles(admin: User = Depends(get_admin_user)):
+    """
+    List stored request profiles, slowest first.
+    
+    Contains the PROFILE_KEEP slowest profiled requests and the latest explicitly
+    requested profiles (X-Profile: 1 or ?profile=1 sent by an admin).
+    
+    Returns:
+        dict: Profile metadata (id, route, status, duration, peak traced memory)
+    """
+    return {"profiles": request_profiler.profile_store.list()}
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = "prof", admin: User = Depends(get_admin_user)):
+    """
+    Download a stored profile.
+    
+    Args:
+        profile_id (str): Id from the X-Profile-Id header or /api/admin/profiles
+        format (str): "prof" for the cProfile dump (snakeviz, pstats) or "txt" for the text report
+        
+    Returns:
+        FileResponse: Profile artifact
+        
+    Raises:
+        HTTPException: 404 if the profile was rotated out or never existed
+    """
+    record = request_profiler.profile_store.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    if format == "txt":
+        return FileResponse(record.report_path, media_type="text/plain", filename=f"{profile_id}.txt")
+    return FileResponse(record.prof_path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/api/progress/{job_id}")
+async def stream_progress(request: Request, job_id: str):
+    """
+    Stream progress of a long-running job as Server-Sent Events.
+
+    The client generates a job id, opens this stream and sends the same id as the
+    `progress_id` form field of /api/person-swap or /api/social-media-optimize.
+    Events: `started`, `stage` (stage name, percent, elapsed), `progress` (number of
+    results the job will produce, once known), `partial` (URL of each finished
+    composite or platform image), then `done` or `failed`. Reconnecting with
+    Last-Event-ID resumes after the last received event. A stream whose job has not
+    started within PROGRESS_CHANNEL_TTL is closed.
+
+    Args:
+        request (Request): HTTP request (used for Last-Event-ID)
+        job_id (str): Client-generated job id, 8-64 characters [A-Za-z0-9_-]
+
+    Returns:
+        StreamingResponse: text/event-stream with progress events
+
+    Example:
+        const events = new EventSource(`/api/progress/${progressId}`);
+        events.addEventListener('partial', e => showResult(JSON.parse(e.data).url));
+    """
+    if not progress.is_valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid progress id")
+
+    try:
+        channel = progress.get_channel(job_id, subscriber=True)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    return StreamingResponse(
+        channel.stream(start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/my-images")
-async def get_my_images(user: User = Depends(get_current_user)):
-    db = get_db()
-    images = db.query(ProcessedImage).filter(ProcessedImage.user_id == user.id).order_by(ProcessedImage.created_at.desc()).all()
-    return {"images": [{"id": img.id, "filename": img.processed_filename, "type": img.processing_type, "created_at": img.created_at} for img in images]}
+async def get_my_images(cursor: Optional[str] = None, limit: int = GALLERY_PAGE_SIZE,
+                        processing_type: Optional[str] = Query(None, alias="type"),
+                        user: User = Depends(get_current_user)):
+    """
+    One page of the user's processing history, newest first.
+
+    Args:
+        cursor (str, optional): `next_cursor` of the previous page; omit for the first page
+        limit (int): Page size, 1-200 (default 50)
+        type (str, optional): Only this processing_type (e.g. "retouch", "social_media_instagram")
+
+    Returns:
+        dict: {"images": [{"id", "filename", "original_filename", "url", "thumbnail_url", "type", "created_at"}],
+               "next_cursor": str | None}
+
+    Example:
+        GET /api/my-images?limit=50
+        GET /api/my-images?limit=50&cursor=MjAyNi0xMC0xOVQwMDoxMjo1OS41NjR8NDI
+    """
+    if not 1 <= limit <= GALLERY_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {GALLERY_MAX_PAGE_SIZE}")
+    if cursor is None:
+        await history_recorder.flush()  # rows of the user's last requests may still be buffered
+    try:
+        images, next_cursor = await run_db(user_images_page, user.id, limit, cursor, processing_type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    items = []
+    for img in images:
+        items.append({"id": img.id, "filename": img.processed_filename, "original_filename": img.original_filename,
+                      "url": await result_url(img.processed_filename),
+                      "thumbnail_url": image_delivery.thumbnail_url(img.processed_filename),
+                      "type": img.processing_type, "created_at": img.created_at})
+    return {"images": items, "next_cursor": next_cursor}
 
 # Telegram bot временно отключен
 # def start_telegram_bot():
@@ -777,22 +997,35 @@ os.makedirs("templates", exist_ok=True)
 # User states storage
 user_states = {}
 
+# Telegram Bot API base URL; point it at a local stand-in (benchmarks/fake_telegram.py) for load tests
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# Media group (album) aggregation: Telegram sends one update per album photo,
+# updates sharing media_group_id are buffered and processed as a single job
+MEDIA_GROUP_WINDOW = float(os.getenv("TELEGRAM_MEDIA_GROUP_WINDOW", "1.5"))
+MEDIA_GROUP_ACTIONS = ("collage", "person_swap")
+COLLAGE_MAX_PHOTOS = 5  # the bot offers 2-5 photos per collage, albums included
+media_group_buffers = {}
+
 # REST API Endpoints for Image Processing
 @app.post("/api/remove-background")
 async def api_remove_background(
     file: UploadFile = File(...),
     method: str = Form("rembg"),
+    output: str = Form("png"),
     user: User = Depends(get_current_user_optional)
 ):
     """API endpoint for background removal"""
+    if output not in BACKGROUND_OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown output mode. Available: {', '.join(BACKGROUND_OUTPUT_MODES)}")
     file_id = str(uuid.uuid4())
     
     logger.info(f"[{file_id}] 📨 INCOMING REQUEST: /api/remove-background")
-    logger.info(f"[{file_id}] 📄 File: {file.filename}, Size: {file.size if hasattr(file, 'size') else 'unknown'}, Method: {method}")
+    logger.info(f"[{file_id}] 📄 File: {file.filename}, Size: {file.size if hasattr(file, 'size') else 'unknown'}, Method: {method}, Output: {output}")
     logger.info(f"[{file_id}] 👤 User: {'authenticated' if user else 'anonymous'}")
     
     try:
-        with timer("File upload and save", file_id):
+        with timer_step("File upload and save", file_id):
             # Save uploaded file
             input_path = f"uploads/{file_id}_input{os.path.splitext(file.filename)[1]}"
             os.makedirs("uploads", exist_ok=True)
@@ -803,24 +1036,21 @@ async def api_remove_background(
             
             logger.info(f"[{file_id}] 💾 File saved to: {input_path}")
         
-        with timer("Background removal processing", file_id):
+        with timer_step("Background removal processing", file_id):
             # Process with ImageProcessor
             processor = ImageProcessor()
-            result_path = await processor.remove_background(input_path, file_id, method)
+            result_path = await processor.remove_background(input_path, file_id, method, output)
             logger.info(f"[{file_id}] 🎨 Processing complete! Result: {result_path}")
         
-        with timer("Database save", file_id):
+        with timer_step("Database save", file_id):
             # Save to database if user is authenticated
             if user:
-                db = next(get_db())
-                processed_image = ProcessedImage(
+                history_recorder.record(
                     user_id=user.id,
                     original_filename=file.filename,
                     processed_filename=os.path.basename(result_path),
                     processing_type=f"remove_background_{method}"
                 )
-                db.add(processed_image)
-                db.commit()
                 logger.info(f"[{file_id}] 💾 Saved to database for user {user.username}")
             else:
                 logger.info(f"[{file_id}] 👤 Anonymous user - not saving to database")
@@ -833,8 +1063,8 @@ async def api_remove_background(
         # Return file
         return FileResponse(
             result_path,
-            media_type="image/png",
-            filename=f"no_bg_{file.filename}",
+            media_type=BACKGROUND_OUTPUT_MODES[output][1],
+            filename=f"no_bg_{os.path.splitext(file.filename)[0]}{os.path.splitext(result_path)[1]}",
             headers={"Content-Disposition": "attachment"}
         )
         
@@ -883,15 +1113,12 @@ async def api_add_frame(
         
         # Save to database if user is authenticated
         if user:
-            db = next(get_db())
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(result_path),
                 processing_type=f"add_frame_{frame_style}"
             )
-            db.add(processed_image)
-            db.commit()
         
         return FileResponse(
             result_path,
@@ -936,15 +1163,12 @@ async def api_smart_crop(
         
         # Save to database if user is authenticated
         if user:
-            db = next(get_db())
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(result_path),
                 processing_type=f"smart_crop_{aspect_ratio.replace(':', 'x')}"
             )
-            db.add(processed_image)
-            db.commit()
         
         return FileResponse(
             result_path,
@@ -986,15 +1210,12 @@ async def api_retouch(
         
         # Save to database if user is authenticated
         if user:
-            db = next(get_db())
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=file.filename,
                 processed_filename=os.path.basename(result_path),
                 processing_type="retouch"
             )
-            db.add(processed_image)
-            db.commit()
         
         return FileResponse(
             result_path,
@@ -1016,6 +1237,7 @@ async def api_retouch(
 @app.post("/api/social-media-optimize")
 async def api_social_media_optimize(
     file: UploadFile = File(...),
+    progress_id: Optional[str] = Form(None),
     user: User = Depends(get_current_user_optional)
 ):
     """API endpoint for social media optimization"""
@@ -1032,20 +1254,18 @@ async def api_social_media_optimize(
         
         # Process with ImageProcessor
         processor = ImageProcessor()
-        result_data = await processor.optimize_for_social_media(input_path, file_id)
+        with progress.track(progress_id):
+            result_data = await processor.optimize_for_social_media(input_path, file_id)
         
         # Save to database if user is authenticated
         if user:
-            db = next(get_db())
             for version in result_data.get("versions", []):
-                processed_image = ProcessedImage(
+                history_recorder.record(
                     user_id=user.id,
                     original_filename=file.filename,
                     processed_filename=os.path.basename(version["path"]),
                     processing_type=f"social_media_{version['platform']}"
                 )
-                db.add(processed_image)
-            db.commit()
         
         # Return JSON with download links
         return {"message": "Optimization complete", "versions": result_data.get("versions", [])}
@@ -1087,15 +1307,12 @@ async def api_create_collage(
         
         # Save to database if user is authenticated
         if user:
-            db = next(get_db())
-            processed_image = ProcessedImage(
+            history_recorder.record(
                 user_id=user.id,
                 original_filename=f"collage_{len(files)}_photos.jpg",
                 processed_filename=os.path.basename(result_path),
                 processing_type=f"collage_{collage_type}"
             )
-            db.add(processed_image)
-            db.commit()
         
         return FileResponse(
             result_path,
@@ -1119,6 +1336,7 @@ async def api_create_collage(
 async def api_person_swap(
     person_files: List[UploadFile] = File(...),
     background_files: List[UploadFile] = File(...),
+    progress_id: Optional[str] = Form(None),
     user: User = Depends(get_current_user_optional)
 ):
     """API endpoint for person swapping"""
@@ -1148,20 +1366,18 @@ async def api_person_swap(
         
         # Process with ImageProcessor
         processor = ImageProcessor()
-        result_paths = await processor.person_swap_separate(person_paths, background_paths, file_id)
+        with progress.track(progress_id):
+            result_paths = await processor.person_swap_separate(person_paths, background_paths, file_id)
         
         # Save to database if user is authenticated
         if user:
-            db = next(get_db())
             for i, result_path in enumerate(result_paths):
-                processed_image = ProcessedImage(
+                history_recorder.record(
                     user_id=user.id,
                     original_filename=f"person_swap_{i}.jpg",
                     processed_filename=os.path.basename(result_path),
                     processing_type="person_swap"
                 )
-                db.add(processed_image)
-            db.commit()
         
         # Return first result or create ZIP with multiple results
         if len(result_paths) == 1:
@@ -1200,7 +1416,8 @@ async def api_documentation():
                 "description": "Remove background from image",
                 "parameters": {
                     "file": "Image file (required)",
-                    "method": "rembg or lbm (optional, default: rembg)"
+                    "method": "rembg, rembg_lowres (faster on large photos) or lbm (optional, default: rembg)",
+                    "output": "png, png_fast, cutout_webp, mask or bbox_cropped (optional, default: png)"
                 },
                 "response": "Processed image file"
             },
@@ -1235,7 +1452,8 @@ async def api_documentation():
                 "method": "POST",
                 "description": "Optimize image for all social media platforms",
                 "parameters": {
-                    "file": "Image file (required)"
+                    "file": "Image file (required)",
+                    "progress_id": "Client-generated id to follow progress at /api/progress/{progress_id} (optional)"
                 },
                 "response": "JSON with download links for all platform versions"
             },
@@ -1254,9 +1472,18 @@ async def api_documentation():
                 "description": "Swap people onto different backgrounds",
                 "parameters": {
                     "person_files": "Images with people (required)",
-                    "background_files": "Background images (required)"
+                    "background_files": "Background images (required)",
+                    "progress_id": "Client-generated id to follow progress at /api/progress/{progress_id} (optional)"
                 },
                 "response": "Processed image(s) with people on new backgrounds"
+            },
+            "/api/progress/{progress_id}": {
+                "method": "GET",
+                "description": "Server-Sent Events stream with stage progress and partial results of a running job",
+                "parameters": {
+                    "progress_id": "Id sent as the progress_id form field of the job request"
+                },
+                "response": "text/event-stream: started, stage, partial, done/failed events"
             }
         },
         "authentication": "Optional - include Authorization: Bearer <token> for user tracking",
@@ -1325,7 +1552,7 @@ async def telegram_webhook(request: Request):
                 }
                 
                 # Send message with inline keyboard
-                telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+                telegram_url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
                 payload = {
                     "chat_id": chat_id,
                     "text": response_text,
@@ -1367,7 +1594,12 @@ https://photo-master-pro-dddddd1997.replit.app"""
                 user_id = user.get("id")
                 user_state = user_states.get(user_id, {})
                 action = user_state.get("action")
-                
+
+                # Albums arrive as one update per photo - collect them into one batched job
+                if message.get("media_group_id") and action in MEDIA_GROUP_ACTIONS:
+                    await collect_media_group(bot_token, chat_id, message, username, user_state)
+                    return {"status": "ok"}
+
                 if action == "remove_bg":
                     await process_remove_background(bot_token, chat_id, message, username)
                     return {"status": "ok"}
@@ -1411,7 +1643,7 @@ https://photo-master-pro-dddddd1997.replit.app"""
             
             # Send response back to Telegram
             if response_text and chat_id:
-                telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+                telegram_url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
                 payload = {
                     "chat_id": chat_id,
                     "text": response_text,
@@ -1436,7 +1668,7 @@ https://photo-master-pro-dddddd1997.replit.app"""
             logger.info(f"Processing callback from {username}: {callback_data}")
             
             # Answer the callback query first
-            answer_url = f"https://api.telegram.org/bot{bot_token}/answerCallbackQuery"
+            answer_url = f"{TELEGRAM_API_URL}/bot{bot_token}/answerCallbackQuery"
             answer_payload = {"callback_query_id": query_id}
             requests.post(answer_url, json=answer_payload)
             
@@ -1463,6 +1695,7 @@ https://photo-master-pro-dddddd1997.replit.app"""
                 response_text = """🎨 *Создание коллажа*
 
 Отправьте мне 2-5 фотографий для создания красивого коллажа.
+Можно отправить их одним альбомом - коллаж будет создан сразу.
 
 📸 *Доступные стили:*
 • Полароид с подписью
@@ -1592,7 +1825,7 @@ https://photo-master-pro-dddddd1997.replit.app"""
             
             # Send response
             if response_text and chat_id:
-                telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+                telegram_url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
                 payload = {
                     "chat_id": chat_id,
                     "text": response_text,
@@ -1694,7 +1927,7 @@ async def process_add_frame_photo(bot_token, chat_id, message, username, user_st
         
         # Send message with inline keyboard using requests
         import requests
-        telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        telegram_url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
         payload = {
             "chat_id": chat_id,
             "text": "🖼️ *Фото получено!*\n\nВыберите тип рамки:",
@@ -1908,7 +2141,13 @@ async def process_person_swap(bot_token, chat_id, message, username, user_state)
             # Get both photos
             person_file_id = user_state.get("person_file_id")
             background_file_id = message["photo"][-1]["file_id"]
-            
+
+            if user_state.get("person_file_ids"):
+                # People came in as an album - run one batched M×1 job
+                await run_person_swap_batch(bot_token, chat_id, user_state["person_file_ids"],
+                                            [background_file_id], user_state)
+                return
+
             if not person_file_id:
                 await send_telegram_message(bot_token, chat_id, "❌ Фото человека не найдено. Попробуйте еще раз.")
                 return
@@ -1984,7 +2223,7 @@ async def process_collage(bot_token, chat_id, message, username, user_state):
         
         if len(photos) == 1:
             await send_telegram_message(bot_token, chat_id, f"✅ *Фото {len(photos)} получено!*\n\nОтправьте еще фото или нажмите /done для создания коллажа.", "Markdown")
-        elif len(photos) < 5:
+        elif len(photos) < COLLAGE_MAX_PHOTOS:
             await send_telegram_message(bot_token, chat_id, f"✅ *Фото {len(photos)} получено!*\n\nОтправьте еще фото или нажмите /done для создания коллажа.", "Markdown")
         else:
             await send_telegram_message(bot_token, chat_id, "🔄 *Создаю коллаж...*\n\nПодождите немного!", "Markdown")
@@ -1996,11 +2235,164 @@ async def process_collage(bot_token, chat_id, message, username, user_state):
         logger.error(f"Error in process_collage: {e}")
         await send_telegram_message(bot_token, chat_id, "❌ Произошла ошибка при обработке фото.")
 
+async def collect_media_group(bot_token, chat_id, message, username, user_state):
+    """Buffer one album update; the first update of a group schedules the batched flush"""
+    group_id = message["media_group_id"]
+    buffer = media_group_buffers.get(group_id)
+
+    if buffer is None:
+        buffer = {"file_ids": [], "last_update": 0.0}
+        media_group_buffers[group_id] = buffer
+        # Keep a reference to the task so it is not garbage collected mid-window
+        buffer["task"] = asyncio.create_task(
+            flush_media_group(bot_token, chat_id, group_id, username, user_state)
+        )
+
+    buffer["file_ids"].append(message["photo"][-1]["file_id"])
+    buffer["last_update"] = time.monotonic()
+    logger.info(f"Buffered album photo {len(buffer['file_ids'])} for media group {group_id} from {username}")
+
+async def flush_media_group(bot_token, chat_id, group_id, username, user_state):
+    """Wait until the album stops growing, then process all its photos as one job"""
+    try:
+        # Debounce: the window restarts with every new photo of the album
+        while True:
+            await asyncio.sleep(MEDIA_GROUP_WINDOW)
+            buffer = media_group_buffers[group_id]
+            if time.monotonic() - buffer["last_update"] >= MEDIA_GROUP_WINDOW:
+                break
+
+        buffer = media_group_buffers.pop(group_id)
+        file_ids = buffer["file_ids"]
+        action = user_state.get("action")
+        logger.info(f"Processing album {group_id} from {username}: {len(file_ids)} photos, action: {action}")
+
+        if action == "collage":
+            await process_collage_album(bot_token, chat_id, file_ids, user_state)
+        elif action == "person_swap":
+            await process_person_swap_album(bot_token, chat_id, file_ids, user_state)
+
+    except Exception as e:
+        media_group_buffers.pop(group_id, None)
+        logger.error(f"Error in flush_media_group: {e}")
+        import traceback
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        await send_telegram_message(bot_token, chat_id, f"❌ Произошла ошибка при обработке альбома: {str(e)}")
+
+async def download_telegram_photos(bot_token, file_ids, unique_id, prefix):
+    """Download several Telegram photos into uploads/, returns local paths or None on failure"""
+    import aiofiles
+    import requests
+
+    os.makedirs("uploads", exist_ok=True)
+    paths = []
+
+    for i, file_id in enumerate(file_ids):
+        photo_url = await download_telegram_photo(bot_token, file_id)
+        if not photo_url:
+            break
+
+        photo_response = requests.get(photo_url)
+        if photo_response.status_code != 200:
+            break
+
+        path = f"uploads/{unique_id}_{prefix}_{i}.jpg"
+        async with aiofiles.open(path, 'wb') as f:
+            await f.write(photo_response.content)
+        paths.append(path)
+
+    if len(paths) != len(file_ids):
+        for path in paths:
+            try:
+                os.remove(path)
+            except:
+                pass
+        return None
+
+    return paths
+
+async def process_collage_album(bot_token, chat_id, file_ids, user_state):
+    """Build one collage from an album (plus any photos sent before it)"""
+    import uuid
+
+    photos = user_state.get("photos", []) + file_ids
+    if len(photos) > COLLAGE_MAX_PHOTOS:
+        await send_telegram_message(bot_token, chat_id, f"⚠️ В коллаж помещается до {COLLAGE_MAX_PHOTOS} фото, использую первые {COLLAGE_MAX_PHOTOS} из {len(photos)}.")
+        photos = photos[:COLLAGE_MAX_PHOTOS]
+    await send_telegram_message(bot_token, chat_id, f"🔄 *Создаю коллаж из {len(photos)} фото...*\n\nПодождите немного!", "Markdown")
+
+    unique_id = str(uuid.uuid4())
+    input_paths = await download_telegram_photos(bot_token, photos, unique_id, "collage")
+    if not input_paths:
+        await send_telegram_message(bot_token, chat_id, "❌ Ошибка загрузки фотографий.")
+        return
+
+    try:
+        from image_processor import ImageProcessor
+        processor = ImageProcessor()
+        result_path = await processor.create_collage(input_paths, "grid", "", unique_id)
+        await send_telegram_photo(bot_token, chat_id, result_path, f"✅ *Коллаж готов!*\n\nИспользовано фото: {len(input_paths)}")
+    finally:
+        for path in input_paths:
+            try:
+                os.remove(path)
+            except:
+                pass
+
+    user_state.clear()
+
+async def process_person_swap_album(bot_token, chat_id, file_ids, user_state):
+    """Album in the person step collects all people, in the background step runs one M×N job"""
+    if user_state.get("step", "person") == "person":
+        user_state["person_file_ids"] = file_ids
+        user_state["step"] = "background"
+        await send_telegram_message(bot_token, chat_id, f"✅ *Получено фото людей: {len(file_ids)}*\n\nТеперь отправьте фото (или альбом) с желаемым фоном.", "Markdown")
+        return
+
+    person_file_ids = user_state.get("person_file_ids") or [user_state.get("person_file_id")]
+    if not all(person_file_ids):
+        await send_telegram_message(bot_token, chat_id, "❌ Фото человека не найдено. Попробуйте еще раз.")
+        return
+
+    await send_telegram_message(bot_token, chat_id, f"🔄 *Обрабатываю фото...*\n\nВыполняю замену фона: {len(person_file_ids)} × {len(file_ids)}", "Markdown")
+    await run_person_swap_batch(bot_token, chat_id, person_file_ids, file_ids, user_state)
+
+async def run_person_swap_batch(bot_token, chat_id, person_file_ids, background_file_ids, user_state):
+    """Run a single person_swap_separate pipeline for all people × backgrounds and reply once"""
+    import uuid
+
+    unique_id = str(uuid.uuid4())
+    person_paths = await download_telegram_photos(bot_token, person_file_ids, unique_id, "person")
+    background_paths = await download_telegram_photos(bot_token, background_file_ids, unique_id, "background")
+
+    try:
+        if not person_paths or not background_paths:
+            await send_telegram_message(bot_token, chat_id, "❌ Ошибка загрузки фотографий.")
+            return
+
+        from image_processor import ImageProcessor
+        processor = ImageProcessor()
+        result_paths = await processor.person_swap_separate(person_paths, background_paths, unique_id)
+
+        if not result_paths:
+            await send_telegram_message(bot_token, chat_id, "❌ Не удалось выполнить замену фона.")
+        elif len(result_paths) == 1:
+            await send_telegram_photo(bot_token, chat_id, result_paths[0], "✅ *Замена фона выполнена!*\n\nЧеловек успешно перенесен на новый фон.")
+        else:
+            await send_telegram_media_group(bot_token, chat_id, result_paths, f"✅ *Замена фона выполнена!*\n\nСоздано вариантов: {len(result_paths)}")
+    finally:
+        for path in (person_paths or []) + (background_paths or []):
+            try:
+                os.remove(path)
+            except:
+                pass
+        user_state.clear()
+
 async def send_telegram_message(bot_token, chat_id, text, parse_mode=None):
     """Send message to Telegram"""
     import requests
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
     payload = {"chat_id": chat_id, "text": text}
     if parse_mode:
         payload["parse_mode"] = parse_mode
@@ -2013,12 +2405,12 @@ async def download_telegram_photo(bot_token, file_id):
     
     try:
         # Get file path
-        file_url = f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}"
+        file_url = f"{TELEGRAM_API_URL}/bot{bot_token}/getFile?file_id={file_id}"
         response = requests.get(file_url)
         
         if response.status_code == 200:
             file_path = response.json()["result"]["file_path"]
-            photo_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
+            photo_url = f"{TELEGRAM_API_URL}/file/bot{bot_token}/{file_path}"
             return photo_url
         
         return None
@@ -2038,7 +2430,7 @@ async def send_telegram_photo(bot_token, chat_id, photo_path, caption=""):
             await send_telegram_message(bot_token, chat_id, f"❌ Ошибка: обработанный файл не найден")
             return False
             
-        url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+        url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendPhoto"
         
         with open(photo_path, 'rb') as photo:
             files = {'photo': photo}
@@ -2065,11 +2457,55 @@ async def send_telegram_photo(bot_token, chat_id, photo_path, caption=""):
         await send_telegram_message(bot_token, chat_id, f"❌ Ошибка при отправке результата: {str(e)}")
         return False
 
+async def send_telegram_media_group(bot_token, chat_id, photo_paths, caption=""):
+    """Send several photos as albums (Telegram allows 2-10 photos per sendMediaGroup)"""
+    import json
+    import requests
+
+    url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMediaGroup"
+
+    try:
+        for start in range(0, len(photo_paths), 10):
+            chunk = photo_paths[start:start + 10]
+            if len(chunk) == 1:
+                await send_telegram_photo(bot_token, chat_id, chunk[0], caption if start == 0 else "")
+                continue
+
+            media = []
+            files = {}
+            for i, photo_path in enumerate(chunk):
+                item = {"type": "photo", "media": f"attach://photo{i}"}
+                if start == 0 and i == 0 and caption:
+                    item["caption"] = caption
+                    item["parse_mode"] = "Markdown"
+                media.append(item)
+                files[f"photo{i}"] = open(photo_path, 'rb')
+
+            try:
+                data = {"chat_id": chat_id, "media": json.dumps(media)}
+                response = requests.post(url, files=files, data=data, timeout=60)
+            finally:
+                for f in files.values():
+                    f.close()
+
+            if response.status_code != 200:
+                logger.error(f"Failed to send media group: {response.status_code} - {response.text}")
+                await send_telegram_message(bot_token, chat_id, "❌ Ошибка отправки результата. Попробуйте еще раз.")
+                return False
+
+        logger.info(f"Media group with {len(photo_paths)} photos sent to chat {chat_id}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error sending media group: {e}")
+        await send_telegram_message(bot_token, chat_id, f"❌ Ошибка при отправке результата: {str(e)}")
+        return False
+
 async def send_telegram_message_with_keyboard(bot_token, chat_id, text, parse_mode=None, keyboard=None):
     """Send message with inline keyboard to Telegram"""
     import requests
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
     payload = {"chat_id": chat_id, "text": text}
     
     if parse_mode:
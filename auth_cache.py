@@ -0,0 +1,79 @@
+"""
+Cache of verified access tokens for the authentication dependencies.
+
+get_current_user / get_current_user_optional run on every authenticated request,
+uploads included; without a cache each of them decodes the JWT and loads the user
+with a DB round-trip. A verified token is kept here together with its user until
+the earlier of the token's own `exp` and AUTH_CACHE_TTL seconds, so a deleted or
+renamed user stops authenticating within AUTH_CACHE_TTL even if nothing calls
+invalidate_user(). Only successful lookups are cached; invalid tokens and unknown
+users always go through the full check.
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))  # seconds a verified token skips the DB (0 disables)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))  # tokens kept, least recently used evicted first
+
+
+class TokenCache:
+    """LRU of token -> (user, expires_at), bounded by size and by expiry."""
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, token: str, now: float = None):
+        """Cached user of `token`, None when it is unknown or has expired"""
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at = entry
+        if expires_at <= (now or time.time()):
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user, token_expires_at: float, now: float = None):
+        """
+        Remember a verified token until it expires, at most `ttl` seconds.
+
+        Example:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            token_cache.put(token, user, payload["exp"])
+        """
+        if self.ttl <= 0 or self.size <= 0:
+            return
+        expires_at = min(float(token_expires_at), (now or time.time()) + self.ttl)
+        self._entries[token] = (user, expires_at)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        """Drop every token of `username` (call after the user is changed or deleted)"""
+        stale = [token for token, (user, _) in self._entries.items() if user.username == username]
+        for token in stale:
+            del self._entries[token]
+        if stale:
+            logger.info(f"🔑 Dropped {len(stale)} cached tokens of {username}")
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache()
@@ -0,0 +1 @@
+# Benchmark suite for image processors (python -m benchmarks.run)
@@ -0,0 +1,154 @@
+"""
+Benchmark case matrix: which processor runs on which fixtures.
+
+Each processor entry says how to build the processor, how many input images it
+takes and how to call it. A case is one (processor, size, mode, faces) point of
+the matrix; `case_id` is the key used in result files and baselines.
+"""
+from benchmarks.fixtures import FixtureSpec, FIXTURE_SIZES, FIXTURE_MODES
+
+QUICK_SIZES = (0.3, 2)
+DEFAULT_SIZES = (0.3, 2, 12)
+FULL_SIZES = tuple(sorted(FIXTURE_SIZES))
+
+DEFAULT_MODES = ("RGB",)
+FULL_MODES = FIXTURE_MODES
+
+
+def _background_remover():
+    from processors.background_remover import BackgroundRemover
+    return BackgroundRemover()
+
+
+def _smart_cropper():
+    from processors.smart_cropper import SmartCropper
+    return SmartCropper()
+
+
+def _frame_adder():
+    from processors.frame_adder import FrameAdder
+    return FrameAdder()
+
+
+def _collage_maker():
+    from processors.collage_maker import CollageMaker
+    return CollageMaker()
+
+
+def _social_optimizer():
+    from processors.social_optimizer import SocialOptimizer
+    return SocialOptimizer()
+
+
+def _photo_retoucher():
+    from processors.photo_retoucher import PhotoRetoucher
+    return PhotoRetoucher()
+
+
+def _person_swapper():
+    from processors.person_swapper import PersonSwapper
+    return PersonSwapper()
+
+
+# name -> settings. "inputs" are (faces override, seed offset) per input image; None keeps the case value
+PROCESSORS = {
+    "background_remover": {
+        "factory": _background_remover,
+        "call": lambda p, paths, file_id: p.remove_background(paths[0], file_id, "rembg"),
+        "inputs": [(None, 0)],
+        "face_sensitive": True,
+    },
+    "background_remover_lowres": {
+        "factory": _background_remover,
+        "call": lambda p, paths, file_id: p.remove_background(paths[0], file_id, "rembg_lowres"),
+        "inputs": [(None, 0)],
+        "face_sensitive": True,
+    },
+    "smart_cropper": {
+        "factory": _smart_cropper,
+        "call": lambda p, paths, file_id: p.smart_crop(paths[0], "1:1", file_id),
+        "inputs": [(None, 0)],
+        "face_sensitive": True,
+    },
+    "frame_adder": {
+        "factory": _frame_adder,
+        "call": lambda p, paths, file_id: p.add_frame(paths[0], "classic", file_id),
+        "inputs": [(None, 0)],
+        "face_sensitive": False,
+    },
+    "collage_maker": {
+        "factory": _collage_maker,
+        "call": lambda p, paths, file_id: p.create_collage(paths, "grid", "Benchmark", file_id),
+        "inputs": [(None, 0), (None, 1), (None, 2), (None, 3)],
+        "face_sensitive": False,
+    },
+    "social_optimizer": {
+        "factory": _social_optimizer,
+        "call": lambda p, paths, file_id: p.optimize_for_social_media(paths[0], file_id),
+        "inputs": [(None, 0)],
+        "face_sensitive": False,
+    },
+    "photo_retoucher": {
+        "factory": _photo_retoucher,
+        "call": lambda p, paths, file_id: p.retouch_image(paths[0], file_id),
+        "inputs": [(None, 0)],
+        "face_sensitive": True,
+    },
+    "person_swapper": {
+        "factory": _person_swapper,
+        # One person onto two plain backgrounds, the common Telegram flow
+        "call": lambda p, paths, file_id: p.person_swap_separate(paths[:1], paths[1:], file_id),
+        "inputs": [(True, 0), (False, 1), (False, 2)],
+        "face_sensitive": False,
+    },
+}
+
+
+class BenchmarkCase:
+    """One point of the benchmark matrix."""
+
+    def __init__(self, processor: str, megapixels: float, mode: str, faces: bool):
+        self.processor = processor
+        self.megapixels = megapixels
+        self.mode = mode
+        self.faces = faces
+
+    @property
+    def case_id(self) -> str:
+        kind = "faces" if self.faces else "plain"
+        return f"{self.processor}/{self.megapixels}mp/{self.mode}/{kind}"
+
+    def fixture_specs(self) -> list:
+        specs = []
+        for faces, seed in PROCESSORS[self.processor]["inputs"]:
+            specs.append(FixtureSpec(self.megapixels, self.mode, self.faces if faces is None else faces, seed))
+        return specs
+
+    def to_dict(self) -> dict:
+        return {"processor": self.processor, "megapixels": self.megapixels, "mode": self.mode, "faces": self.faces}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BenchmarkCase":
+        return cls(data["processor"], data["megapixels"], data["mode"], data["faces"])
+
+
+def build_cases(processors=None, sizes=DEFAULT_SIZES, modes=DEFAULT_MODES) -> list:
+    """
+    Expand the matrix for the selected processors.
+
+    Face-sensitive processors (face detection, segmentation) run on fixtures with
+    and without faces; the rest only on fixtures with faces.
+    """
+    selected = processors or list(PROCESSORS)
+    unknown = [name for name in selected if name not in PROCESSORS]
+    if unknown:
+        raise ValueError(f"Unknown processors: {', '.join(unknown)}. Available: {', '.join(PROCESSORS)}")
+
+    cases = []
+    for name in selected:
+        variants = (True, False) if PROCESSORS[name]["face_sensitive"] else (True,)
+        for megapixels in sizes:
+            for mode in modes:
+                for faces in variants:
+                    cases.append(BenchmarkCase(name, megapixels, mode, faces))
+    return cases
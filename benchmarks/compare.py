@@ -0,0 +1,144 @@
+"""
+Compare a benchmark result file against the stored baseline and flag regressions.
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/bench-20250101-120000.json
+    python -m benchmarks.compare current.json --baseline other.json --threshold 0.10
+
+Exit code is 1 when at least one case regressed, so the command can gate CI.
+"""
+import os
+import sys
+import json
+import argparse
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Relative slowdown / memory growth tolerated before a case is flagged
+LATENCY_THRESHOLD = 0.15
+RSS_THRESHOLD = 0.20
+# Absolute floors so millisecond jitter on tiny fixtures is not reported as a regression
+MIN_LATENCY_DELTA = 0.005
+MIN_RSS_DELTA_MB = 16
+
+# Environment keys that make latency numbers incomparable when they differ
+ENVIRONMENT_KEYS = ("machine", "cpu_count", "python", "pillow", "numpy", "opencv", "onnxruntime")
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def environment_differences(current: dict, baseline: dict) -> list:
+    current_env = current.get("environment", {})
+    baseline_env = baseline.get("environment", {})
+    return [
+        f"{key}: baseline {baseline_env.get(key)} -> current {current_env.get(key)}"
+        for key in ENVIRONMENT_KEYS
+        if current_env.get(key) != baseline_env.get(key)
+    ]
+
+
+def _relative_change(current: float, baseline: float) -> float:
+    return (current - baseline) / baseline if baseline else 0.0
+
+
+def compare_case(case_id: str, current: dict, baseline: dict, latency_threshold: float = LATENCY_THRESHOLD,
+                 rss_threshold: float = RSS_THRESHOLD) -> dict:
+    """
+    Compare one case. Verdicts: ok, regression, improved, new, error, input-changed.
+
+    Latency uses the median of the measured iterations; memory uses peak RSS of the
+    isolated worker process.
+    """
+    row = {"case_id": case_id, "verdict": "ok", "latency_change": None, "rss_change": None, "notes": []}
+
+    if current.get("status") != "ok":
+        row["notes"].append(current.get("error", "failed"))
+        row["verdict"] = "regression" if baseline and baseline.get("status") == "ok" else "error"
+        return row
+    if not baseline or baseline.get("status") != "ok":
+        row["verdict"] = "new"
+        return row
+    if current.get("fixtures") != baseline.get("fixtures"):
+        row["verdict"] = "input-changed"
+        row["notes"].append("fixture bytes differ from baseline (Pillow/numpy version or FIXTURE_VERSION changed)")
+        return row
+
+    current_latency = current["latency_s"]["median"]
+    baseline_latency = baseline["latency_s"]["median"]
+    row["latency_change"] = _relative_change(current_latency, baseline_latency)
+    latency_delta = current_latency - baseline_latency
+
+    if row["latency_change"] > latency_threshold and latency_delta > MIN_LATENCY_DELTA:
+        row["verdict"] = "regression"
+        row["notes"].append(f"median {baseline_latency:.3f}s -> {current_latency:.3f}s")
+    elif row["latency_change"] < -latency_threshold and -latency_delta > MIN_LATENCY_DELTA:
+        row["verdict"] = "improved"
+
+    current_rss = current.get("peak_rss_mb")
+    baseline_rss = baseline.get("peak_rss_mb")
+    if current_rss and baseline_rss:
+        row["rss_change"] = _relative_change(current_rss, baseline_rss)
+        if row["rss_change"] > rss_threshold and current_rss - baseline_rss > MIN_RSS_DELTA_MB:
+            row["verdict"] = "regression"
+            row["notes"].append(f"peak RSS {baseline_rss:.0f} MB -> {current_rss:.0f} MB")
+
+    return row
+
+
+def compare_results(current: dict, baseline: dict, latency_threshold: float = LATENCY_THRESHOLD,
+                    rss_threshold: float = RSS_THRESHOLD) -> list:
+    baseline_cases = baseline.get("cases", {})
+    return [
+        compare_case(case_id, case, baseline_cases.get(case_id), latency_threshold, rss_threshold)
+        for case_id, case in current.get("cases", {}).items()
+    ]
+
+
+def _format_change(change) -> str:
+    return "-" if change is None else f"{change * 100:+.1f}%"
+
+
+def format_report(rows: list, warnings: list = ()) -> str:
+    lines = []
+    for warning in warnings:
+        lines.append(f"⚠️ Environment differs from baseline, {warning}")
+    width = max([len(row["case_id"]) for row in rows] + [4])
+    lines.append(f"{'case'.ljust(width)}  {'verdict':<13} {'latency':>9} {'rss':>9}  notes")
+    for row in rows:
+        lines.append(
+            f"{row['case_id'].ljust(width)}  {row['verdict']:<13} {_format_change(row['latency_change']):>9} "
+            f"{_format_change(row['rss_change']):>9}  {'; '.join(row['notes'])}"
+        )
+    regressions = sum(1 for row in rows if row["verdict"] == "regression")
+    lines.append(f"{len(rows)} cases, {regressions} regression(s)")
+    return "\n".join(lines)
+
+
+def has_regressions(rows: list) -> bool:
+    return any(row["verdict"] == "regression" for row in rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare benchmark results with the baseline")
+    parser.add_argument("results", help="Result JSON written by python -m benchmarks.run")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON (default: benchmarks/baseline.json)")
+    parser.add_argument("--threshold", type=float, default=LATENCY_THRESHOLD, help="Tolerated median slowdown, 0.15 = 15%%")
+    parser.add_argument("--rss-threshold", type=float, default=RSS_THRESHOLD, help="Tolerated peak RSS growth")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with python -m benchmarks.run --save-baseline")
+        return 0
+
+    current = load_results(args.results)
+    baseline = load_results(args.baseline)
+    rows = compare_results(current, baseline, args.threshold, args.rss_threshold)
+    print(format_report(rows, environment_differences(current, baseline)))
+    return 1 if has_regressions(rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Encode time vs output bytes for every encoder profile (processors/encoding.py).
+
+Each fixture is encoded to memory as JPEG, PNG, WebP and AVIF (when the local
+Pillow supports them) with every profile, plus the settings processors used
+before the profiles existed ("legacy": JPEG quality 90 + optimize, PNG optimize)
+for reference.
+
+Usage:
+    python -m benchmarks.encoders                       # 2 and 12 MP, all profiles and formats
+    python -m benchmarks.encoders --sizes 24 --formats JPEG --repeat 5
+    python -m benchmarks.encoders --output benchmarks/results/encoders.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from PIL import Image
+
+from benchmarks.fixtures import FixtureSpec, ensure_fixture
+from benchmarks.run import _parse_sizes
+from processors.encoding import PROFILES, is_supported
+
+FORMATS = ("JPEG", "PNG", "WEBP", "AVIF")
+LEGACY_OPTIONS = {
+    "JPEG": {"quality": 90, "optimize": True},
+    "PNG": {"optimize": True},
+    "WEBP": {},
+    "AVIF": {},
+}
+
+
+def encode(img: Image.Image, format: str, options: dict, repeat: int):
+    """(median seconds, bytes) of encoding `img` to memory"""
+    samples, size = [], 0
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        img.save(buffer, format, **options)
+        samples.append(time.perf_counter() - started)
+        size = buffer.tell()
+    return statistics.median(samples), size
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark encoder profiles: encode time vs bytes")
+    parser.add_argument("--sizes", type=_parse_sizes, default=(2, 12), help="Comma separated megapixel sizes")
+    parser.add_argument("--formats", type=lambda value: tuple(value.upper().split(",")), default=FORMATS,
+                        help="Comma separated formats (JPEG,PNG,WEBP,AVIF)")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured encodes per point")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    formats = [f for f in args.formats if is_supported(f)]
+    profiles = {name: profile.save_options for name, profile in PROFILES.items()}
+    profiles["legacy"] = LEGACY_OPTIONS.get
+
+    print(f"{'format':<6} {'MP':>5} {'profile':<9} {'median s':>9} {'MB':>8} {'MP/s':>7} {'vs balanced':>14}")
+    results = []
+    for megapixels in args.sizes:
+        img = Image.open(ensure_fixture(FixtureSpec(megapixels, "RGB", True)))
+        img.load()
+        pixels = img.size[0] * img.size[1] / 1e6
+        for format in formats:
+            rows = {name: encode(img, format, options(format), args.repeat) for name, options in profiles.items()}
+            base_time, base_bytes = rows["balanced"]
+            for name, (seconds, size) in rows.items():
+                results.append({"format": format, "megapixels": megapixels, "profile": name,
+                                "median_s": round(seconds, 5), "bytes": size})
+                print(f"{format:<6} {megapixels:>5} {name:<9} {seconds:>9.4f} {size / 1e6:>8.2f} {pixels / seconds:>7.1f} "
+                      f"{seconds / base_time:>6.2f}x {size / base_bytes:>6.0%}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
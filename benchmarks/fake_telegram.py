@@ -0,0 +1,154 @@
+"""
+Local stand-in for the Telegram Bot API, used to load-test the /webhook paths.
+
+Implements just what app.py calls: sendMessage, sendPhoto, sendMediaGroup,
+answerCallbackQuery, getFile and file downloads (every file_id resolves to the
+same synthetic photo). Optional latency emulates the round trip to Telegram.
+
+Usage:
+    python -m benchmarks.fake_telegram --port 8081 --latency 0.05
+    TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=loadtest-token python main.py
+"""
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+METHOD_PATTERN = re.compile(r"^/bot(?P<token>[^/]+)/(?P<method>\w+)$")
+FILE_PATTERN = re.compile(r"^/file/bot(?P<token>[^/]+)/(?P<path>.+)$")
+
+
+class FakeTelegramServer:
+    """Threaded HTTP server answering Bot API calls; counts calls per method."""
+
+    def __init__(self, photo_bytes: bytes, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.photo_bytes = photo_bytes
+        self.latency = latency
+        self.calls = {}
+        self.bytes_received = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self)
+
+            def do_POST(self):
+                server._handle(self)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegramServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _record(self, method: str, size: int) -> int:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.bytes_received += size
+            self._message_id += 1
+            return self._message_id
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        parts = urlsplit(handler.path)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        file_match = FILE_PATTERN.match(parts.path)
+        if file_match and handler.command == "GET":
+            self._record("downloadFile", len(body))
+            self._send(handler, 200, self.photo_bytes, "image/jpeg")
+            return
+
+        method_match = METHOD_PATTERN.match(parts.path)
+        if not method_match:
+            self._send_json(handler, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        method = method_match.group("method")
+        message_id = self._record(method, len(body))
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if body and handler.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                params.update(json.loads(body))
+            except ValueError:
+                pass
+
+        if method == "getFile":
+            file_id = params.get("file_id", "unknown")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.photo_bytes),
+                      "file_path": f"photos/{file_id}.jpg"}
+        elif method == "answerCallbackQuery":
+            result = True
+        elif method == "sendMediaGroup":
+            result = [{"message_id": message_id, "date": int(time.time())}]
+        else:
+            result = {"message_id": message_id, "date": int(time.time()), "chat": {"id": params.get("chat_id")}}
+        self._send_json(handler, 200, {"ok": True, "result": result})
+
+    def _send_json(self, handler, status: int, payload: dict):
+        self._send(handler, status, json.dumps(payload).encode(), "application/json")
+
+    def _send(self, handler, status: int, body: bytes, content_type: str):
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def main(argv=None) -> int:
+    from benchmarks.fixtures import FixtureSpec, ensure_fixture
+
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call")
+    parser.add_argument("--photo-mp", type=lambda value: float(value) if "." in value else int(value), default=2,
+                        help="Megapixels of the photo served for every file_id")
+    args = parser.parse_args(argv)
+
+    with open(ensure_fixture(FixtureSpec(args.photo_mp, "RGB", True)), "rb") as f:
+        photo_bytes = f.read()
+
+    server = FakeTelegramServer(photo_bytes, args.host, args.port, args.latency)
+    print(f"🤖 Fake Telegram API listening on {server.url}")
+    print(f"   Start the app with TELEGRAM_API_URL={server.url} TELEGRAM_BOT_TOKEN=loadtest-token")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"📊 Calls: {json.dumps(server.calls, sort_keys=True)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Deterministic synthetic fixtures for the benchmark suite.
+
+Images are generated from a seed (gradient background, geometric clutter, optional
+face-like figures, sensor-like noise) and cached under benchmarks/.fixtures/, so
+every run and every machine benchmarks byte-identical inputs for the same
+Pillow/numpy versions. Nothing is downloaded and no real photos are committed.
+"""
+import os
+import random
+import hashlib
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fixtures")
+
+# Bump when the generator changes so cached files are regenerated and baselines stop matching
+FIXTURE_VERSION = 1
+
+# Nominal megapixels -> (width, height), 4:3 like most camera output
+FIXTURE_SIZES = {
+    0.3: (640, 480),
+    2: (1600, 1200),
+    12: (4000, 3000),
+    24: (5664, 4248),
+    48: (8000, 6000),
+}
+
+FIXTURE_MODES = ("RGB", "RGBA", "P", "L")
+
+SKIN_TONES = [(241, 194, 167), (224, 172, 105), (198, 134, 66), (141, 85, 36), (255, 219, 172)]
+NOISE_BAND_ROWS = 256
+
+
+class FixtureSpec:
+    """Parameters that fully determine one synthetic image."""
+
+    def __init__(self, megapixels: float, mode: str = "RGB", faces: bool = True, seed: int = 0):
+        if megapixels not in FIXTURE_SIZES:
+            raise ValueError(f"Unsupported fixture size {megapixels} MP, expected one of {sorted(FIXTURE_SIZES)}")
+        if mode not in FIXTURE_MODES:
+            raise ValueError(f"Unsupported fixture mode {mode}, expected one of {FIXTURE_MODES}")
+        self.megapixels = megapixels
+        self.mode = mode
+        self.faces = faces
+        self.seed = seed
+
+    @property
+    def size(self) -> tuple:
+        return FIXTURE_SIZES[self.megapixels]
+
+    @property
+    def name(self) -> str:
+        kind = "faces" if self.faces else "plain"
+        return f"v{FIXTURE_VERSION}_{self.megapixels}mp_{self.mode}_{kind}_s{self.seed}"
+
+    @property
+    def extension(self) -> str:
+        # JPEG for what cameras produce, PNG where JPEG cannot hold the mode
+        return "jpg" if self.mode in ("RGB", "L") else "png"
+
+    @property
+    def path(self) -> str:
+        return os.path.join(FIXTURES_DIR, f"{self.name}.{self.extension}")
+
+
+def _draw_background(rng: np.random.Generator, size: tuple) -> Image.Image:
+    """Smooth colour field: random low-resolution colours upscaled bicubically"""
+    width, height = size
+    coarse = rng.integers(30, 226, size=(6, 8, 3), dtype=np.uint8)
+    return Image.fromarray(coarse, "RGB").resize((width, height), Image.Resampling.BICUBIC)
+
+
+def _draw_clutter(draw: ImageDraw.ImageDraw, prng: random.Random, size: tuple):
+    """Rectangles, ellipses and lines that give edge detectors and contrast maps something to find"""
+    width, height = size
+    scale = min(width, height)
+    for _ in range(24):
+        x0, y0 = prng.randrange(width), prng.randrange(height)
+        w, h = prng.randint(scale // 20, scale // 4), prng.randint(scale // 20, scale // 4)
+        color = tuple(prng.randrange(256) for _ in range(3))
+        if prng.random() < 0.5:
+            draw.rectangle([x0, y0, x0 + w, y0 + h], fill=color)
+        else:
+            draw.ellipse([x0, y0, x0 + w, y0 + h], fill=color)
+    for _ in range(12):
+        points = [(prng.randrange(width), prng.randrange(height)) for _ in range(2)]
+        draw.line(points, fill=tuple(prng.randrange(256) for _ in range(3)), width=max(1, scale // 300))
+
+
+def _draw_person(draw: ImageDraw.ImageDraw, prng: random.Random, center_x: int, head_top: int, head_height: int):
+    """Frontal face-like figure (head, hair, eyes, brows, nose, mouth) on a torso"""
+    head_width = int(head_height * 0.75)
+    skin = prng.choice(SKIN_TONES)
+    hair = tuple(prng.randint(10, 90) for _ in range(3))
+    shirt = tuple(prng.randrange(256) for _ in range(3))
+
+    left, right = center_x - head_width // 2, center_x + head_width // 2
+    bottom = head_top + head_height
+
+    # Torso and neck first so the head overlaps them
+    draw.rectangle([center_x - head_width // 5, bottom - head_height // 10, center_x + head_width // 5, bottom + head_height // 4], fill=skin)
+    draw.pieslice([center_x - head_width * 1.4, bottom + head_height // 5, center_x + head_width * 1.4, bottom + head_height * 3],
+                  180, 360, fill=shirt)
+
+    draw.ellipse([left - head_width // 12, head_top - head_height // 12, right + head_width // 12, head_top + head_height // 2], fill=hair)
+    draw.ellipse([left, head_top, right, bottom], fill=skin)
+
+    eye_y = head_top + int(head_height * 0.42)
+    eye_w, eye_h = head_width // 6, head_height // 14
+    for eye_x in (center_x - head_width // 4, center_x + head_width // 4):
+        draw.ellipse([eye_x - eye_w // 2, eye_y - eye_h // 2, eye_x + eye_w // 2, eye_y + eye_h // 2], fill=(250, 250, 250))
+        draw.ellipse([eye_x - eye_h // 2, eye_y - eye_h // 2, eye_x + eye_h // 2, eye_y + eye_h // 2], fill=(40, 30, 20))
+        draw.line([eye_x - eye_w // 2, eye_y - eye_h * 2, eye_x + eye_w // 2, eye_y - eye_h * 2], fill=hair, width=max(1, eye_h // 2))
+
+    nose_y = head_top + int(head_height * 0.62)
+    shadow = tuple(max(0, c - 50) for c in skin)
+    draw.line([center_x, eye_y + eye_h, center_x, nose_y], fill=shadow, width=max(1, head_width // 40))
+
+    mouth_y = head_top + int(head_height * 0.78)
+    draw.chord([center_x - head_width // 5, mouth_y - head_height // 20, center_x + head_width // 5, mouth_y + head_height // 20],
+               0, 180, fill=(150, 40, 50))
+
+
+def _add_noise(img: Image.Image, rng: np.random.Generator, amplitude: int = 8) -> Image.Image:
+    """Add seeded grain in row bands to keep peak memory low on 48 MP fixtures"""
+    pixels = np.asarray(img).copy()
+    for top in range(0, pixels.shape[0], NOISE_BAND_ROWS):
+        band = pixels[top:top + NOISE_BAND_ROWS].astype(np.int16)
+        band += rng.integers(-amplitude, amplitude + 1, size=band.shape[:2] + (1,), dtype=np.int16)
+        pixels[top:top + NOISE_BAND_ROWS] = np.clip(band, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, img.mode)
+
+
+def _to_mode(img: Image.Image, mode: str) -> Image.Image:
+    if mode == "RGB":
+        return img
+    if mode == "L":
+        return img.convert("L")
+    if mode == "P":
+        return img.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    # RGBA: opaque centre fading to semi-transparent corners, like a cut-out sticker
+    width, height = img.size
+    alpha = Image.new("L", (64, 48), 96)
+    ImageDraw.Draw(alpha).ellipse([4, 3, 60, 45], fill=255)
+    rgba = img.convert("RGBA")
+    rgba.putalpha(alpha.resize((width, height), Image.Resampling.BILINEAR))
+    return rgba
+
+
+def generate(spec: FixtureSpec) -> Image.Image:
+    """Render the image described by `spec` (same spec -> same pixels)"""
+    rng = np.random.default_rng([FIXTURE_VERSION, spec.seed, int(spec.megapixels * 10)])
+    prng = random.Random(f"{FIXTURE_VERSION}-{spec.seed}-{spec.megapixels}")
+
+    img = _draw_background(rng, spec.size)
+    draw = ImageDraw.Draw(img)
+    _draw_clutter(draw, prng, spec.size)
+
+    if spec.faces:
+        width, height = spec.size
+        people = prng.randint(1, 3)
+        for index in range(people):
+            head_height = int(height * prng.uniform(0.18, 0.3))
+            center_x = int(width * (index + 1) / (people + 1))
+            head_top = int(height * prng.uniform(0.12, 0.3))
+            _draw_person(draw, prng, center_x, head_top, head_height)
+
+    img = _add_noise(img, rng)
+    return _to_mode(img, spec.mode)
+
+
+def ensure_fixture(spec: FixtureSpec) -> str:
+    """Return the path of the cached fixture, generating it on first use"""
+    if not os.path.exists(spec.path):
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        img = generate(spec)
+        tmp_path = f"{spec.path}.tmp"
+        if spec.extension == "jpg":
+            img.save(tmp_path, "JPEG", quality=92)
+        else:
+            img.save(tmp_path, "PNG", compress_level=1)
+        os.replace(tmp_path, spec.path)
+    return spec.path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
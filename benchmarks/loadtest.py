@@ -0,0 +1,385 @@
+"""
+End-to-end HTTP load test of the FastAPI app with a fake Telegram Bot API.
+
+Drives a weighted mix of /api/remove-background, /api/smart-crop,
+/api/create-collage and /webhook traffic (realistic bot flows: /start, button
+press, photo upload) and reports throughput, p50/p95/p99 latency, error rate and
+event-loop lag per endpoint.
+
+In-process mode (default) runs the app on this event loop through httpx's ASGI
+transport, so the lag probe measures the app's own loop: a blocking call in a
+handler shows up as lag attributed to the endpoints in flight at that moment.
+With --url the app runs elsewhere (uvicorn/gunicorn) and lag is client-side only.
+
+Usage:
+    python -m benchmarks.loadtest --duration 30 --concurrency 8
+    python -m benchmarks.loadtest --rate 5 --duration 60 --mix smart-crop=3,webhook=2
+    python -m benchmarks.loadtest --url http://localhost:5000 --telegram-port 8081
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from datetime import datetime, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import httpx
+
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.fixtures import FixtureSpec, ensure_fixture
+from benchmarks.run import percentile, describe_environment
+
+BOT_TOKEN = "loadtest-token"
+DEFAULT_MIX = "smart-crop=4,remove-background=2,create-collage=1,webhook=3"
+# Weights of bot conversations inside the webhook share of the mix
+WEBHOOK_FLOWS = {"start": 3, "retouch": 2, "smart_crop": 2, "remove_bg": 1}
+LAG_PROBE_INTERVAL = 0.01
+REQUEST_TIMEOUT = 300
+
+
+class EndpointStats:
+    """Latencies, errors and loop lag observed while requests of one endpoint were in flight."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        self.loop_lag = []
+
+    def summary(self, elapsed: float) -> dict:
+        count = len(self.latencies)
+        result = {
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "throughput_rps": count / elapsed if elapsed else 0.0,
+            "statuses": self.statuses,
+        }
+        if count:
+            result["latency_ms"] = {
+                "p50": percentile(self.latencies, 0.50) * 1000,
+                "p95": percentile(self.latencies, 0.95) * 1000,
+                "p99": percentile(self.latencies, 0.99) * 1000,
+                "max": max(self.latencies) * 1000,
+            }
+        if self.loop_lag:
+            result["loop_lag_ms"] = {"p99": percentile(self.loop_lag, 0.99) * 1000, "max": max(self.loop_lag) * 1000}
+        return result
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}'. Available: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("Scenario mix has no positive weights")
+    return mix
+
+
+class LoadTest:
+    """Issues scenario requests through one httpx client and aggregates per-endpoint stats."""
+
+    def __init__(self, client: httpx.AsyncClient, mix: dict, photo_bytes: bytes, seed: int = 0):
+        self.client = client
+        self.mix = mix
+        self.photo_bytes = photo_bytes
+        self.random = random.Random(seed)
+        self.stats = {}
+        self.in_flight = {}
+        self.loop_lag = []
+        self.dropped = 0
+        self._ids = itertools.count(1_000_000)
+
+    def _photo(self, name: str = "photo.jpg") -> tuple:
+        return (name, self.photo_bytes, "image/jpeg")
+
+    async def request(self, label: str, method: str, url: str, started_at: float = None, **kwargs) -> httpx.Response:
+        """
+        Send one request and record it under `label`.
+
+        `started_at` lets open-loop arrivals count the time they waited for the
+        (possibly blocked) event loop, avoiding coordinated omission.
+        """
+        stats = self.stats.setdefault(label, EndpointStats())
+        self.in_flight[label] = self.in_flight.get(label, 0) + 1
+        start_time = started_at if started_at is not None else time.perf_counter()
+        ok = False
+        response = None
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            stats.statuses[str(response.status_code)] = stats.statuses.get(str(response.status_code), 0) + 1
+            ok = response.status_code < 400
+            if ok and label.startswith("webhook"):
+                # The webhook answers 200 even when it failed, with {"status": "error"}
+                ok = response.json().get("status") != "error"
+        except (httpx.HTTPError, ValueError) as e:
+            stats.statuses[type(e).__name__] = stats.statuses.get(type(e).__name__, 0) + 1
+        finally:
+            stats.latencies.append(time.perf_counter() - start_time)
+            self.in_flight[label] -= 1
+        if not ok:
+            stats.errors += 1
+        return response
+
+    # Scenarios ---------------------------------------------------------------
+
+    async def remove_background(self, started_at: float):
+        await self.request("POST /api/remove-background", "POST", "/api/remove-background", started_at,
+                           files={"file": self._photo()}, data={"method": "rembg"})
+
+    async def smart_crop(self, started_at: float):
+        aspect_ratio = self.random.choice(["1:1", "16:9", "4:3", "3:4"])
+        await self.request("POST /api/smart-crop", "POST", "/api/smart-crop", started_at,
+                           files={"file": self._photo()}, data={"aspect_ratio": aspect_ratio})
+
+    async def create_collage(self, started_at: float):
+        collage_type, count = self.random.choice([("polaroid", 1), ("5x5", 2), ("5x15", 3)])
+        files = [("files", self._photo(f"photo{i}.jpg")) for i in range(count)]
+        await self.request("POST /api/create-collage", "POST", "/api/create-collage", started_at,
+                           files=files, data={"collage_type": collage_type, "caption": "Load test"})
+
+    async def webhook(self, started_at: float):
+        flow = self.random.choices(list(WEBHOOK_FLOWS), weights=list(WEBHOOK_FLOWS.values()))[0]
+        user_id = next(self._ids)
+
+        if flow == "start":
+            await self._send_update("webhook:text", self._text_update(user_id, "/start"), started_at)
+            return
+
+        await self._send_update("webhook:callback", self._callback_update(user_id, flow), started_at)
+        await self._send_update("webhook:photo", self._photo_update(user_id))
+        if flow == "smart_crop":
+            await self._send_update("webhook:callback", self._callback_update(user_id, "aspect_1x1"))
+
+    async def _send_update(self, label: str, update: dict, started_at: float = None):
+        await self.request(label, "POST", "/webhook", started_at, json=update)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"loadtest_{user_id}"}
+
+    def _text_update(self, user_id: int, text: str) -> dict:
+        return {"update_id": next(self._ids), "message": {
+            "message_id": next(self._ids), "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id), "text": text,
+        }}
+
+    def _callback_update(self, user_id: int, data: str) -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "from": self._user(user_id), "data": data,
+            "message": {"message_id": next(self._ids), "chat": {"id": user_id, "type": "private"}},
+        }}
+
+    def _photo_update(self, user_id: int) -> dict:
+        file_id = f"loadtest-photo-{next(self._ids)}"
+        return {"update_id": next(self._ids), "message": {
+            "message_id": next(self._ids), "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1600, "height": 1200}],
+        }}
+
+    # Load models -------------------------------------------------------------
+
+    def _pick_scenario(self):
+        name = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        return getattr(self, SCENARIOS[name])
+
+    async def monitor_loop_lag(self, stop: asyncio.Event):
+        """Sleep in short ticks; the overshoot of every tick is time the loop was blocked"""
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = max(0.0, loop.time() - start - LAG_PROBE_INTERVAL)
+            self.loop_lag.append(lag)
+            for label, count in self.in_flight.items():
+                if count:
+                    self.stats[label].loop_lag.append(lag)
+
+    async def run_closed(self, concurrency: int, duration: float):
+        """`concurrency` virtual users, each sending its next scenario as soon as the previous finished"""
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < deadline:
+                await self._pick_scenario()(time.perf_counter())
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+
+    async def run_open(self, rate: float, duration: float, max_in_flight: int):
+        """Poisson arrivals at `rate` scenarios/s; arrivals beyond `max_in_flight` are dropped and counted"""
+        loop = asyncio.get_running_loop()
+        deadline = time.perf_counter() + duration
+        tasks = set()
+        next_arrival = time.perf_counter()
+
+        while next_arrival < deadline:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= max_in_flight:
+                self.dropped += 1
+            else:
+                task = loop.create_task(self._pick_scenario()(next_arrival))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            next_arrival += self.random.expovariate(rate)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {label: stats.summary(elapsed) for label, stats in sorted(self.stats.items())}
+        total = EndpointStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+        overall = total.summary(elapsed)
+        overall.pop("statuses")
+        if self.loop_lag:
+            overall["loop_lag_ms"] = {
+                "p50": percentile(self.loop_lag, 0.50) * 1000,
+                "p99": percentile(self.loop_lag, 0.99) * 1000,
+                "max": max(self.loop_lag) * 1000,
+            }
+        overall["dropped_arrivals"] = self.dropped
+        return {"elapsed_s": elapsed, "overall": overall, "endpoints": endpoints}
+
+
+SCENARIOS = {
+    "remove-background": "remove_background",
+    "smart-crop": "smart_crop",
+    "create-collage": "create_collage",
+    "webhook": "webhook",
+}
+
+
+def format_report(report: dict) -> str:
+    def fmt(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    header = f"{'endpoint':<30} {'reqs':>6} {'rps':>7} {'err%':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'lag99':>7} {'lagmax':>7}"
+    lines = [header, "-" * len(header)]
+    rows = list(report["endpoints"].items()) + [("TOTAL", report["overall"])]
+    for label, row in rows:
+        latency = row.get("latency_ms", {})
+        lag = row.get("loop_lag_ms", {})
+        lines.append(
+            f"{label:<30} {row['requests']:>6} {row['throughput_rps']:>7.2f} {row['error_rate'] * 100:>6.1f} "
+            f"{fmt(latency.get('p50')):>7} {fmt(latency.get('p95')):>7} {fmt(latency.get('p99')):>7} "
+            f"{fmt(latency.get('max')):>7} {fmt(lag.get('p99')):>7} {fmt(lag.get('max')):>7}"
+        )
+    lines.append("latency and loop lag in ms; lag columns = event-loop lag sampled while the endpoint was in flight")
+    if report["overall"].get("dropped_arrivals"):
+        lines.append(f"⚠️ {report['overall']['dropped_arrivals']} arrivals dropped: --concurrency cap reached")
+    return "\n".join(lines)
+
+
+def _snapshot(directories) -> set:
+    # Results are sharded (processed/ab/cd/name); hidden files (the storage index) are left alone
+    return {os.path.join(root, name) for d in directories for root, dirs, files in os.walk(d)
+            for name in files if not name.startswith(".")}
+
+
+async def _run(args, photo_bytes: bytes, telegram: FakeTelegramServer) -> dict:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=REQUEST_TIMEOUT)
+    else:
+        # The app reads these at import time
+        os.environ["TELEGRAM_API_URL"] = telegram.url
+        os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        from app import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest",
+                                   timeout=REQUEST_TIMEOUT)
+
+    load_test = LoadTest(client, parse_mix(args.mix), photo_bytes, args.seed)
+    stop = asyncio.Event()
+    monitor = asyncio.get_running_loop().create_task(load_test.monitor_loop_lag(stop))
+    start_time = time.perf_counter()
+    try:
+        if args.rate:
+            await load_test.run_open(args.rate, args.duration, args.concurrency)
+        else:
+            await load_test.run_closed(args.concurrency, args.duration)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        stop.set()
+        await monitor
+        await client.aclose()
+    return load_test.report(elapsed)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="HTTP load test of the photo API and Telegram webhook")
+    parser.add_argument("--url", help="Target a running server instead of the in-process app")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Virtual users (closed loop) or max in-flight scenarios (with --rate)")
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate, scenarios per second")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--image-mp", type=lambda value: float(value) if "." in value else int(value), default=2,
+                        help="Megapixels of uploaded / Telegram photos")
+    parser.add_argument("--telegram-port", type=int, default=0, help="Fake Telegram API port (0 = random)")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Seconds added to every Bot API call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-files", action="store_true", help="Keep uploads/ and processed/ files created by the run")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.chdir(ROOT_DIR)
+    with open(ensure_fixture(FixtureSpec(args.image_mp, "RGB", True)), "rb") as f:
+        photo_bytes = f.read()
+
+    telegram = FakeTelegramServer(photo_bytes, port=args.telegram_port, latency=args.telegram_latency).start()
+    if args.url:
+        print(f"🤖 Fake Telegram API on {telegram.url}; the target server needs "
+              f"TELEGRAM_API_URL={telegram.url} TELEGRAM_BOT_TOKEN={BOT_TOKEN} for webhook traffic")
+
+    created_before = _snapshot(["uploads", "processed"])
+    mode = f"open loop {args.rate}/s" if args.rate else f"closed loop x{args.concurrency}"
+    print(f"🚀 Load test: {mode}, {args.duration:.0f}s, mix {args.mix}, target {args.url or 'in-process app'}")
+    try:
+        report = asyncio.run(_run(args, photo_bytes, telegram))
+    finally:
+        telegram.stop()
+        if not args.url and not args.keep_files:
+            for path in _snapshot(["uploads", "processed"]) - created_before:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    report.update({
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "telegram_calls": telegram.calls,
+        "environment": describe_environment(),
+    })
+    print(format_report(report))
+    print(f"🤖 Telegram API calls: {json.dumps(telegram.calls, sort_keys=True)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"💾 Report saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Edge parity of the low-res guided person mask against rembg's full-resolution mask.
+
+PersonSwapper cuts people out with BackgroundRemover.get_mask: rembg runs on a
+copy downscaled to REMBG_MASK_MAX_SIDE and only the mask is brought back to full
+size with guided_upsample. PERSON_SWAP_FULLRES_MASK=true restores the previous
+path, rembg's own mask of the full image. This script reports how far the two
+masks differ where it matters for a cutout, in a band around the subject's
+outline, plus the time of each path:
+
+    iou         intersection over union of the two masks thresholded at 128
+    edge_mae    mean |low-res - full-res| in the edge band, 0-255
+    edge_p99    99th percentile of that difference
+
+With rembg installed the masks come from the model on the benchmark fixtures (or
+on --images). Without it (--synthetic, also the fallback) the model is simulated:
+a known silhouette is reduced to the 320x320 u2net output and resized back the
+way each path does it, which measures the upsampling alone and also reports the
+error of both paths against the true outline. Exit code 1 when a case misses
+--min-iou or --max-edge-mae.
+
+Usage:
+    python -m benchmarks.mask_parity                          # 2 and 12 MP fixtures
+    python -m benchmarks.mask_parity --images me.jpg,group.jpg --output benchmarks/results/mask_parity.json
+    python -m benchmarks.mask_parity --synthetic --sizes 2,12,24
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from benchmarks.fixtures import FixtureSpec, ensure_fixture
+from benchmarks.run import _parse_sizes
+from processors.background_remover import BackgroundRemover, MASK_MAX_SIDE, guided_upsample, _load_rgb
+
+MODEL_SIDE = 320  # u2net input/output resolution
+EDGE_BAND = 0.01  # half-width of the edge band, fraction of the image's long side
+
+
+def edge_band(mask: np.ndarray) -> np.ndarray:
+    """Pixels within EDGE_BAND of the outline of `mask` (thresholded at 128)"""
+    radius = max(2, round(EDGE_BAND * max(mask.shape)))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    solid = (mask >= 128).astype(np.uint8)
+    return cv2.dilate(solid, kernel) != cv2.erode(solid, kernel)
+
+
+def compare(mask: np.ndarray, reference: np.ndarray) -> dict:
+    """Parity metrics of `mask` against `reference` (both "L" arrays of one size)"""
+    solid, reference_solid = mask >= 128, reference >= 128
+    union = np.count_nonzero(solid | reference_solid)
+    iou = np.count_nonzero(solid & reference_solid) / union if union else 1.0
+    band = edge_band(reference)
+    diff = np.abs(mask.astype(np.int16) - reference.astype(np.int16))[band]
+    return {"iou": round(iou, 4),
+            "edge_mae": round(float(diff.mean()) if diff.size else 0.0, 2),
+            "edge_p99": int(np.percentile(diff, 99)) if diff.size else 0}
+
+
+def silhouette(size: tuple) -> Image.Image:
+    """Anti-aliased head-and-shoulders mask filling most of the frame"""
+    width, height = size
+    scale = 2  # drawn at 2x and reduced for soft, sub-pixel edges
+    mask = Image.new("L", (width * scale, height * scale), 0)
+    w, h = mask.size
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse([w * 0.38, h * 0.12, w * 0.62, h * 0.45], fill=255)                      # head
+    draw.rounded_rectangle([w * 0.22, h * 0.42, w * 0.78, h * 1.05], radius=w // 8, fill=255)  # torso
+    draw.polygon([(w * 0.6, h * 0.5), (w * 0.9, h * 0.2), (w * 0.93, h * 0.24), (w * 0.66, h * 0.6)], fill=255)  # arm
+    return mask.resize(size, Image.Resampling.BOX).filter(ImageFilter.GaussianBlur(0.6))
+
+
+def synthetic_case(megapixels: float) -> dict:
+    """Simulated model output upsampled both ways, against each other and the true outline"""
+    background = _load_rgb(Image.open(ensure_fixture(FixtureSpec(megapixels, "RGB", False))))
+    truth = silhouette(background.size)
+    subject = Image.new("RGB", background.size, (214, 160, 120))
+    img = Image.composite(subject, background, truth)
+    model_mask = truth.resize((MODEL_SIDE, MODEL_SIDE), Image.Resampling.BOX)
+
+    started = time.perf_counter()
+    full_res = np.asarray(model_mask.resize(img.size, Image.Resampling.LANCZOS))  # rembg: mask resized to the input
+    full_res_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scale = MASK_MAX_SIDE / max(img.size)
+    small_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale))) if scale < 1 else img.size
+    small_mask = np.asarray(model_mask.resize(small_size, Image.Resampling.LANCZOS))
+    low_res = small_mask if small_size == img.size else guided_upsample(small_mask, np.asarray(img.convert("L")))
+    low_res_s = time.perf_counter() - started
+
+    truth = np.asarray(truth)
+    return {"full_res_s": round(full_res_s, 4), "low_res_s": round(low_res_s, 4), **compare(low_res, full_res),
+            "full_res_vs_truth": compare(full_res, truth), "low_res_vs_truth": compare(low_res, truth)}
+
+
+def model_case(img: Image.Image) -> dict:
+    """Both get_mask paths on a real image (needs rembg)"""
+    remover = BackgroundRemover()
+    remover._mask_image(img.resize((64, 64)), "warmup")  # model load is not part of either path
+
+    started = time.perf_counter()
+    full_res = np.asarray(remover._mask_image(img, "parity", full_res=True))
+    full_res_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    low_res = np.asarray(remover._mask_image(img, "parity"))
+    low_res_s = time.perf_counter() - started
+    return {"full_res_s": round(full_res_s, 4), "low_res_s": round(low_res_s, 4), **compare(low_res, full_res)}
+
+
+def _rembg_available() -> bool:
+    try:
+        import rembg  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the low-res guided person mask with rembg's full-res mask")
+    parser.add_argument("--sizes", type=_parse_sizes, default=(2, 12), help="Comma separated fixture megapixels")
+    parser.add_argument("--images", help="Comma separated photo paths to use instead of the fixtures (needs rembg)")
+    parser.add_argument("--synthetic", action="store_true", help="Simulate the model instead of running rembg")
+    parser.add_argument("--min-iou", type=float, default=0.98, help="Fail below this IoU")
+    parser.add_argument("--max-edge-mae", type=float, default=16, help="Fail above this mean edge difference (0-255)")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    synthetic = args.synthetic or not _rembg_available()
+    if synthetic and not args.synthetic:
+        print("⚠️ rembg is not installed: simulating the model (--synthetic)")
+    if synthetic and args.images:
+        parser.error("--images needs rembg")
+
+    if args.images:
+        inputs = [(path, lambda path=path: model_case(_load_rgb(path))) for path in args.images.split(",")]
+    elif synthetic:
+        inputs = [(f"{megapixels} MP", lambda megapixels=megapixels: synthetic_case(megapixels))
+                  for megapixels in args.sizes]
+    else:
+        inputs = [(f"{megapixels} MP", lambda megapixels=megapixels: model_case(
+            _load_rgb(Image.open(ensure_fixture(FixtureSpec(megapixels, "RGB", True)))))) for megapixels in args.sizes]
+
+    print(f"🎭 Mask parity, {'simulated model' if synthetic else 'rembg'}, REMBG_MASK_MAX_SIDE={MASK_MAX_SIDE}")
+    print(f"{'input':<24} {'full-res s':>10} {'low-res s':>10} {'iou':>7} {'edge mae':>9} {'edge p99':>9}")
+    results, failed = [], False
+    for name, run in inputs:
+        result = {"input": name, **run()}
+        passed = result["iou"] >= args.min_iou and result["edge_mae"] <= args.max_edge_mae
+        failed = failed or not passed
+        results.append({**result, "passed": passed})
+        print(f"{name:<24} {result['full_res_s']:>10.3f} {result['low_res_s']:>10.3f} {result['iou']:>7.4f} "
+              f"{result['edge_mae']:>9.2f} {result['edge_p99']:>9} {'✅' if passed else '❌'}")
+        if synthetic:
+            for path in ("full_res", "low_res"):
+                truth = result[f"{path}_vs_truth"]
+                print(f"{'  ' + path + ' vs truth':<24} {'':>21} {truth['iou']:>7.4f} {truth['edge_mae']:>9.2f} "
+                      f"{truth['edge_p99']:>9}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"model": "simulated" if synthetic else "rembg", "mask_max_side": MASK_MAX_SIDE,
+                       "min_iou": args.min_iou, "max_edge_mae": args.max_edge_mae, "results": results}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
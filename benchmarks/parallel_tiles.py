@@ -0,0 +1,138 @@
+"""
+Single-request speedup of the parallel tile executor vs number of cores.
+
+Runs the per-pixel stages that processors split across the shared tile pool
+(processors.tiling) with 1, 2, 4, ... workers on one image and reports the median
+time, speedup over one worker and parallel efficiency. Images below the
+MIN_TILE_PIXELS heuristic run inline, so small sizes should show no change;
+efficiency is speedup per tile actually run in parallel.
+
+Usage:
+    python -m benchmarks.parallel_tiles                      # 2 and 12 MP, 1..cpu_count workers
+    python -m benchmarks.parallel_tiles --sizes 0.3,24 --workers 1,2,4,8 --repeat 5
+    python -m benchmarks.parallel_tiles -o retouch --output benchmarks/results/tiles.json
+
+OpenCV parallelizes some filters internally as well; pass --cv-threads 1 to measure
+the tile executor alone.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmarks.fixtures import FixtureSpec, ensure_fixture
+from benchmarks.run import _parse_sizes
+from processors import tiling
+from processors.photo_retoucher import PhotoRetoucher, BILATERAL_DIAMETER, BILATERAL_SIGMA
+
+
+def _retouch(img: Image.Image, rgb: np.ndarray, workers: int):
+    retoucher = PhotoRetoucher()
+    if workers == 1:
+        return retoucher._apply_enhancements(img, "bench")
+    return retoucher._apply_enhancements_tiled(img, "bench", workers=workers)
+
+
+def _bilateral(img: Image.Image, rgb: np.ndarray, workers: int):
+    return tiling.parallel_rows(
+        lambda strip: cv2.bilateralFilter(strip, BILATERAL_DIAMETER, BILATERAL_SIGMA, BILATERAL_SIGMA),
+        rgb, overlap=BILATERAL_DIAMETER // 2, workers=workers)
+
+
+def _grayscale(img: Image.Image, rgb: np.ndarray, workers: int):
+    return tiling.parallel_rows(lambda strip: cv2.cvtColor(strip, cv2.COLOR_RGB2GRAY), rgb, workers=workers)
+
+
+def _blur_blend(img: Image.Image, rgb: np.ndarray, workers: int):
+    def blur_blend(strip):
+        return cv2.addWeighted(strip, 0.8, cv2.GaussianBlur(strip, (5, 5), 0.8), 0.2, 0)
+    return tiling.parallel_rows(blur_blend, rgb, overlap=2, workers=workers)
+
+
+OPERATIONS = {
+    "retouch": _retouch,          # full PhotoRetoucher chain (tiled path vs whole image)
+    "bilateral": _bilateral,      # noise reduction step
+    "grayscale": _grayscale,      # SmartCropper face-detection input
+    "blur_blend": _blur_blend,    # skin smoothing step
+}
+
+
+def measure(operation, img: Image.Image, rgb: np.ndarray, workers: int, repeat: int) -> list:
+    operation(img, rgb, workers)  # warm-up: thread start, first-touch allocations
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation(img, rgb, workers)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _default_workers() -> tuple:
+    counts, count = [], 1
+    while count < tiling.TILE_POOL_WORKERS:
+        counts.append(count)
+        count *= 2
+    return tuple(counts) + (tiling.TILE_POOL_WORKERS,)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark parallel tile execution vs worker count")
+    parser.add_argument("-o", "--operation", action="append", dest="operations", choices=list(OPERATIONS),
+                        help="Operation to measure (repeatable, default: all)")
+    parser.add_argument("--sizes", type=_parse_sizes, default=(2, 12), help="Comma separated megapixel sizes")
+    parser.add_argument("--workers", type=lambda value: tuple(int(item) for item in value.split(",")),
+                        default=_default_workers(), help="Comma separated worker counts (default: 1..TILE_POOL_WORKERS)")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured iterations per point")
+    parser.add_argument("--cv-threads", type=int, help="cv2.setNumThreads value (default: OpenCV's own)")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.cv_threads is not None:
+        cv2.setNumThreads(args.cv_threads)
+    if max(args.workers) > tiling.TILE_POOL_WORKERS:
+        print(f"⚠️ Tile pool has {tiling.TILE_POOL_WORKERS} threads; set TILE_POOL_WORKERS to measure more workers")
+
+    print(f"🖥️ {os.cpu_count()} CPUs, tile pool {tiling.TILE_POOL_WORKERS} threads, OpenCV threads {cv2.getNumThreads()}, "
+          f"min tile {tiling.MIN_TILE_PIXELS} px")
+    print(f"{'operation':<12} {'MP':>5} {'workers':>7} {'tiles':>5} {'median s':>9} {'speedup':>8} {'efficiency':>10}")
+
+    results = []
+    for megapixels in args.sizes:
+        img = Image.open(ensure_fixture(FixtureSpec(megapixels, "RGB", True)))
+        img.load()
+        rgb = np.asarray(img)
+        pixels = img.size[0] * img.size[1]
+        for name in args.operations or OPERATIONS:
+            single = None
+            for workers in args.workers:
+                median = statistics.median(measure(OPERATIONS[name], img, rgb, workers, args.repeat))
+                single = single or median
+                tiles = tiling.plan_workers(pixels, workers)
+                speedup = single / median
+                results.append({"operation": name, "megapixels": megapixels, "workers": workers, "tiles": tiles,
+                                "median_s": round(median, 5), "speedup": round(speedup, 3)})
+                print(f"{name:<12} {megapixels:>5} {workers:>7} {tiles:>5} {median:>9.4f} {speedup:>7.2f}x "
+                      f"{speedup / tiles:>9.0%}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"cpu_count": os.cpu_count(), "tile_pool_workers": tiling.TILE_POOL_WORKERS,
+                       "cv_threads": cv2.getNumThreads(), "min_tile_pixels": tiling.MIN_TILE_PIXELS,
+                       "results": results}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
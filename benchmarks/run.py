@@ -0,0 +1,344 @@
+"""
+Run the processor benchmark suite.
+
+Every case runs in a fresh worker process so peak RSS belongs to that case alone
+and model/session caches of one processor do not leak into another. The first
+iteration (warm-up: rembg model load, cascade load) is reported separately as
+`first_run_s` and excluded from the latency statistics.
+
+Usage:
+    python -m benchmarks.run                          # default matrix: 0.3/2/12 MP, RGB
+    python -m benchmarks.run --quick                  # 0.3/2 MP, for a quick local check
+    python -m benchmarks.run --full                   # 0.3-48 MP, RGB/RGBA/P/L
+    python -m benchmarks.run -p smart_cropper -p photo_retoucher --sizes 12,24
+    python -m benchmarks.run --save-baseline          # store results as benchmarks/baseline.json
+
+Results are written as JSON to benchmarks/results/ and compared with the baseline
+when one exists; the exit code is 1 if any case regressed.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import platform
+import argparse
+import statistics
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+
+# Processors write to relative paths (processed/...), so always run from the project root
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import compare
+from benchmarks.cases import (PROCESSORS, BenchmarkCase, build_cases, QUICK_SIZES, DEFAULT_SIZES,
+                              FULL_SIZES, DEFAULT_MODES, FULL_MODES)
+from benchmarks.fixtures import ensure_fixture, file_sha256
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+RESULT_SCHEMA = 1
+CASE_TIMEOUT = 1800  # seconds; a 48 MP rembg run on a small CPU box can take minutes per iteration
+
+
+def _read_proc_status_mb(field: str):
+    """VmRSS / VmHWM from /proc/self/status in MB, None where /proc is not available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    return _read_proc_status_mb("VmRSS")
+
+
+def peak_rss_mb():
+    peak = _read_proc_status_mb("VmHWM")
+    if peak is None:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        peak = maxrss / (1024 ** 2) if sys.platform == "darwin" else maxrss / 1024
+    return peak
+
+
+def percentile(samples: list, fraction: float) -> float:
+    # Nearest-rank percentile: with 5 samples p95 is the slowest one
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "p95": percentile(samples, 0.95),
+        "max": max(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def _cleanup_outputs(file_id: str):
+    # Every processor output starts with the file_id
+    from processors.storage import result_store
+    result_store.delete_prefix(file_id)
+
+
+def measure_case(case: BenchmarkCase, repeat: int, warmup: int) -> dict:
+    """Run one case in the current process and return its result entry"""
+    from processors.instrumentation import collect_stages
+
+    settings = PROCESSORS[case.processor]
+    specs = case.fixture_specs()
+    paths = [ensure_fixture(spec) for spec in specs]
+    input_megapixels = sum(spec.size[0] * spec.size[1] for spec in specs) / 1_000_000
+
+    processor = settings["factory"]()
+    loop = asyncio.new_event_loop()
+    rss_before = current_rss_mb()
+
+    samples = []
+    stage_samples = {}
+    first_run = None
+    try:
+        for iteration in range(warmup + repeat):
+            file_id = f"bench_{uuid.uuid4().hex[:12]}"
+            with collect_stages() as stages:
+                start_time = time.perf_counter()
+                try:
+                    output = loop.run_until_complete(settings["call"](processor, paths, file_id))
+                finally:
+                    elapsed = time.perf_counter() - start_time
+                    _cleanup_outputs(file_id)
+            if not output:
+                # Processors that swallow per-item errors (person swap, social media) return empty results
+                raise RuntimeError("processor returned no output")
+
+            if first_run is None:
+                first_run = elapsed
+            if iteration >= warmup:
+                samples.append(elapsed)
+                per_stage = {}
+                for name, seconds in stages:
+                    per_stage[name] = per_stage.get(name, 0.0) + seconds
+                for name, seconds in per_stage.items():
+                    stage_samples.setdefault(name, []).append(seconds)
+    finally:
+        loop.close()
+
+    latency = summarize(samples)
+    peak = peak_rss_mb()
+    return {
+        "status": "ok",
+        **case.to_dict(),
+        "fixtures": [{"name": spec.name, "sha256": file_sha256(path)} for spec, path in zip(specs, paths)],
+        "input_megapixels": round(input_megapixels, 3),
+        "iterations": len(samples),
+        "first_run_s": first_run,
+        "latency_s": latency,
+        "samples_s": samples,
+        "throughput": {
+            "ops_per_s": 1 / latency["median"] if latency["median"] else None,
+            "megapixels_per_s": input_megapixels / latency["median"] if latency["median"] else None,
+        },
+        "peak_rss_mb": peak,
+        "rss_growth_mb": peak - rss_before if peak is not None and rss_before is not None else None,
+        "stages_median_s": {name: statistics.median(values) for name, values in stage_samples.items()},
+    }
+
+
+def _worker(case_data: dict, repeat: int, warmup: int, result_queue):
+    # Processor step logs would drown the report; warnings and errors still come through
+    logging.basicConfig(level=logging.WARNING)
+    os.chdir(ROOT_DIR)
+    case = BenchmarkCase.from_dict(case_data)
+    try:
+        result_queue.put(measure_case(case, repeat, warmup))
+    except BaseException as e:
+        result_queue.put({"status": "error", **case.to_dict(), "error": f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(case: BenchmarkCase, repeat: int, warmup: int, timeout: float = CASE_TIMEOUT) -> dict:
+    """Run a case in a spawned worker process; a crash or OOM kill becomes an error entry"""
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=_worker, args=(case.to_dict(), repeat, warmup, result_queue))
+    process.start()
+    deadline = time.monotonic() + timeout
+
+    try:
+        while True:
+            try:
+                return result_queue.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    try:
+                        return result_queue.get(timeout=1)
+                    except queue.Empty:
+                        return {"status": "error", **case.to_dict(), "error": f"worker exited with code {process.exitcode}"}
+                if time.monotonic() > deadline:
+                    process.terminate()
+                    return {"status": "error", **case.to_dict(), "error": f"timed out after {timeout:.0f}s"}
+    finally:
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+
+
+def _package_version(*names):
+    from importlib import metadata
+    for name in names:
+        try:
+            return metadata.version(name)
+        except metadata.PackageNotFoundError:
+            continue
+    return None
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def describe_environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "pillow": _package_version("pillow", "Pillow"),
+        "numpy": _package_version("numpy"),
+        "opencv": _package_version("opencv-python", "opencv-python-headless"),
+        "rembg": _package_version("rembg"),
+        "onnxruntime": _package_version("onnxruntime", "onnxruntime-gpu"),
+        "git_commit": _git_commit(),
+    }
+
+
+def save_baseline(results: dict, baseline_path: str):
+    """
+    Store results as the baseline. Cases from a previous baseline that were not
+    re-run are kept when it was recorded on the same kind of machine.
+    """
+    merged = results
+    if os.path.exists(baseline_path):
+        previous = compare.load_results(baseline_path)
+        if not compare.environment_differences(results, previous):
+            merged = {**results, "cases": {**previous.get("cases", {}), **results["cases"]}}
+        else:
+            print("ℹ️ Baseline environment differs, replacing the whole baseline")
+    with open(baseline_path, "w") as f:
+        json.dump(merged, f, indent=2, sort_keys=True)
+    print(f"💾 Baseline saved to {baseline_path} ({len(merged['cases'])} cases)")
+
+
+def _parse_sizes(value: str) -> tuple:
+    return tuple(float(item) if "." in item else int(item) for item in value.split(",") if item)
+
+
+def _print_case(case_id: str, result: dict):
+    if result["status"] != "ok":
+        print(f"❌ {case_id}: {result.get('error')}")
+        return
+    latency = result["latency_s"]
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result.get("peak_rss_mb") else "n/a"
+    print(f"✅ {case_id}: median {latency['median']:.3f}s (p95 {latency['p95']:.3f}s, first {result['first_run_s']:.3f}s), "
+          f"{result['throughput']['megapixels_per_s']:.1f} MP/s, peak RSS {rss}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark image processors on synthetic fixtures")
+    parser.add_argument("-p", "--processor", action="append", dest="processors", choices=list(PROCESSORS),
+                        help="Processor to run (repeatable, default: all)")
+    parser.add_argument("--sizes", type=_parse_sizes, help="Comma separated megapixel sizes, e.g. 0.3,2,12")
+    parser.add_argument("--modes", type=lambda value: tuple(value.split(",")), help="Comma separated modes, e.g. RGB,L")
+    parser.add_argument("--quick", action="store_true", help="Small fixtures only")
+    parser.add_argument("--full", action="store_true", help="All sizes (0.3-48 MP) and modes (RGB/RGBA/P/L)")
+    parser.add_argument("--repeat", type=int, default=5, help="Measured iterations per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured iterations per case")
+    parser.add_argument("--in-process", action="store_true", help="Do not isolate cases (peak RSS becomes cumulative)")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/bench-<timestamp>.json)")
+    parser.add_argument("--baseline", default=compare.DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=compare.LATENCY_THRESHOLD, help="Tolerated median slowdown")
+    args = parser.parse_args(argv)
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    sizes = args.sizes or (FULL_SIZES if args.full else QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    modes = args.modes or (FULL_MODES if args.full else DEFAULT_MODES)
+    try:
+        cases = build_cases(args.processors, sizes, modes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.chdir(ROOT_DIR)
+    os.makedirs("processed", exist_ok=True)
+
+    # Generate fixtures up front so their cost never lands in a measurement
+    specs = {spec.path: spec for case in cases for spec in case.fixture_specs()}
+    print(f"🖼️ Preparing {len(specs)} fixtures")
+    for spec in specs.values():
+        ensure_fixture(spec)
+
+    results = {
+        "schema": RESULT_SCHEMA,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": describe_environment(),
+        "settings": {"repeat": args.repeat, "warmup": args.warmup, "isolated": not args.in_process},
+        "cases": {},
+    }
+
+    print(f"🚀 Running {len(cases)} cases ({args.warmup} warm-up + {args.repeat} measured iterations each)")
+    for case in cases:
+        if args.in_process:
+            try:
+                result = measure_case(case, args.repeat, args.warmup)
+            except Exception as e:
+                result = {"status": "error", **case.to_dict(), "error": f"{type(e).__name__}: {e}"}
+        else:
+            result = run_isolated(case, args.repeat, args.warmup)
+        results["cases"][case.case_id] = result
+        _print_case(case.case_id, result)
+
+    output_path = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"💾 Results saved to {output_path}")
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ No baseline at {args.baseline}; record one on the reference machine with --save-baseline")
+        return 0
+
+    baseline = compare.load_results(args.baseline)
+    rows = compare.compare_results(results, baseline, args.threshold)
+    print(compare.format_report(rows, compare.environment_differences(results, baseline)))
+    return 1 if compare.has_regressions(rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Write-behind recorder for users' processing history (ProcessedImage rows).
+
+Handlers call history_recorder.record(...) and return immediately; rows are
+buffered in memory and written with one multi-row INSERT when HISTORY_BATCH_SIZE
+rows are pending or HISTORY_FLUSH_MS has passed, whichever comes first. A batch
+of social media versions or person swaps therefore costs one round-trip instead
+of one session and commit per image. Pending rows are flushed on shutdown; rows
+of a failed flush are retried with the next batch.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import ProcessedImage, run_db
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))  # flush as soon as this many rows wait
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", "250"))  # longest a row waits before it is written
+HISTORY_MAX_PENDING = 10000  # rows kept across failed flushes before the oldest are dropped
+
+
+def _insert_rows(db, rows: list):
+    db.execute(insert(ProcessedImage), rows)
+
+
+class HistoryRecorder:
+    """In-memory buffer of ProcessedImage rows plus the task that flushes it."""
+
+    def __init__(self, batch_size: int = HISTORY_BATCH_SIZE, flush_ms: int = HISTORY_FLUSH_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.flushed_rows = 0
+        self.flushes = 0
+        self._rows = []
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def record(self, user_id: int, original_filename: str, processed_filename: str, processing_type: str):
+        """
+        Queue one history row (call from the event loop; starts the flusher on first use).
+
+        Rows recorded after stop() stay pending until the next flush() or start().
+
+        Example:
+            history_recorder.record(user_id=user.id, original_filename=file.filename,
+                                    processed_filename=os.path.basename(output_path), processing_type="retouch")
+        """
+        self._rows.append({
+            "user_id": user_id,
+            "original_filename": original_filename,
+            "processed_filename": processed_filename,
+            "processing_type": processing_type,
+            "created_at": datetime.utcnow(),  # time of processing, not of the flush
+        })
+        if self._task is None:
+            if self._stopping:
+                # Shutting down: do not bring back the flusher stop() just finished
+                logger.warning(f"⚠️ History row for {processed_filename} recorded after shutdown, kept pending")
+                return
+            self.start()
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """
+        Write every pending row in one INSERT; number of rows written.
+
+        Flushes run one at a time: an explicit flush (e.g. before reading the history)
+        waits for a batch already in flight, so every row recorded before the call
+        is in the database when it returns.
+        """
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        try:
+            await run_db(_insert_rows, rows)
+        except Exception as e:
+            # Keep them for the next flush, but do not grow without bound while the DB is down
+            self._rows = (rows + self._rows)[-HISTORY_MAX_PENDING:]
+            logger.error(f"❌ History flush of {len(rows)} rows failed, {len(self._rows)} pending: {e}")
+            return 0
+        self.flushed_rows += len(rows)
+        self.flushes += 1
+        logger.debug(f"💾 History: {len(rows)} rows written in one batch")
+        return len(rows)
+
+    def start(self):
+        """Start the flusher on the running loop (startup handler, or the first record())"""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still pending"""
+        if self._task is not None:
+            # Not cancel(): a flush in flight would lose its detached batch (or roll it back)
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+history_recorder = HistoryRecorder()
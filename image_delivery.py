@@ -0,0 +1,362 @@
+"""
+Serving processed images at /processed: format negotiation and HTTP caching.
+
+Processors store every result once, in its native format (JPEG or PNG). When the
+client's Accept header lists a more compact format the local Pillow can encode
+(AVIF, then WebP by default), the route serves a variant in that format instead.
+Variants are encoded on first request with the request's encoder profile and
+cached on disk under processed/.variants/ (sharded like the results, see
+processors/storage.py), one file per (result, profile, format), so later
+requests only pay for a stat.
+
+Fixed-size previews (THUMBNAIL_SIZES, WebP or JPEG by Accept) are served at
+/thumbs/<size>/<name> for the gallery and result pages; they are rendered in the
+background when a result is stored, or on the first request, and live next to
+the variants, so the storage sweeper deletes them with their result.
+
+Result names are unique UUIDs and their content never changes, so responses are
+`immutable` with a content-hash ETag (If-None-Match -> 304). Byte ranges come
+from FileResponse, precompressed `.br`/`.gz` siblings are used when the client
+accepts them, and the body goes out zero-copy via the ASGI pathsend extension or,
+behind nginx/Apache, an X-Accel-Redirect / X-Sendfile hand-off.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from starlette.responses import FileResponse, Response
+
+from processors import encoding
+from processors.storage import result_store, signed_path, STORAGE_ROOT, RESULT_URL_TTL
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_DIR = STORAGE_ROOT
+# Candidate formats in order of preference; a format is used when the client lists it explicitly
+NEGOTIATED_FORMATS = [item.strip().upper() for item in os.getenv("IMAGE_NEGOTIATION_FORMATS", "avif,webp").split(",")
+                      if item.strip()]
+
+MEDIA_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "AVIF": "image/avif",
+}
+SOURCE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+# Preview sizes (longest side, px) served at /thumbs/<size>/<name>: gallery cards, result previews
+THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv("THUMBNAIL_SIZES", "480,1280").split(",") if size.strip())
+THUMBNAIL_FORMATS = ("WEBP", "JPEG")
+THUMBNAIL_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+THUMBNAIL_OPTIONS = {"WEBP": {"quality": 80, "method": 4}, "JPEG": {"quality": 82, "optimize": True}}
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "1"))  # background renders of new results
+# Render previews as soon as a result is stored (otherwise on the first /thumbs/ request)
+THUMBNAILS_ON_STORE = os.getenv("THUMBNAILS_ON_STORE", "true").lower() in ("1", "true", "yes")
+
+CACHE_MAX_AGE = int(os.getenv("PROCESSED_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+CACHE_CONTROL = f"public, max-age={CACHE_MAX_AGE}, immutable"
+# Precompressed siblings (result.png.br, result.png.gz) in order of preference
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# "X-Accel-Redirect" (nginx) or "X-Sendfile" (Apache, lighttpd): the front server sends the file itself
+SENDFILE_HEADER = os.getenv("SENDFILE_HEADER", "")
+SENDFILE_PREFIX = os.getenv("SENDFILE_PREFIX", "/internal/processed/")  # nginx internal location for processed/
+ETAG_CACHE_SIZE = 4096
+HASH_CHUNK_SIZE = 1024 * 1024
+# Variants and previews are encoded per encoder profile, which the X-Encoder-Profile header selects
+# (?encoding= is part of the URL already): shared caches must not hand one profile's bytes to another
+VARY = "Accept, Accept-Encoding, X-Encoder-Profile"
+
+
+def parse_accept(header: str) -> dict:
+    """Media type -> q value from an Accept header (wildcards kept as written)"""
+    accepted = {}
+    for item in (header or "").split(","):
+        media_type, _, params = item.strip().partition(";")
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_type.strip().lower()] = quality
+    return accepted
+
+
+def negotiate_format(accept_header: str, source_format: str) -> str:
+    """
+    Output format for a stored image of `source_format`.
+
+    Only formats the client names explicitly count: `*/*` or `image/*` (curl, old
+    clients) keep the original format, so nobody receives a format it may not decode.
+
+    Example:
+        negotiate_format("image/avif,image/webp,*/*;q=0.8", "JPEG")  # "AVIF"
+    """
+    accepted = parse_accept(accept_header)
+    for format in NEGOTIATED_FORMATS:
+        if format == source_format:
+            break
+        if accepted.get(MEDIA_TYPES.get(format), 0) > 0 and encoding.is_supported(format):
+            return format
+    return source_format
+
+
+async def resolve_processed(filename: str):
+    """Path of a stored result, None for hidden, nested or missing names"""
+    if not filename or filename.startswith(".") or os.path.basename(filename) != filename:
+        return None
+    path = result_store.resolve(filename)
+    if path is None and result_store.backend.remote:
+        # Evicted from the local disk but still in the bucket
+        path = await asyncio.to_thread(result_store.fetch, filename)
+    return path
+
+
+class VariantCache:
+    """Lazily encoded, disk-cached format variants of stored results."""
+
+    def __init__(self, store=result_store):
+        self.store = store
+        self._pending = {}  # variant path -> encoding task, so concurrent requests share one encode
+
+    def variant_path(self, source_path: str, format: str, profile_name: str) -> str:
+        name = os.path.basename(source_path)
+        return os.path.join(self.store.variant_dir(name), f"{name}.{profile_name}.{format.lower()}")
+
+    async def get(self, source_path: str, format: str) -> str:
+        """Path of the `format` variant of `source_path`, encoding it on first use"""
+        profile = encoding.get_profile()
+        path = self.variant_path(source_path, format, profile.name)
+        return await self._ensure(path, source_path, self._encode, source_path, path, format)
+
+    async def _ensure(self, path: str, source_path: str, build, *args) -> str:
+        """`path`, running build(*args) in a worker thread first unless it is fresh"""
+        if self._is_fresh(path, source_path):
+            return path
+        task = self._pending.get(path)
+        if task is None:
+            # to_thread copies the context, so the worker encodes with this request's profile
+            task = asyncio.ensure_future(asyncio.to_thread(build, *args))
+            self._pending[path] = task
+            task.add_done_callback(lambda _: self._pending.pop(path, None))
+        # shield: a client disconnecting must not cancel an encode other requests wait for
+        await asyncio.shield(task)
+        return path
+
+    @staticmethod
+    def _is_fresh(path: str, source_path: str) -> bool:
+        try:
+            return os.stat(path).st_mtime_ns >= os.stat(source_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _write(img: Image.Image, path: str, format: str, **options):
+        """Encode to a temp file and rename, so readers never see a partial file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            encoding.save_image(img, temp_path, format, **options)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _encode(self, source_path: str, path: str, format: str):
+        with Image.open(source_path) as img:
+            self._write(img, path, format)
+        logger.info(f"🖼️ Encoded {format} variant of {os.path.basename(source_path)}: "
+                    f"{os.path.getsize(source_path)} -> {os.path.getsize(path)} bytes")
+
+
+class ThumbnailCache(VariantCache):
+    """
+    Fixed-size previews of stored results (THUMBNAIL_SIZES), as WebP and JPEG.
+
+    All sizes are rendered from one draft-mode decode: JPEG sources are decoded
+    at 1/2-1/8 scale straight away, so a 24 MP result costs a fraction of a full
+    decode. Transparent results keep alpha in WebP and get a white background in JPEG.
+    """
+
+    def thumbnail_path(self, name: str, size: int, format: str) -> str:
+        return os.path.join(self.store.variant_dir(name), f"{name}.thumb{size}.{THUMBNAIL_EXTENSIONS[format]}")
+
+    async def get(self, source_path: str, size: int, format: str) -> str:
+        """Path of the `size` preview of `source_path`, rendering every preview on first use"""
+        path = self.thumbnail_path(os.path.basename(source_path), size, format)
+        return await self._ensure(path, source_path, self.render, source_path)
+
+    def render(self, source_path: str):
+        """Write every preview size and format of a stored result (blocking)"""
+        name = os.path.basename(source_path)
+        formats = [format for format in THUMBNAIL_FORMATS if encoding.is_supported(format)]
+        with Image.open(source_path) as img:
+            largest = max(THUMBNAIL_SIZES)
+            img.draft("RGB", (largest, largest))  # JPEG: decode at the smallest scale still >= largest
+            img.load()
+            for size in sorted(THUMBNAIL_SIZES, reverse=True):
+                img.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+                for format in formats:
+                    preview = img
+                    if format == "JPEG" and img.mode in ("RGBA", "LA", "P"):
+                        preview = Image.new("RGB", img.size, (255, 255, 255))
+                        preview.paste(img, mask=img.convert("RGBA").getchannel("A"))
+                    self._write(preview, self.thumbnail_path(name, size, format), format,
+                                **THUMBNAIL_OPTIONS[format])
+        logger.info(f"🖼️ Rendered previews of {name}: {', '.join(map(str, sorted(THUMBNAIL_SIZES)))} px")
+
+
+variant_cache = VariantCache()
+thumbnail_cache = ThumbnailCache()
+_thumbnail_executor = None
+
+
+def pregenerate_thumbnails(name: str, path: str):
+    """Storage commit hook: render previews of a new result in the background"""
+    global _thumbnail_executor
+    if os.path.splitext(name)[1].lower() not in encoding.FORMAT_BY_EXTENSION:
+        return
+    if _thumbnail_executor is None:
+        _thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+    _thumbnail_executor.submit(_render_quietly, path)
+
+
+def _render_quietly(path: str):
+    try:
+        thumbnail_cache.render(path)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not render previews of {path}: {e}")
+
+
+def thumbnail_url(name: str, size: int = None, expires_in: int = RESULT_URL_TTL) -> str:
+    """Signed, expiring /thumbs/ URL of a result preview (smallest size by default)"""
+    return signed_path(name, expires_in, prefix=f"/thumbs/{size or min(THUMBNAIL_SIZES)}/")
+
+
+def thumbnail_format(accept_header: str) -> str:
+    """WebP for clients that list it, JPEG otherwise"""
+    if parse_accept(accept_header).get("image/webp", 0) > 0 and encoding.is_supported("WEBP"):
+        return "WEBP"
+    return "JPEG"
+
+
+async def negotiate(source_path: str, accept_header: str):
+    """
+    (path, media type) to serve for a stored result and the client's Accept header.
+
+    Falls back to the original when the client accepts nothing better, the variant
+    cannot be encoded, or it turned out larger than the original.
+    """
+    source_format = SOURCE_FORMATS.get(os.path.splitext(source_path)[1].lower())
+    if source_format is None:
+        return source_path, media_type_for(source_path)  # already WebP/AVIF
+
+    format = negotiate_format(accept_header, source_format)
+    if format == source_format:
+        return source_path, MEDIA_TYPES[source_format]
+
+    try:
+        variant = await variant_cache.get(source_path, format)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not encode {format} variant of {source_path}: {e}")
+        return source_path, MEDIA_TYPES[source_format]
+
+    if os.path.getsize(variant) >= os.path.getsize(source_path):
+        return source_path, MEDIA_TYPES[source_format]
+    return variant, MEDIA_TYPES[format]
+
+
+def media_type_for(path: str) -> str:
+    format = encoding.FORMAT_BY_EXTENSION.get(os.path.splitext(path)[1].lower())
+    return MEDIA_TYPES.get(format) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+# (path, mtime_ns, size) -> ETag, least recently used first
+_etags = OrderedDict()
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+async def content_etag(path: str, stat_result: os.stat_result) -> str:
+    """Strong ETag from the file's SHA-256, hashed once per file version"""
+    key = (path, stat_result.st_mtime_ns, stat_result.st_size)
+    etag = _etags.get(key)
+    if etag is None:
+        etag = f'"{await asyncio.to_thread(_hash_file, path)}"'
+        _etags[key] = etag
+        if len(_etags) > ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    else:
+        _etags.move_to_end(key)
+    return etag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET/HEAD)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {item.strip().removeprefix("W/") for item in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def find_precompressed(path: str, accept_encoding: str):
+    """(path, content encoding) of a precompressed sibling the client accepts, or (path, None)"""
+    accepted = parse_accept(accept_encoding)
+    for content_encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        if accepted.get(content_encoding, 0) > 0 and os.path.isfile(path + suffix):
+            return path + suffix, content_encoding
+    return path, None
+
+
+def _sendfile_target(path: str) -> str:
+    if SENDFILE_HEADER.lower() == "x-accel-redirect":
+        relative = os.path.relpath(path, PROCESSED_DIR).replace(os.sep, "/")
+        return SENDFILE_PREFIX.rstrip("/") + "/" + relative
+    return os.path.abspath(path)
+
+
+async def file_response(request, path: str, media_type: str, max_age: int = None) -> Response:
+    """
+    Response for a processed file with immutable caching and a content-hash ETag.
+
+    304 when If-None-Match matches; otherwise FileResponse (Range/If-Range, HEAD,
+    pathsend) or, with SENDFILE_HEADER set, an empty response telling the front
+    server which file to send. `max_age` shortens the cache lifetime (signed links).
+    """
+    path, content_encoding = find_precompressed(path, request.headers.get("accept-encoding", ""))
+    stat_result = os.stat(path)
+    etag = await content_etag(path, stat_result)
+    cache_control = CACHE_CONTROL
+    if max_age is not None and max_age < CACHE_MAX_AGE:
+        cache_control = f"public, max-age={max(0, max_age)}, immutable"
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": VARY}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if SENDFILE_HEADER:
+        headers[SENDFILE_HEADER] = _sendfile_target(path)
+        return Response(headers=headers, media_type=media_type)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
@@ -31,6 +31,8 @@ CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_processed_images_user_id ON processed_images(user_id);
 CREATE INDEX IF NOT EXISTS idx_processed_images_created_at ON processed_images(created_at);
+-- Keyset pagination of a user's history (/api/my-images, gallery): newest first, (created_at, id) as cursor
+CREATE INDEX IF NOT EXISTS idx_processed_images_user_created ON processed_images(user_id, created_at, id);
 
 -- Insert demo data (optional)
 INSERT INTO users (username, email, password_hash) VALUES 
@@ -0,0 +1,170 @@
+"""
+Event-loop lag monitor and blocking-call detector.
+
+A heartbeat task on the event loop measures how late each tick fires (loop lag).
+In debug mode a watchdog thread also checks the heartbeat: when the loop has not
+ticked for LOOP_BLOCK_THRESHOLD seconds it samples the loop thread's stack and
+attributes the stall to the innermost project function on it (for example
+app.send_telegram_message or processors.photo_retoucher._apply_enhancements).
+Lag and stall counts per function are exported at /metrics.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+from processors.instrumentation import REGISTRY, Counter, Histogram, METRICS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))  # seconds between heartbeat ticks
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.25"))  # lag counted as a blocking call
+# Stack capture needs a watchdog thread and sys._current_frames(); off unless asked for (or DEBUG is on)
+LOOP_BLOCK_DEBUG = os.getenv("LOOP_BLOCK_DEBUG", os.getenv("DEBUG", "false")).lower() in ("1", "true", "yes")
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+UNATTRIBUTED = "unattributed"
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LOOP_LAG = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event-loop heartbeat tick beyond its scheduled time",
+    buckets=LAG_BUCKETS,
+))
+
+LOOP_BLOCKED = REGISTRY.register(Counter(
+    "event_loop_blocked_total",
+    "Event-loop stalls longer than LOOP_BLOCK_THRESHOLD, by innermost project function on the stack",
+    ("function",),
+))
+
+LOOP_BLOCKED_SECONDS = REGISTRY.register(Counter(
+    "event_loop_blocked_seconds_total",
+    "Total event-loop stall time, by innermost project function on the stack",
+    ("function",),
+))
+
+
+def _is_project_file(filename: str) -> bool:
+    if filename.startswith("<"):
+        return False  # <frozen ...>, <string>, <stdin>
+    path = os.path.abspath(filename)
+    return (
+        path.startswith(PROJECT_ROOT + os.sep)
+        and "site-packages" not in path
+        and os.sep + "." not in path[len(PROJECT_ROOT):]  # .venv and other hidden directories
+        and path != os.path.abspath(__file__)
+    )
+
+
+def _function_label(frame_summary: traceback.FrameSummary) -> str:
+    module = os.path.relpath(frame_summary.filename, PROJECT_ROOT)[:-len(".py")].replace(os.sep, ".")
+    return f"{module}.{frame_summary.name}"
+
+
+def attribute_stack(stack: traceback.StackSummary):
+    """Return (function label, project frames) for the innermost project frame of `stack`"""
+    project_frames = [frame for frame in stack if _is_project_file(frame.filename)]
+    if not project_frames:
+        return UNATTRIBUTED, []
+    return _function_label(project_frames[-1]), project_frames
+
+
+class LoopMonitor:
+    """Heartbeat task plus optional watchdog thread for one event loop."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD,
+                 capture_stacks: bool = LOOP_BLOCK_DEBUG):
+        self.interval = interval
+        self.threshold = threshold
+        self.capture_stacks = capture_stacks
+        self.max_lag = 0.0
+        self._loop_thread_id = None
+        self._last_beat = None
+        self._pending = None  # (function, project frames) captured during the current stall
+        self._lock = threading.Lock()
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start monitoring the running loop (call from a coroutine, e.g. a startup handler)"""
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = loop.create_task(self._heartbeat())
+        if self.capture_stacks:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        logger.info(f"⏱️ Event-loop monitor started (tick {self.interval}s, block threshold {self.threshold}s, "
+                    f"stack capture {'on' if self.capture_stacks else 'off'})")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled)
+            with self._lock:
+                self._last_beat = time.monotonic()
+                pending, self._pending = self._pending, None
+            self.max_lag = max(self.max_lag, lag)
+            if METRICS_ENABLED:
+                LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self._record_block(lag, pending)
+
+    def _record_block(self, lag: float, pending):
+        function, frames = pending if pending else (UNATTRIBUTED, [])
+        if METRICS_ENABLED:
+            LOOP_BLOCKED.inc(function=function)
+            LOOP_BLOCKED_SECONDS.inc(lag, function=function)
+        if frames:
+            stack_text = "".join(traceback.format_list(frames)).rstrip()
+            logger.warning(f"🐢 Event loop blocked for {lag:.2f}s in {function}\n{stack_text}")
+        else:
+            logger.warning(f"🐢 Event loop blocked for {lag:.2f}s")
+
+    def _watch(self):
+        """Watchdog thread: sample the loop thread's stack once per stall"""
+        poll = max(0.01, self.threshold / 4)
+        captured_for = None
+        while not self._stopped.wait(poll):
+            with self._lock:
+                last_beat = self._last_beat
+            if time.monotonic() - last_beat < self.threshold + self.interval:
+                continue
+            if captured_for == last_beat:
+                continue  # still the same stall, already sampled
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            attribution = attribute_stack(traceback.extract_stack(frame))
+            del frame
+            with self._lock:
+                if self._last_beat == last_beat:
+                    self._pending = attribution
+            captured_for = last_beat
+
+
+loop_monitor = LoopMonitor()
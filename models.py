@@ -1,13 +1,63 @@
 import os
+import base64
+import asyncio
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, tuple_, Column, Integer, String, DateTime, ForeignKey, Index, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./photo_processor.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# Connection pool per app worker process (PostgreSQL); SQLite uses SQLAlchemy's defaults
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # replace connections older than this (seconds)
+# Run DB work on an asyncio engine (asyncpg / aiosqlite) instead of worker threads
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def _engine_options() -> dict:
+    if IS_SQLITE:
+        return {"connect_args": {"check_same_thread": False, "timeout": 30}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,  # drop connections the server closed while idle
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: readers no longer wait for the writer; NORMAL sync is safe with WAL and much faster
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
+
+engine = create_engine(DATABASE_URL, **_engine_options())
+if IS_SQLITE:
+    event.listen(engine, "connect", _sqlite_pragmas)
+# expire_on_commit=False: objects stay readable after their session is closed
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    _scheme, _rest = DATABASE_URL.split("://", 1)
+    async_engine = create_async_engine(f"{ASYNC_DRIVERS[_scheme.split('+')[0]]}://{_rest}", **_engine_options())
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -36,14 +86,114 @@ class ProcessedImage(Base):
     # Relationship with user
     user = relationship("User", back_populates="processed_images")
 
+    __table_args__ = (
+        # Keyset pagination of a user's history: WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+        Index("idx_processed_images_user_created", "user_id", "created_at", "id"),
+    )
+
+GALLERY_PAGE_SIZE = 50
+GALLERY_MAX_PAGE_SIZE = 200
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes of tables that already exist
+    for index in ProcessedImage.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+def encode_cursor(created_at: datetime, image_id: int) -> str:
+    """Opaque cursor pointing just after one history row"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{image_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """
+    (created_at, id) of a cursor from encode_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, image_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(image_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def user_images_page(db, user_id: int, limit: int = GALLERY_PAGE_SIZE, cursor: str = None,
+                     processing_type: str = None):
+    """
+    One page of a user's history, newest first, and the cursor of the next page (None on the last).
+
+    Keyset pagination on (created_at, id) served by idx_processed_images_user_created:
+    every page costs the same, however deep, unlike OFFSET.
+
+    Raises:
+        ValueError: If `cursor` is malformed
+
+    Example:
+        images, next_cursor = user_images_page(db, user.id, limit=50, processing_type="retouch")
+    """
+    query = db.query(ProcessedImage).filter(ProcessedImage.user_id == user_id)
+    if processing_type:
+        query = query.filter(ProcessedImage.processing_type == processing_type)
+    if cursor:
+        created_at, image_id = decode_cursor(cursor)
+        query = query.filter(tuple_(ProcessedImage.created_at, ProcessedImage.id) < (created_at, image_id))
+    rows = query.order_by(ProcessedImage.created_at.desc(), ProcessedImage.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
 def get_db():
-    """Get database session"""
+    """
+    Database session for one request, closed when the request ends (FastAPI dependency).
+
+    Example:
+        @app.get("/api/users/{user_id}")
+        def read_user(user_id: int, db: Session = Depends(get_db)):
+            return db.get(User, user_id)
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@contextmanager
+def session_scope():
+    """Session that commits on success, rolls back on error and is always closed"""
     db = SessionLocal()
     try:
-        return db
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
     finally:
-        pass  # Don't close here, let the caller handle it
+        db.close()
+
+def _run_in_session(func, args):
+    with session_scope() as db:
+        return func(db, *args)
+
+async def run_db(func, *args):
+    """
+    Run `func(session, *args)` in its own committed session without blocking the event loop.
+
+    With DB_ASYNC=true the session comes from the async engine (AsyncSession.run_sync),
+    otherwise it runs in a worker thread. Returned ORM objects stay readable.
+
+    Example:
+        user = await run_db(lambda db, name: db.query(User).filter(User.username == name).first(), username)
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                return await session.run_sync(func, *args)
+    return await asyncio.to_thread(_run_in_session, func, args)
+
+def saved_filenames(names) -> set:
+    """Which of the processed file `names` are in users' processing history (kept by the storage sweeper)"""
+    with session_scope() as db:
+        rows = db.query(ProcessedImage.processed_filename).filter(
+            ProcessedImage.processed_filename.in_(list(names))).all()
+        return {row[0] for row in rows}
@@ -0,0 +1,100 @@
+"""
+Password hashing for register/login, off the event loop and bounded.
+
+A bcrypt hash or verify costs ~250 ms of CPU at the default cost; done inline in
+an async handler it stalls every other request for that long. Here each one runs
+in a small dedicated thread pool (PASSWORD_HASH_WORKERS; bcrypt releases the GIL),
+and at most AUTH_MAX_PENDING of them may be running or queued: beyond that
+register/login get 429 straight away, so a credential-stuffing burst costs at
+most PASSWORD_HASH_WORKERS cores and never the image processing endpoints.
+
+The cost is BCRYPT_ROUNDS (log2 of the iterations, passlib's default 12). After
+it is changed, existing hashes are re-hashed with the new cost on the next
+successful login.
+"""
+import os
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from processors.instrumentation import REGISTRY, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))  # running + queued hashes
+
+PASSWORD_HASH_DURATION = REGISTRY.register(Histogram(
+    "password_hash_seconds",
+    "Time of a password hash or verification in the hashing pool, queueing included",
+    ("operation",),
+))
+
+AUTH_REJECTED = REGISTRY.register(Counter(
+    "auth_rejected_total",
+    "Register/login requests rejected because AUTH_MAX_PENDING password hashes were already pending",
+))
+
+
+class PasswordHasherBusy(Exception):
+    """AUTH_MAX_PENDING hashes are already running or queued."""
+
+
+class PasswordHasher:
+    """bcrypt hash/verify in a bounded thread pool, awaitable from handlers."""
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = AUTH_MAX_PENDING):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def hash(self, password: str) -> str:
+        """
+        bcrypt hash of `password` for storing.
+
+        Example:
+            password_hash = await password_hasher.hash(user.password)
+        """
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, password_hash: str):
+        """
+        Check `password`; returns (matches, new_hash).
+
+        new_hash is set when the stored hash uses an outdated cost or scheme and
+        should replace it, None otherwise.
+        """
+        return await self._run("verify", self.context.verify_and_update, password, password_hash)
+
+    async def _run(self, operation: str, func, *args):
+        if self._pending >= self.max_pending:
+            AUTH_REJECTED.inc()
+            raise PasswordHasherBusy(f"{self._pending} password hashes pending")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = self._executor.submit(func, *args)
+        self._pending += 1
+        # Released when the hash finishes, not when the caller stops waiting: a disconnected
+        # client's hash still occupies a worker
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._finished, operation, started))
+        return await asyncio.wrap_future(future)
+
+    def _finished(self, operation: str, started: float):
+        self._pending -= 1
+        PASSWORD_HASH_DURATION.observe(time.perf_counter() - started, operation=operation)
+
+
+password_hasher = PasswordHasher()
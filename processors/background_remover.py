@@ -1,22 +1,48 @@
 import os
+import io
+import asyncio
 import logging
-from contextlib import contextmanager
-import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from processors.instrumentation import timer_step, observe_image
+from processors.encoding import save_image
+from processors.storage import result_store
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function for timing operations
-@contextmanager
-def timer_step(step_name: str, file_id: str = None):
-    start_time = time.time()
-    request_prefix = f"[{file_id}] " if file_id else ""
-    logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+# "rembg_lowres": the net only sees this many pixels on the long side anyway (u2net: 320),
+# so predict on a downscaled copy and upsample just the alpha channel with a guided filter
+MASK_MAX_SIDE = int(os.getenv("REMBG_MASK_MAX_SIDE", "1024"))
+GUIDED_FILTER_RADIUS = 4  # window radius in mask pixels
+GUIDED_FILTER_EPS = 1e-3  # edge threshold on [0, 1] luminance variance; smaller follows edges tighter
+
+# Output encodings selectable per request: name -> (file suffix, media type)
+OUTPUT_MODES = {
+    "png": ("_no_bg.png", "image/png"),                   # full RGBA PNG, as rembg returns it
+    "png_fast": ("_no_bg.png", "image/png"),              # same pixels, low zlib level: ~3-5x faster encode
+    "cutout_webp": ("_no_bg.webp", "image/webp"),         # lossy RGBA WebP, a fraction of the PNG size
+    "mask": ("_mask.png", "image/png"),                   # single-channel alpha only
+    "bbox_cropped": ("_no_bg_cropped.png", "image/png"),  # RGBA cropped to the subject's bounding box
+}
+PNG_FAST_COMPRESS_LEVEL = 1
+CUTOUT_WEBP_QUALITY = int(os.getenv("CUTOUT_WEBP_QUALITY", "85"))
+CUTOUT_WEBP_METHOD = 2  # encoder effort 0-6: 2 is ~2x faster than the default 4 at the same size
+BBOX_ALPHA_THRESHOLD = 16  # alpha below this is matting noise, not subject
+
+
+def _probe_image_size(input_path: str):
+    """Read image dimensions from the file header without decoding pixels"""
+    from PIL import Image
     try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
+        with Image.open(input_path) as img:
+            return img.size
+    except Exception:
+        return (0, 0)
 
 # Lazy import для rembg
 rembg_remove = None
@@ -32,6 +58,77 @@ def get_rembg():
             raise ImportError("rembg library is not properly installed")
     return rembg_remove
 
+rembg_session = None
+
+def get_rembg_session():
+    """Shared rembg session (ONNX model loaded once per process)"""
+    global rembg_session
+    if rembg_session is None:
+        try:
+            from rembg import new_session
+            rembg_session = new_session(REMBG_MODEL)
+        except ImportError as e:
+            logger.error(f"rembg not available: {e}")
+            raise ImportError("rembg library is not properly installed")
+    return rembg_session
+
+
+def guided_upsample(mask: np.ndarray, guide: np.ndarray, radius: int = GUIDED_FILTER_RADIUS,
+                    eps: float = GUIDED_FILTER_EPS) -> np.ndarray:
+    """
+    Upsample a low-res alpha mask to the size of `guide` along the guide's edges.
+
+    Fast guided filter (He & Sun, 2015): the local linear model alpha = a * I + b is
+    fitted at mask resolution, then only the coefficients are upsampled and applied
+    to the full-res luminance, so hair and contour edges follow the photo instead of
+    the blurry bilinear mask.
+
+    Args:
+        mask (np.ndarray): uint8 (h, w) alpha predicted at low resolution
+        guide (np.ndarray): uint8 (H, W) full-resolution luminance
+        radius (int): Window radius in mask pixels
+        eps (float): Regularization; larger values smooth across weak edges
+
+    Returns:
+        np.ndarray: uint8 (H, W) alpha
+    """
+    height, width = guide.shape
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    small_guide = cv2.resize(guide, (mask.shape[1], mask.shape[0]), interpolation=cv2.INTER_AREA)
+    small_guide = small_guide.astype(np.float32) / 255
+    alpha = mask.astype(np.float32) / 255
+
+    mean_guide = cv2.boxFilter(small_guide, -1, ksize)
+    mean_alpha = cv2.boxFilter(alpha, -1, ksize)
+    variance = cv2.boxFilter(small_guide * small_guide, -1, ksize) - mean_guide * mean_guide
+    covariance = cv2.boxFilter(small_guide * alpha, -1, ksize) - mean_guide * mean_alpha
+    a = covariance / (variance + eps)
+    b = mean_alpha - a * mean_guide
+
+    # Coefficients in 0..255 units: alpha255 = a * guide255 + 255 * b
+    a = cv2.resize(cv2.boxFilter(a, -1, ksize), (width, height), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(cv2.boxFilter(b, -1, ksize) * 255 + 0.5, (width, height), interpolation=cv2.INTER_LINEAR)
+    np.multiply(a, guide, out=a)
+    a += b
+    del b
+    return np.clip(a, 0, 255, out=a).astype(np.uint8)
+
+
+def subject_bbox(alpha: np.ndarray, threshold: int = BBOX_ALPHA_THRESHOLD):
+    """(left, top, right, bottom) of pixels with alpha >= threshold, None if there is no subject"""
+    solid = alpha >= threshold
+    rows = np.flatnonzero(solid.any(axis=1))
+    if rows.size == 0:
+        return None
+    columns = np.flatnonzero(solid[rows[0]:rows[-1] + 1].any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def _load_rgb(source) -> Image.Image:
+    """Open a path applying EXIF orientation like rembg does (loaded images are used as is), convert to RGB"""
+    img = ImageOps.exif_transpose(Image.open(source)) if isinstance(source, str) else source
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
 class BackgroundRemover:
     """
     Specialized class for AI-powered background removal from images.
@@ -45,7 +142,8 @@ class BackgroundRemover:
         """Initialize BackgroundRemover with default settings."""
         pass
         
-    async def remove_background(self, input_path: str, file_id: str, method: str = "rembg") -> str:
+    async def remove_background(self, input_path: str, file_id: str, method: str = "rembg",
+                                output: str = "png") -> str:
         """
         Remove background from image using specified AI method.
         
@@ -55,27 +153,34 @@ class BackgroundRemover:
         Args:
             input_path (str): Path to input image file
             file_id (str): Unique identifier for tracking and logging
-            method (str): Processing method ("rembg" for fast, "lbm" for high quality)
+            method (str): Processing method ("rembg" for fast, "rembg_lowres" for large
+                photos - low-res mask with guided upsampling, "lbm" for high quality)
+            output (str): Output encoding, one of OUTPUT_MODES ("png", "png_fast",
+                "cutout_webp", "mask", "bbox_cropped")
             
         Returns:
-            str: Path to processed image with transparent background
+            str: Path to processed image with transparent background (or to the mask)
             
         Raises:
-            ValueError: If unknown method specified
+            ValueError: If unknown method or output mode specified
             Exception: If AI processing fails or file operations error
             
         Example:
             remover = BackgroundRemover()
             result = await remover.remove_background("input.jpg", "uuid", "rembg")
         """
-        logger.info(f"[{file_id}] 🎨 Starting background removal with method: {method}")
+        logger.info(f"[{file_id}] 🎨 Starting background removal with method: {method}, output: {output}")
         logger.info(f"[{file_id}] 📁 Input file: {input_path}")
         
         try:
+            if output not in OUTPUT_MODES:
+                raise ValueError(f"Unknown background removal output mode: {output}")
             if method == "rembg":
-                return await self._remove_background_rembg(input_path, file_id)
+                return await self._remove_background_rembg(input_path, file_id, output)
+            elif method == "rembg_lowres":
+                return await self._remove_background_lowres(input_path, file_id, output)
             elif method == "lbm":
-                return await self._remove_background_lbm(input_path, file_id)
+                return await self._remove_background_lbm(input_path, file_id, output)
             else:
                 raise ValueError(f"Unknown background removal method: {method}")
                 
@@ -83,7 +188,7 @@ class BackgroundRemover:
             logger.error(f"[{file_id}] ❌ Error removing background with method {method}: {e}")
             raise
 
-    async def _remove_background_rembg(self, input_path: str, file_id: str) -> str:
+    async def _remove_background_rembg(self, input_path: str, file_id: str, output: str = "png") -> str:
         """Remove background using rembg library"""
         logger.info(f"[{file_id}] 🔧 Using rembg method for background removal")
         
@@ -91,6 +196,7 @@ class BackgroundRemover:
             with timer_step("Reading input image", file_id):
                 with open(input_path, 'rb') as f:
                     input_data = f.read()
+                observe_image(_probe_image_size(input_path))
                 logger.info(f"[{file_id}] 📖 Read {len(input_data)} bytes from input file")
             
             with timer_step("Loading rembg library", file_id):
@@ -98,14 +204,23 @@ class BackgroundRemover:
                 logger.info(f"[{file_id}] ✅ rembg library loaded successfully")
             
             with timer_step("AI background removal processing", file_id):
-                output_data = remove_func(input_data)
-                logger.info(f"[{file_id}] 🤖 AI processing complete, output size: {len(output_data)} bytes")
+                if output == "png":
+                    output_data = remove_func(input_data)
+                    logger.info(f"[{file_id}] 🤖 AI processing complete, output size: {len(output_data)} bytes")
+                else:
+                    # Image in, image out: skips rembg's own PNG encode, the output mode encodes instead
+                    result = remove_func(Image.open(io.BytesIO(input_data)), only_mask=(output == "mask"))
+                    if output == "bbox_cropped":
+                        result = self._crop_to_subject(result, file_id)
+                    logger.info(f"[{file_id}] 🤖 AI processing complete, output: {result.mode} {result.size}")
             
             with timer_step("Saving result", file_id):
-                output_path = f"processed/{file_id}_no_bg.png"
-                os.makedirs("processed", exist_ok=True)
-                with open(output_path, 'wb') as f:
-                    f.write(output_data)
+                if output == "png":
+                    with result_store.writing(f"{file_id}_no_bg.png") as output_path:
+                        with open(output_path, 'wb') as f:
+                            f.write(output_data)
+                else:
+                    output_path = self._save_output(result, file_id, output)
                 logger.info(f"[{file_id}] 💾 Result saved to: {output_path}")
             
             logger.info(f"[{file_id}] ✅ Background removed successfully with rembg: {output_path}")
@@ -115,7 +230,132 @@ class BackgroundRemover:
             logger.error(f"[{file_id}] ❌ Error removing background with rembg: {e}")
             raise
 
-    async def _remove_background_lbm(self, input_path: str, file_id: str) -> str:
+    async def get_mask(self, source, file_id: str, full_res: bool = False) -> Image.Image:
+        """
+        Compute the subject's alpha mask without producing a cutout.
+
+        The mask is predicted on a copy downscaled to MASK_MAX_SIDE and upsampled
+        with guided_upsample, so its cost barely grows with photo size. With
+        `full_res` rembg gets the full image and resizes its mask itself, as the
+        "rembg" method does (slower on large photos; benchmarks/mask_parity.py
+        compares the two). Consumers that composite the subject themselves
+        (PersonSwapper) compute it once per photo and reuse it.
+
+        Args:
+            source (str | Image.Image): Path to the image or an already loaded (oriented) image
+            file_id (str): Unique identifier for tracking and logging
+            full_res (bool): Use rembg's full-resolution mask instead of the low-res guided one
+
+        Returns:
+            Image.Image: "L" mask of the (EXIF-oriented) image size, 255 = subject
+
+        Example:
+            mask = await remover.get_mask("person.jpg", "uuid")
+        """
+        # Inference runs in a worker thread: the loop stays free (progress streams keep flowing)
+        return await asyncio.to_thread(self._mask_image, source, file_id, full_res)
+
+    def _mask_image(self, source, file_id: str, full_res: bool = False) -> Image.Image:
+        with timer_step("Loading image for mask", file_id):
+            img = _load_rgb(source)
+            observe_image(img.size)
+        if full_res:
+            return self._predict_mask_full_res(img, file_id)
+        return Image.fromarray(self._predict_mask(img, file_id), 'L')
+
+    def _predict_mask_full_res(self, img: Image.Image, file_id: str) -> Image.Image:
+        """rembg's own mask at img.size (the model input is the full image, its output resized by rembg)"""
+        with timer_step("Loading rembg session", file_id):
+            session = get_rembg_session()
+            remove_func = get_rembg()
+        with timer_step("AI mask prediction (full resolution)", file_id):
+            mask = remove_func(img, session=session, only_mask=True).convert('L')
+            logger.info(f"[{file_id}] 🤖 Mask predicted at {img.size[0]}x{img.size[1]}")
+        return mask
+
+    def _predict_mask(self, img: Image.Image, file_id: str) -> np.ndarray:
+        """Low-res rembg inference + guided upsampling to img.size"""
+        with timer_step("Loading rembg session", file_id):
+            session = get_rembg_session()
+
+        scale = MASK_MAX_SIDE / max(img.size)
+        with timer_step("AI mask prediction", file_id):
+            small = img
+            if scale < 1:
+                small = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                                   Image.Resampling.BILINEAR, reducing_gap=2.0)
+            mask = np.asarray(session.predict(small)[0].convert('L'))
+            logger.info(f"[{file_id}] 🤖 Mask predicted at {small.size[0]}x{small.size[1]}")
+
+        if small is img:
+            return mask
+        with timer_step("Guided mask upsampling", file_id):
+            return guided_upsample(mask, np.asarray(img.convert('L')))
+
+    async def _remove_background_lowres(self, input_path: str, file_id: str, output: str = "png") -> str:
+        """Remove background with a low-res mask; the full-res image is touched once, in NumPy"""
+        logger.info(f"[{file_id}] 🔧 Using low-res mask method for background removal")
+
+        try:
+            with timer_step("Loading input image", file_id):
+                img = _load_rgb(input_path)
+                observe_image(img.size)
+                logger.info(f"[{file_id}] 📖 Loaded image: {img.size}")
+
+            alpha = self._predict_mask(img, file_id)
+
+            with timer_step("Compositing cutout", file_id):
+                if output == "mask":
+                    result = Image.fromarray(alpha, 'L')
+                else:
+                    rgb = np.asarray(img)
+                    if output == "bbox_cropped":
+                        # Crop before compositing: only the subject's pixels are copied and encoded
+                        bbox = subject_bbox(alpha)
+                        if bbox is not None:
+                            left, top, right, bottom = bbox
+                            rgb, alpha = rgb[top:bottom, left:right], alpha[top:bottom, left:right]
+                    cutout = np.dstack((rgb, alpha))
+                    # Zero fully transparent pixels like rembg's cutout: identical look, far smaller files
+                    cutout[alpha == 0] = 0
+                    result = Image.fromarray(cutout, 'RGBA')
+
+            with timer_step("Saving result", file_id):
+                output_path = self._save_output(result, file_id, output)
+                logger.info(f"[{file_id}] 💾 Result saved to: {output_path}")
+
+            logger.info(f"[{file_id}] ✅ Background removed successfully with low-res mask: {output_path}")
+            return output_path
+
+        except Exception as e:
+            logger.error(f"[{file_id}] ❌ Error removing background with low-res mask: {e}")
+            raise
+
+    def _crop_to_subject(self, cutout: Image.Image, file_id: str) -> Image.Image:
+        """Crop an RGBA cutout to subject_bbox of its alpha (unchanged when nothing is opaque)"""
+        bbox = subject_bbox(np.asarray(cutout.getchannel('A')))
+        if bbox is None:
+            logger.warning(f"[{file_id}] ⚠️ No subject found in mask, keeping full frame")
+            return cutout
+        logger.info(f"[{file_id}] ✂️ Cropped to subject box {bbox}")
+        return cutout.crop(bbox)
+
+    def _save_output(self, result: Image.Image, file_id: str, output: str) -> str:
+        """Encode a cutout (RGBA) or mask (L) as the requested output mode (PNG settings from the encoder profile)"""
+        suffix, _ = OUTPUT_MODES[output]
+        if output == "mask" and result.mode != 'L':
+            result = result.getchannel('A')
+        options = {}
+        if output == "cutout_webp":
+            options = {"quality": CUTOUT_WEBP_QUALITY, "method": CUTOUT_WEBP_METHOD}
+        elif output == "png_fast":
+            options = {"compress_level": PNG_FAST_COMPRESS_LEVEL, "optimize": False}
+
+        with result_store.writing(f"{file_id}{suffix}") as output_path:
+            save_image(result, output_path, **options)
+        return output_path
+
+    async def _remove_background_lbm(self, input_path: str, file_id: str, output: str = "png") -> str:
         """Remove background using jasperai/LBM_relighting method"""
         logger.info(f"[{file_id}] 🔧 Using LBM method for background removal")
         
@@ -137,7 +377,7 @@ class BackgroundRemover:
                 # Placeholder for LBM API call
                 # В реальном проекте здесь был бы вызов к jasperai API
                 logger.warning(f"[{file_id}] ⚠️ LBM method not fully implemented - using rembg as fallback")
-                return await self._remove_background_rembg(input_path, file_id)
+                return await self._remove_background_rembg(input_path, file_id, output)
                 
         except Exception as e:
             logger.error(f"[{file_id}] ❌ Error removing background with LBM: {e}")
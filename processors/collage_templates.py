@@ -0,0 +1,258 @@
+"""
+Declarative collage templates.
+
+A template describes a collage instead of drawing it: canvas size and colour,
+photo slots, static decorations drawn under the photos (filmstrip sprocket holes,
+postcard borders and writing lines), an overlay drawn over them (the logo line)
+and caption boxes filled per request. The static layers depend only on the
+template, so they are rendered once per template and canvas size and cached;
+per request CollageMaker only loads the tiles, copies the cached background,
+pastes the tiles into their slots and draws the caption.
+
+Layouts whose geometry depends on the number of photos (grid, universal,
+filmstrip, magazine) are built per photo count by cached factories.
+"""
+import math
+import logging
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_SIZE = 64  # per factory: distinct photo counts whose layers stay rendered
+
+
+class Slot:
+    """Where one input photo goes on the canvas and how it is fitted."""
+
+    __slots__ = ("box", "fit", "align", "source")
+
+    def __init__(self, box: tuple, fit: str = "contain", align: str = "center", source: int = None):
+        self.box = box        # (x, y, width, height)
+        self.fit = fit        # "square": centre square crop scaled to the box; "contain": shrunk to fit, aspect
+                              # kept; "passport": landscape photos cropped to a square, then scaled to the box
+        self.align = align    # placement of a "contain" tile smaller than the box: "center", "top", "top-left"
+        self.source = source  # index of the input photo (None: the slot's own position)
+
+    @property
+    def size(self) -> tuple:
+        return self.box[2], self.box[3]
+
+    def position(self, tile_size: tuple) -> tuple:
+        """Top-left corner for a prepared tile of `tile_size`"""
+        x, y, width, height = self.box
+        if self.align == "top-left":
+            return x, y
+        if self.align == "top":
+            return x + (width - tile_size[0]) // 2, y
+        return x + (width - tile_size[0]) // 2, y + (height - tile_size[1]) // 2
+
+
+class CaptionBox:
+    """Where the request's caption text is drawn."""
+
+    __slots__ = ("xy", "fill", "anchor", "max_chars")
+
+    def __init__(self, xy: tuple, fill="black", anchor: str = "mm", max_chars: int = None):
+        self.xy = xy
+        self.fill = fill
+        self.anchor = anchor
+        self.max_chars = max_chars
+
+
+class CollageTemplate:
+    """
+    One collage layout, with its static layers rendered on first use.
+
+    Decorations and overlay items are (ImageDraw method, xy, options) tuples,
+    e.g. ("ellipse", [5, 0, 13, 8], {"fill": "white"}) or
+    ("text", (300, 780), {"text": "PhotoProcessor", "fill": "gray", "anchor": "mm"}).
+    """
+
+    __slots__ = ("name", "title", "size", "slots", "background", "decorations", "overlay", "captions",
+                 "min_images", "_background_layer", "_overlay_layer")
+
+    def __init__(self, name: str, title: str, size: tuple, slots: list, background="white",
+                 decorations: list = (), overlay: list = (), captions: list = (), min_images: int = 1):
+        self.name = name              # output suffix: <file_id>_<name>.jpg
+        self.title = title            # for logs
+        self.size = size
+        self.slots = slots
+        self.background = background
+        self.decorations = decorations
+        self.overlay = overlay
+        self.captions = captions
+        self.min_images = min_images  # fewer photos fall back to the universal layout
+        self._background_layer = None
+        self._overlay_layer = None
+
+    def tile_requests(self) -> list:
+        """(source index, fit, size) of every slot, in slot order"""
+        return [(index if slot.source is None else slot.source, slot.fit, slot.size)
+                for index, slot in enumerate(self.slots)]
+
+    def compose(self, tiles: list, caption: str = "") -> Image.Image:
+        """Canvas with `tiles` (one prepared image per slot) pasted in and the caption drawn"""
+        canvas = self._static_background().copy()
+        for slot, tile in zip(self.slots, tiles):
+            canvas.paste(tile, slot.position(tile.size))
+
+        overlay = self._static_overlay()
+        if overlay is not None:
+            layer, offset = overlay
+            canvas.paste(layer, offset, layer)
+
+        if caption and self.captions:
+            try:
+                draw = ImageDraw.Draw(canvas)
+                for box in self.captions:
+                    draw.text(box.xy, caption[:box.max_chars], fill=box.fill, anchor=box.anchor)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not add caption to {self.name}: {e}")
+        return canvas
+
+    def _static_background(self) -> Image.Image:
+        if self._background_layer is None:
+            layer = Image.new("RGB", self.size, self.background)
+            _draw_items(ImageDraw.Draw(layer), self.decorations)
+            self._background_layer = layer
+        return self._background_layer
+
+    def _static_overlay(self):
+        """(RGBA layer cropped to its content, offset), None without overlay items"""
+        if self._overlay_layer is None and self.overlay:
+            layer = Image.new("RGBA", self.size, (0, 0, 0, 0))
+            _draw_items(ImageDraw.Draw(layer), self.overlay)
+            bbox = layer.getbbox() or (0, 0, 1, 1)
+            self._overlay_layer = (layer.crop(bbox), bbox[:2])
+        return self._overlay_layer
+
+
+def _draw_items(draw: ImageDraw.ImageDraw, items):
+    for method, xy, options in items:
+        getattr(draw, method)(xy, **options)
+
+
+# Fixed layouts
+
+POLAROID = CollageTemplate(
+    "polaroid", "📸 Polaroid style photo", (500, 600),
+    slots=[Slot((50, 50, 400, 400), fit="square")],
+    captions=[CaptionBox((250, 520))],
+)
+
+STRIP_5X15 = CollageTemplate(
+    # 5x15 cm = roughly 2:6 ratio: 3 photos fitted to the width, one under another
+    "5x15_collage", "📐 5x15 collage", (400, 1200),
+    slots=[Slot((10, 10 + i * 396, 380, 386), align="top") for i in range(3)],
+    min_images=3,
+)
+
+SQUARE_5X5 = CollageTemplate(
+    "5x5_collage", "⬜ 5x5 square collage", (600, 600),
+    slots=[Slot((10, 10 + i * 295, 580, 285), align="top") for i in range(2)],
+    min_images=2,
+)
+
+PASSPORT = CollageTemplate(
+    # 4 copies of one photo, 2x2
+    "passport_style", "🆔 Passport style photos", (330, 430),
+    slots=[Slot((x, y, 150, 200), fit="passport", source=0) for x, y in ((10, 10), (160, 10), (10, 210), (160, 210))],
+)
+
+POSTCARD_INK = "#8B4513"
+
+VINTAGE_POSTCARD = CollageTemplate(
+    # Photo on the left, divider and writing lines on the right of a beige card
+    "vintage_postcard", "📮 Vintage postcard", (600, 400), background="#F5F5DC",
+    slots=[Slot((20, 20, 400, 300), align="top-left")],
+    decorations=[
+        ("rectangle", [5, 5, 594, 394], {"outline": POSTCARD_INK, "width": 3}),
+        ("rectangle", [15, 15, 584, 384], {"outline": "#D2691E", "width": 1}),
+        ("line", [440, 30, 440, 370], {"fill": POSTCARD_INK, "width": 2}),
+    ] + [("line", [450, 60 + i * 30, 570, 60 + i * 30], {"fill": "#D3D3D3", "width": 1}) for i in range(5)],
+    captions=[CaptionBox((460, 80), fill=POSTCARD_INK, anchor="la", max_chars=50)],
+)
+
+
+# Layouts sized by the number of photos
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def universal_template(count: int, background=(255, 255, 255), logo_text: str = "PhotoProcessor",
+                       with_caption: bool = True) -> CollageTemplate:
+    """Square tiles in a near-square grid with the caption and logo below"""
+    if count < 1:
+        raise ValueError("No images provided for collage")
+    tile, margin = 300, 20
+    columns = int(math.ceil(math.sqrt(count)))
+    rows = int(math.ceil(count / columns))
+    width = columns * tile + (columns + 1) * margin
+    height = rows * tile + (rows + 1) * margin + 100  # Extra space for text
+    slots = [Slot((margin + (i % columns) * (tile + margin), margin + (i // columns) * (tile + margin), tile, tile),
+                  fit="square") for i in range(count)]
+    overlay = [("text", (width // 2, height - 20), {"text": logo_text, "fill": "gray", "anchor": "mm"})] if logo_text else []
+    captions = [CaptionBox((width // 2, height - 60))] if with_caption else []
+    return CollageTemplate("universal_collage", f"🔧 Universal collage of {count}", (width, height), slots,
+                           background=background, overlay=overlay, captions=captions)
+
+
+def grid_template(count: int) -> CollageTemplate:
+    """Universal layout on light grey, without the caption"""
+    return universal_template(count, background=(240, 240, 240), with_caption=False)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def filmstrip_template(count: int) -> CollageTemplate:
+    """Up to 6 frames on a black strip with sprocket holes down both edges"""
+    frames = min(count, 6)
+    frame_width, frame_height, border, hole = 200, 150, 20, 8
+    width = frame_width + 2 * border
+    height = (frame_height + border) * frames + border
+    holes = []
+    for y in range(0, height, 20):
+        holes.append(("ellipse", [5, y, 5 + hole, y + hole], {"fill": "white"}))
+        holes.append(("ellipse", [width - 5 - hole, y, width - 5, y + hole], {"fill": "white"}))
+    slots = [Slot((border, border + i * (frame_height + border), frame_width, frame_height)) for i in range(frames)]
+    return CollageTemplate("filmstrip", f"🎬 Filmstrip of {frames}", (width, height), slots,
+                           background="black", decorations=holes, min_images=0)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def magazine_template(count: int) -> CollageTemplate:
+    """Main photo at the top, up to 3 thumbnails along the bottom, title in between"""
+    width, height, thumb = 600, 800, 80
+    slots = [Slot((20, 20, width - 40, 500), align="top-left")] if count else []
+    slots += [Slot((20 + i * (thumb + 10), height - thumb - 20, thumb, thumb), align="top-left")
+              for i in range(min(count, 4) - 1)]
+    return CollageTemplate("magazine_cover", "📰 Magazine cover", (width, height), slots,
+                           captions=[CaptionBox((width // 2, height - 150))], min_images=0)
+
+
+# collage_type -> template for a number of photos
+TEMPLATES = {
+    "polaroid": lambda count: POLAROID,
+    "5x15": lambda count: STRIP_5X15,
+    "5x5": lambda count: SQUARE_5X5,
+    "magazine": magazine_template,
+    "passport": lambda count: PASSPORT,
+    "filmstrip": filmstrip_template,
+    "grid": grid_template,
+    "vintage_postcard": lambda count: VINTAGE_POSTCARD,
+}
+
+
+def get_template(collage_type: str, count: int) -> CollageTemplate:
+    """
+    Template for `count` photos; unknown types and too few photos get the universal layout.
+
+    Example:
+        get_template("filmstrip", 4).compose(tiles)
+    """
+    factory = TEMPLATES.get(collage_type)
+    if factory is not None:
+        template = factory(count)
+        if count >= template.min_images:
+            return template
+    return universal_template(count)
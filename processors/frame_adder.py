@@ -1,26 +1,16 @@
 import os
 import logging
-from contextlib import contextmanager
-import time
 from PIL import Image, ImageDraw, ImageFilter
 import cv2
 import numpy as np
 
+from processors.instrumentation import timer_step, observe_image
+from processors.encoding import save_image
+from processors.storage import result_store
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function for timing operations
-@contextmanager
-def timer_step(step_name: str, file_id: str = None):
-    start_time = time.time()
-    request_prefix = f"[{file_id}] " if file_id else ""
-    logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
-    try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
-
 class FrameAdder:
     """
     Professional frame addition system for images with multiple style options.
@@ -64,6 +54,7 @@ class FrameAdder:
             with timer_step("Loading image for frame addition", file_id):
                 img = Image.open(image_path)
                 original_size = img.size
+                observe_image(original_size)
                 logger.info(f"[{file_id}] 📖 Original image size: {original_size}")
             
             with timer_step("Creating frame", file_id):
@@ -71,9 +62,8 @@ class FrameAdder:
                 logger.info(f"[{file_id}] ✅ Frame created successfully")
             
             with timer_step("Saving framed result", file_id):
-                output_path = f"processed/{file_id}_framed_{frame_style}.jpg"
-                os.makedirs("processed", exist_ok=True)
-                framed_img.save(output_path, 'JPEG', quality=90, optimize=True)
+                with result_store.writing(f"{file_id}_framed_{frame_style}.jpg") as output_path:
+                    save_image(framed_img, output_path)
                 logger.info(f"[{file_id}] 💾 Framed image saved to: {output_path}")
             
             logger.info(f"[{file_id}] ✅ Frame addition completed successfully: {output_path}")
@@ -91,6 +81,7 @@ class FrameAdder:
             with timer_step("Loading images for custom frame", file_id):
                 img = Image.open(image_path)
                 frame_img = Image.open(frame_path)
+                observe_image(img.size)
                 logger.info(f"[{file_id}] 📖 Image size: {img.size}, Frame size: {frame_img.size}")
             
             with timer_step("Processing custom frame", file_id):
@@ -108,9 +99,8 @@ class FrameAdder:
                 logger.info(f"[{file_id}] ✅ Custom frame applied successfully")
             
             with timer_step("Saving custom framed result", file_id):
-                output_path = f"processed/{file_id}_custom_framed.png"
-                os.makedirs("processed", exist_ok=True)
-                result.save(output_path, 'PNG', optimize=True)
+                with result_store.writing(f"{file_id}_custom_framed.png") as output_path:
+                    save_image(result, output_path)
                 logger.info(f"[{file_id}] 💾 Custom framed image saved to: {output_path}")
             
             logger.info(f"[{file_id}] ✅ Custom frame addition completed successfully: {output_path}")
@@ -0,0 +1,300 @@
+import os
+import re
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from processors import progress
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Latency buckets in seconds: image steps range from milliseconds (crop math) to tens of seconds (rembg on 48 MP)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Upper bounds of the image size buckets used for the `megapixels` label
+MEGAPIXEL_BUCKETS = (1, 4, 12, 24, 48)
+
+# Label values beyond this many series per metric are folded into "other"
+MAX_SERIES_PER_METRIC = 500
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _LabeledMetric:
+    """Base of in-process metrics: lazily created series per label combination."""
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= MAX_SERIES_PER_METRIC:
+            key = tuple("other" for _ in self.labelnames)
+        return key
+
+
+class Counter(_LabeledMetric):
+    """Monotonic counter with labels, rendered in Prometheus text format."""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            snapshot = dict(self._series)
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in sorted(snapshot.items())
+        ]
+
+
+class Histogram(_LabeledMetric):
+    """
+    In-process cumulative histogram with labels, rendered in Prometheus text format.
+
+    Series are created lazily per label combination. Observation cost is one
+    bisect plus a few additions under a lock, cheap enough for per-stage timing.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Initialize histogram with metric name, help text, label names and bucket bounds."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+        lines = []
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            base = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(base + [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics exported together at /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+OPERATION_DURATION = REGISTRY.register(Histogram(
+    "photo_operation_duration_seconds",
+    "Duration of a whole image processing operation",
+    ("operation", "method", "megapixels", "status"),
+))
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "photo_stage_duration_seconds",
+    "Duration of a single timer_step stage inside an image processing operation",
+    ("operation", "method", "megapixels", "stage"),
+))
+
+
+def render_prometheus() -> str:
+    """Render all registered metrics in Prometheus text exposition format (version 0.0.4)"""
+    return REGISTRY.render()
+
+
+def megapixel_bucket(size) -> str:
+    """Map an image (width, height) to a coarse size label such as '4-12MP'"""
+    megapixels = size[0] * size[1] / 1_000_000
+    lower = 0
+    for upper in MEGAPIXEL_BUCKETS:
+        if megapixels < upper:
+            return f"<{upper}MP" if lower == 0 else f"{lower}-{upper}MP"
+        lower = upper
+    return f"{lower}+MP"
+
+
+class OperationContext:
+    """Labels of the operation currently running in this request/task."""
+
+    __slots__ = ("operation", "method", "megapixels")
+
+    def __init__(self, operation: str, method: str = ""):
+        self.operation = operation
+        self.method = method
+        self.megapixels = "unknown"
+
+
+_current_operation = ContextVar("instrumentation_operation", default=None)
+
+
+@contextmanager
+def track_operation(operation: str, method: str = ""):
+    """
+    Label everything timed inside the block with `operation` and `method`.
+
+    Records the total duration of the block into photo_operation_duration_seconds.
+    Nested calls (e.g. background removal inside person swap) keep the outer labels.
+
+    Example:
+        with track_operation("smart_crop", aspect_ratio):
+            return await self.smart_cropper.smart_crop(image_path, aspect_ratio, file_id)
+    """
+    if _current_operation.get() is not None:
+        yield _current_operation.get()
+        return
+
+    context = OperationContext(operation, method or "")
+    token = _current_operation.set(context)
+    start_time = time.perf_counter()
+    status = "error"
+    try:
+        yield context
+        status = "ok"
+    finally:
+        _current_operation.reset(token)
+        if METRICS_ENABLED:
+            OPERATION_DURATION.observe(time.perf_counter() - start_time, operation=context.operation,
+                                       method=context.method, megapixels=context.megapixels, status=status)
+
+
+def observe_image(size):
+    """Report the (width, height) of the image being processed for the megapixels label"""
+    context = _current_operation.get()
+    if context is not None and context.megapixels == "unknown":
+        context.megapixels = megapixel_bucket(size)
+
+
+# Per-request list of (stage, seconds) pairs, set by the request logging middleware
+_stage_sink = ContextVar("instrumentation_stage_sink", default=None)
+
+
+@contextmanager
+def collect_stages():
+    """
+    Collect every timer_step finished inside the block as (stage_name, seconds) pairs.
+
+    Example:
+        with collect_stages() as stages:
+            response = await call_next(request)
+        log_request_summary(request, response.status_code, duration, stages)
+    """
+    stages = []
+    token = _stage_sink.set(stages)
+    try:
+        yield stages
+    finally:
+        _stage_sink.reset(token)
+
+
+def _stage_label(step_name: str) -> str:
+    # "Compositing person on background 3" -> "Compositing person on background N" keeps cardinality bounded
+    return re.sub(r"\d+", "N", step_name)
+
+
+# Helper function for timing operations
+@contextmanager
+def timer_step(step_name: str, file_id: str = None):
+    """
+    Time one processing stage: log it, record it in the stage histogram and report progress.
+
+    Log lines are only formatted when INFO is enabled for this logger, so with logging
+    turned down the cost is two perf_counter calls and one histogram observation.
+
+    Args:
+        step_name (str): Human readable stage name
+        file_id (str, optional): Request/file identifier used as log prefix
+
+    Example:
+        with timer_step("Loading image for cropping", file_id):
+            img = Image.open(image_path)
+    """
+    log_enabled = logger.isEnabledFor(logging.INFO)
+    request_prefix = f"[{file_id}] " if file_id else ""
+    if log_enabled:
+        logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
+    progress.stage_started(step_name)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        if log_enabled:
+            logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
+        progress.stage_finished(step_name, duration)
+        stages = _stage_sink.get()
+        if stages is not None:
+            stages.append((step_name, duration))
+        if METRICS_ENABLED:
+            context = _current_operation.get()
+            if context is not None:
+                STAGE_DURATION.observe(duration, operation=context.operation, method=context.method,
+                                       megapixels=context.megapixels, stage=_stage_label(step_name))
+            else:
+                STAGE_DURATION.observe(duration, operation="unknown", method="", megapixels="unknown",
+                                       stage=_stage_label(step_name))
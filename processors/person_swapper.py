@@ -1,24 +1,25 @@
 import os
+import asyncio
 import logging
-from contextlib import contextmanager
-import time
-from PIL import Image
+from PIL import Image, ImageOps
 from processors.background_remover import BackgroundRemover
+from processors import progress
+from processors.instrumentation import timer_step, observe_image
+from processors.encoding import save_image
+from processors.storage import result_store
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function for timing operations
-@contextmanager
-def timer_step(step_name: str, file_id: str = None):
-    start_time = time.time()
-    request_prefix = f"[{file_id}] " if file_id else ""
-    logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
-    try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
+# Person cutouts use the low-res guided mask by default (BackgroundRemover.get_mask); true restores
+# rembg's full-resolution mask, slower on large photos (compare: python -m benchmarks.mask_parity)
+PERSON_SWAP_FULLRES_MASK = os.getenv("PERSON_SWAP_FULLRES_MASK", "false").lower() in ("1", "true", "yes")
+
+
+def _load_person(path: str) -> Image.Image:
+    """EXIF-oriented RGB decode of the person photo"""
+    return ImageOps.exif_transpose(Image.open(path)).convert('RGB')
+
 
 class PersonSwapper:
     """
@@ -70,13 +71,21 @@ class PersonSwapper:
                 logger.info(f"[{file_id}] 🏞️ Background images: {len(background_paths)}")
             
             results = []
+            progress.set_total(len(background_paths))
+            
+            try:
+                person_img = await self._extract_person(person_path, file_id, 0)
+            except Exception as e:
+                logger.error(f"[{file_id}] ❌ Error extracting person: {e}")
+                return results
             
             for i, bg_path in enumerate(background_paths):
                 try:
                     result_path = await self._swap_person_to_background(
-                        person_path, bg_path, file_id, 0, i
+                        person_img, bg_path, file_id, 0, i
                     )
                     results.append(result_path)
+                    progress.partial_result(result_path, person=0, background=i)
                 except Exception as e:
                     logger.error(f"[{file_id}] ❌ Error swapping person to background {i}: {e}")
             
@@ -93,15 +102,24 @@ class PersonSwapper:
         
         try:
             results = []
+            progress.set_total(len(person_paths) * len(background_paths))
             
             with timer_step("Processing person-background combinations", file_id):
                 for person_idx, person_path in enumerate(person_paths):
+                    # One mask per person, reused for every background
+                    try:
+                        person_img = await self._extract_person(person_path, file_id, person_idx)
+                    except Exception as e:
+                        logger.error(f"[{file_id}] ❌ Error extracting person {person_idx}: {e}")
+                        continue
+                    
                     for bg_idx, bg_path in enumerate(background_paths):
                         try:
                             result_path = await self._swap_person_to_background(
-                                person_path, bg_path, file_id, person_idx, bg_idx
+                                person_img, bg_path, file_id, person_idx, bg_idx
                             )
                             results.append(result_path)
+                            progress.partial_result(result_path, person=person_idx, background=bg_idx)
                         except Exception as e:
                             logger.error(f"[{file_id}] ❌ Error swapping person {person_idx} to background {bg_idx}: {e}")
             
@@ -112,75 +130,70 @@ class PersonSwapper:
             logger.error(f"[{file_id}] ❌ Error in separate person swap: {e}")
             raise
 
-    async def _swap_person_to_background(self, person_path: str, background_path: str, 
+    async def _extract_person(self, person_path: str, file_id: str, person_idx: int) -> Image.Image:
+        """Вырезает человека один раз: RGBA-изображение с маской из BackgroundRemover.get_mask (PERSON_SWAP_FULLRES_MASK)"""
+        with timer_step(f"Removing background from person {person_idx}", file_id):
+            person_img = await asyncio.to_thread(_load_person, person_path)
+            mask = await self.background_remover.get_mask(person_img, f"{file_id}_person_{person_idx}",
+                                                       full_res=PERSON_SWAP_FULLRES_MASK)
+            person_img.putalpha(mask)
+            logger.info(f"[{file_id}] ✂️ Person {person_idx} extracted: {person_img.size}")
+            return person_img
+
+    async def _swap_person_to_background(self, person_img: Image.Image, background_path: str, 
                                        file_id: str, person_idx: int, bg_idx: int) -> str:
-        """Подставляет одного человека на один фон"""
+        """Подставляет одного человека (RGBA-вырезку) на один фон"""
         logger.info(f"[{file_id}] 🔄 Swapping person {person_idx} to background {bg_idx}")
         
         try:
-            with timer_step(f"Removing background from person {person_idx}", file_id):
-                # Remove background from person image
-                person_no_bg_path = await self.background_remover.remove_background(
-                    person_path, f"{file_id}_person_{person_idx}", "rembg"
-                )
-                logger.info(f"[{file_id}] ✂️ Person background removed: {person_no_bg_path}")
-            
-            with timer_step(f"Compositing person on background {bg_idx}", file_id):
-                # Load images
-                person_img = Image.open(person_no_bg_path)
-                background_img = Image.open(background_path)
-                
-                # Convert person image to RGBA if not already
-                if person_img.mode != 'RGBA':
-                    person_img = person_img.convert('RGBA')
-                
-                # Scale person to fit background proportionally
-                bg_width, bg_height = background_img.size
-                person_width, person_height = person_img.size
-                
-                # Calculate scale to fit person nicely (about 60% of background height)
-                target_height = int(bg_height * 0.6)
-                scale_factor = target_height / person_height
-                new_person_width = int(person_width * scale_factor)
-                new_person_height = target_height
-                
-                # Resize person
-                person_resized = person_img.resize((new_person_width, new_person_height), Image.Resampling.LANCZOS)
-                
-                # Position person (center-bottom)
-                x_pos = (bg_width - new_person_width) // 2
-                y_pos = bg_height - new_person_height - 20  # Small margin from bottom
-                
-                # Ensure position is within bounds
-                x_pos = max(0, min(x_pos, bg_width - new_person_width))
-                y_pos = max(0, min(y_pos, bg_height - new_person_height))
-                
-                # Composite images
-                if background_img.mode != 'RGBA':
-                    background_img = background_img.convert('RGBA')
-                
-                result = background_img.copy()
-                result.paste(person_resized, (x_pos, y_pos), person_resized)
-                
-                # Convert back to RGB for saving
-                final_result = Image.new('RGB', result.size, (255, 255, 255))
-                final_result.paste(result, mask=result.split()[-1] if result.mode == 'RGBA' else None)
-                
-                # Save result
-                output_path = f"processed/{file_id}_swap_p{person_idx}_bg{bg_idx}.jpg"
-                os.makedirs("processed", exist_ok=True)
-                final_result.save(output_path, 'JPEG', quality=90, optimize=True)
-                
-                logger.info(f"[{file_id}] 🎭 Person swap completed: {output_path}")
-                
-                # Clean up temporary file
-                try:
-                    os.remove(person_no_bg_path)
-                except Exception:
-                    pass
-                
-                return output_path
-                
+            # Blocking PIL work in a worker thread so the loop keeps streaming progress meanwhile
+            return await asyncio.to_thread(self._composite, person_img, background_path, file_id, person_idx, bg_idx)
         except Exception as e:
             logger.error(f"[{file_id}] ❌ Error swapping person {person_idx} to background {bg_idx}: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def _composite(self, person_img: Image.Image, background_path: str,
+                   file_id: str, person_idx: int, bg_idx: int) -> str:
+        """Scale the cutout, paste it centre-bottom on the background and save the result"""
+        with timer_step(f"Compositing person on background {bg_idx}", file_id):
+            background_img = Image.open(background_path)
+            observe_image(background_img.size)
+            
+            # Scale person to fit background proportionally
+            bg_width, bg_height = background_img.size
+            person_width, person_height = person_img.size
+            
+            # Calculate scale to fit person nicely (about 60% of background height)
+            target_height = int(bg_height * 0.6)
+            scale_factor = target_height / person_height
+            new_person_width = int(person_width * scale_factor)
+            new_person_height = target_height
+            
+            # Resize person
+            person_resized = person_img.resize((new_person_width, new_person_height), Image.Resampling.LANCZOS)
+            
+            # Position person (center-bottom)
+            x_pos = (bg_width - new_person_width) // 2
+            y_pos = bg_height - new_person_height - 20  # Small margin from bottom
+            
+            # Ensure position is within bounds
+            x_pos = max(0, min(x_pos, bg_width - new_person_width))
+            y_pos = max(0, min(y_pos, bg_height - new_person_height))
+            
+            # Composite images
+            if background_img.mode != 'RGBA':
+                background_img = background_img.convert('RGBA')
+            
+            result = background_img.copy()
+            result.paste(person_resized, (x_pos, y_pos), person_resized)
+            
+            # Convert back to RGB for saving
+            final_result = Image.new('RGB', result.size, (255, 255, 255))
+            final_result.paste(result, mask=result.split()[-1] if result.mode == 'RGBA' else None)
+            
+            # Save result
+            with result_store.writing(f"{file_id}_swap_p{person_idx}_bg{bg_idx}.jpg") as output_path:
+                save_image(final_result, output_path)
+            
+            logger.info(f"[{file_id}] 🎭 Person swap completed: {output_path}")
+            return output_path
@@ -1,25 +1,34 @@
 import os
+import math
 import logging
-from contextlib import contextmanager
-import time
 from PIL import Image, ImageEnhance, ImageFilter
 import cv2
 import numpy as np
 
+from processors.instrumentation import timer_step, observe_image
+from processors.encoding import save_image
+from processors.storage import result_store
+from processors.tiling import map_tiles, process_tiled, plan_workers, plan_tile_size, DEFAULT_TILE_SIZE
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function for timing operations
-@contextmanager
-def timer_step(step_name: str, file_id: str = None):
-    start_time = time.time()
-    request_prefix = f"[{file_id}] " if file_id else ""
-    logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
-    try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
+# Enhancement settings shared by the whole-image and tiled paths
+BRIGHTNESS_FACTOR = 1.05
+CONTRAST_FACTOR = 1.1
+COLOR_FACTOR = 1.08
+SHARPNESS_FACTOR = 1.15
+BILATERAL_DIAMETER = 9
+BILATERAL_SIGMA = 75
+SMOOTHING_RADIUS = 0.8
+SMOOTHING_BLEND = 0.2
+
+# Images from this size up are always retouched tile by tile (bounded memory); smaller ones
+# only when the tile pool has spare cores and the image is big enough to split (see plan_workers)
+TILED_RETOUCH_MIN_MP = float(os.getenv("RETOUCH_TILED_MIN_MP", "16"))
+# Context a tile needs so seams match the whole-image result:
+# SMOOTH kernel (sharpness) 1px + bilateral radius + gaussian support (~3 sigma)
+RETOUCH_TILE_OVERLAP = 1 + BILATERAL_DIAMETER // 2 + math.ceil(3 * SMOOTHING_RADIUS)
 
 class PhotoRetoucher:
     """
@@ -62,16 +71,20 @@ class PhotoRetoucher:
             with timer_step("Loading image for retouching", file_id):
                 img = Image.open(image_path)
                 original_size = img.size
+                observe_image(original_size)
                 logger.info(f"[{file_id}] 📖 Original image size: {original_size}")
             
             with timer_step("Applying enhancement filters", file_id):
-                enhanced_img = self._apply_enhancements(img, file_id)
+                pixels = original_size[0] * original_size[1]
+                if pixels >= TILED_RETOUCH_MIN_MP * 1_000_000 or plan_workers(pixels) > 1:
+                    enhanced_img = self._apply_enhancements_tiled(img, file_id)
+                else:
+                    enhanced_img = self._apply_enhancements(img, file_id)
                 logger.info(f"[{file_id}] ✅ Enhancements applied successfully")
             
             with timer_step("Saving retouched result", file_id):
-                output_path = f"processed/{file_id}_retouched.jpg"
-                os.makedirs("processed", exist_ok=True)
-                enhanced_img.save(output_path, 'JPEG', quality=92, optimize=True)
+                with result_store.writing(f"{file_id}_retouched.jpg") as output_path:
+                    save_image(enhanced_img, output_path)
                 logger.info(f"[{file_id}] 💾 Retouched image saved to: {output_path}")
             
             logger.info(f"[{file_id}] ✅ Photo retouching completed successfully: {output_path}")
@@ -91,22 +104,22 @@ class PhotoRetoucher:
         
         # 1. Brightness adjustment
         enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1.05)  # Slight brightness increase
+        img = enhancer.enhance(BRIGHTNESS_FACTOR)  # Slight brightness increase
         logger.info(f"[{file_id}] ☀️ Brightness enhanced")
         
         # 2. Contrast enhancement
         enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.1)  # Moderate contrast boost
+        img = enhancer.enhance(CONTRAST_FACTOR)  # Moderate contrast boost
         logger.info(f"[{file_id}] 🌈 Contrast enhanced")
         
         # 3. Color saturation
         enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(1.08)  # Slight saturation boost
+        img = enhancer.enhance(COLOR_FACTOR)  # Slight saturation boost
         logger.info(f"[{file_id}] 🎨 Color saturation enhanced")
         
         # 4. Sharpness enhancement
         enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(1.15)  # Moderate sharpening
+        img = enhancer.enhance(SHARPNESS_FACTOR)  # Moderate sharpening
         logger.info(f"[{file_id}] 🔍 Sharpness enhanced")
         
         # 5. Noise reduction (using bilateral filter via OpenCV)
@@ -115,7 +128,7 @@ class PhotoRetoucher:
             img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
             
             # Apply bilateral filter for noise reduction while preserving edges
-            filtered = cv2.bilateralFilter(img_cv, 9, 75, 75)
+            filtered = cv2.bilateralFilter(img_cv, BILATERAL_DIAMETER, BILATERAL_SIGMA, BILATERAL_SIGMA)
             
             # Convert back to PIL
             img = Image.fromarray(cv2.cvtColor(filtered, cv2.COLOR_BGR2RGB))
@@ -127,14 +140,63 @@ class PhotoRetoucher:
         # 6. Subtle gaussian blur for skin smoothing (very light)
         try:
             # Create a blurred version
-            blurred = img.filter(ImageFilter.GaussianBlur(radius=0.8))
+            blurred = img.filter(ImageFilter.GaussianBlur(radius=SMOOTHING_RADIUS))
             
             # Blend original with blurred (20% blur, 80% original)
-            img = Image.blend(img, blurred, 0.2)
+            img = Image.blend(img, blurred, SMOOTHING_BLEND)
             logger.info(f"[{file_id}] 🌟 Skin smoothing applied")
             
         except Exception as e:
             logger.warning(f"[{file_id}] ⚠️ Could not apply skin smoothing: {e}")
         
         logger.info(f"[{file_id}] ✅ All enhancements applied successfully")
-        return img
\ No newline at end of file
+        return img
+
+    def _apply_enhancements_tiled(self, img: Image.Image, file_id: str, workers: int = None) -> Image.Image:
+        """
+        Tiled version of _apply_enhancements for large images.
+
+        Contrast is the only global step (it blends towards the mean luminance), so a
+        first pass accumulates the luminance histogram tile by tile; the second pass
+        runs the full chain on overlapping tiles into a preallocated output. Only the
+        decoded source, the output and a few tiles are alive at once instead of a
+        dozen full-size copies, tiles run in parallel on the shared tile pool, and the
+        result is identical to the whole-image path.
+        """
+        workers = plan_workers(img.size[0] * img.size[1], workers)
+        tile_size = plan_tile_size(img.size, workers, DEFAULT_TILE_SIZE)
+        logger.info(f"[{file_id}] 🧩 Applying enhancements in {tile_size}px tiles "
+                    f"({workers} workers, overlap {RETOUCH_TILE_OVERLAP}px)")
+
+        with timer_step("Measuring mean luminance for contrast", file_id):
+            histogram = [0] * 256
+            for _, _, tile_histogram in map_tiles(img, self._brightened_luminance_histogram,
+                                                  tile_size=tile_size, workers=workers):
+                histogram = [total + count for total, count in zip(histogram, tile_histogram)]
+            # Same rounding as ImageEnhance.Contrast (ImageStat mean of the "L" image)
+            contrast_mean = int(sum(i * count for i, count in enumerate(histogram)) / sum(histogram) + 0.5)
+
+        with timer_step("Enhancing tiles", file_id):
+            return process_tiled(img, lambda tile: self._enhance_tile(tile, contrast_mean), tile_size=tile_size,
+                                 overlap=RETOUCH_TILE_OVERLAP, workers=workers)
+
+    def _brightened_luminance_histogram(self, tile: Image.Image) -> list:
+        if tile.mode != 'RGB':
+            tile = tile.convert('RGB')
+        return ImageEnhance.Brightness(tile).enhance(BRIGHTNESS_FACTOR).convert('L').histogram()
+
+    def _enhance_tile(self, tile: Image.Image, contrast_mean: int) -> Image.Image:
+        """Enhancement chain of _apply_enhancements with the contrast mean of the whole image"""
+        if tile.mode != 'RGB':
+            tile = tile.convert('RGB')
+        tile = ImageEnhance.Brightness(tile).enhance(BRIGHTNESS_FACTOR)
+        tile = Image.blend(Image.new('RGB', tile.size, (contrast_mean,) * 3), tile, CONTRAST_FACTOR)
+        tile = ImageEnhance.Color(tile).enhance(COLOR_FACTOR)
+        tile = ImageEnhance.Sharpness(tile).enhance(SHARPNESS_FACTOR)
+
+        filtered = cv2.bilateralFilter(cv2.cvtColor(np.asarray(tile), cv2.COLOR_RGB2BGR),
+                                       BILATERAL_DIAMETER, BILATERAL_SIGMA, BILATERAL_SIGMA)
+        tile = Image.fromarray(cv2.cvtColor(filtered, cv2.COLOR_BGR2RGB))
+
+        blurred = tile.filter(ImageFilter.GaussianBlur(radius=SMOOTHING_RADIUS))
+        return Image.blend(tile, blurred, SMOOTHING_BLEND)
@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from processors.storage import signed_path
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Channel of the job running in the current request (None when nobody listens)
+_current_channel = ContextVar("progress_channel", default=None)
+
+# job_id -> ProgressChannel
+_channels = {}
+_channels_lock = threading.Lock()
+
+CHANNEL_TTL = int(os.getenv("PROGRESS_CHANNEL_TTL", "300"))  # seconds to keep a channel after it finished
+MAX_CHANNELS = int(os.getenv("PROGRESS_MAX_CHANNELS", "1000"))
+# Channels opened by subscribers for jobs that have not started; kept below MAX_CHANNELS
+# so unauthenticated GET /api/progress/{id} calls cannot use up room the jobs need
+MAX_PENDING_CHANNELS = int(os.getenv("PROGRESS_MAX_PENDING_CHANNELS", "100"))
+KEEPALIVE_INTERVAL = 15  # seconds between SSE keep-alive comments
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class ProgressChannel:
+    """
+    Progress event log of one long-running job, consumed as Server-Sent Events.
+
+    Processors publish stage boundaries (via timer_step) and partial results; any
+    number of subscribers replay the log from the beginning (or from Last-Event-ID)
+    and then follow new events until the job finishes. Publishing is thread-safe so
+    stages executed in worker threads are reported as well.
+    """
+
+    def __init__(self, job_id: str):
+        """Initialize an empty channel for the given client-supplied job id."""
+        self.job_id = job_id
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.total_units = None
+        self.completed_units = 0
+        self.completed_stages = 0
+        self.last_percent = 0
+        self.events = []
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def percent(self) -> int:
+        """Estimate completion: exact when the processor declared its units, asymptotic otherwise"""
+        if self.finished:
+            return 100
+        if self.total_units:
+            estimate = min(99, int(100 * self.completed_units / self.total_units))
+        else:
+            estimate = min(95, int(100 * (1 - 0.7 ** self.completed_stages)))
+        # Never move the progress bar backwards when the estimate switches to exact units
+        self.last_percent = max(self.last_percent, estimate)
+        return self.last_percent
+
+    def expired(self, now: float) -> bool:
+        """Finished more than CHANNEL_TTL ago, or never started within CHANNEL_TTL of creation"""
+        if self.finished:
+            return now - self.finished_at > CHANNEL_TTL
+        return not self.started_at and now - self.created_at > CHANNEL_TTL
+
+    def elapsed(self) -> float:
+        start = self.started_at or self.created_at
+        end = self.finished_at or time.time()
+        return round(end - start, 3)
+
+    def start(self):
+        self.started_at = time.time()
+        self._publish("started", {})
+
+    def set_total(self, total_units: int):
+        """Declare how many partial results the job will produce (drives the percent value)"""
+        self.total_units = total_units
+        self._publish("progress", {"stage": None, "total": total_units})
+
+    def stage_started(self, stage: str):
+        self._publish("stage", {"stage": stage, "state": "started"})
+
+    def stage_finished(self, stage: str, duration: float):
+        self.completed_stages += 1
+        self._publish("stage", {"stage": stage, "state": "done", "duration": round(duration, 3)})
+
+    def partial_result(self, path: str, **info):
+        """Push one finished output (composite, platform image...) before the whole batch is done"""
+        self.completed_units += 1
+        self._publish("partial", {"url": signed_path(os.path.basename(path)), **info})
+
+    def finish(self, error: str = None):
+        self.finished_at = time.time()
+        if error:
+            self._publish("failed", {"message": error})
+        else:
+            self._publish("done", {})
+
+    def _publish(self, event_type: str, data: dict):
+        payload = {"job_id": self.job_id, "percent": self.percent(), "elapsed": self.elapsed(), **data}
+        with self._lock:
+            event_id = len(self.events)
+            self.events.append(f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(payload)}\n\n")
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Subscriber loop already closed
+                pass
+
+    async def stream(self, start: int = 0):
+        """
+        Async generator of SSE frames: replays events from `start`, then follows live ones.
+
+        Ends after `done`/`failed`, or at the first keep-alive after the channel expired
+        (its job never started) or was pruned, so abandoned streams do not stay open.
+        """
+        loop = asyncio.get_running_loop()
+        index = start
+
+        while True:
+            wakeup = asyncio.Event()
+            with self._lock:
+                pending = self.events[index:]
+                done = self.finished
+                if not pending and not done:
+                    self._waiters.add((loop, wakeup))
+
+            for frame in pending:
+                yield frame
+            index += len(pending)
+
+            if done and not pending:
+                return
+            if pending:
+                continue
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                if self.expired(time.time()) or _channels.get(self.job_id) is not self:
+                    return
+                yield ": keep-alive\n\n"
+            finally:
+                with self._lock:
+                    self._waiters.discard((loop, wakeup))
+
+
+def is_valid_job_id(job_id: str) -> bool:
+    return bool(job_id) and bool(JOB_ID_PATTERN.match(job_id))
+
+
+def _prune_channels(now: float):
+    """Drop finished channels after CHANNEL_TTL and abandoned never-started ones"""
+    expired = [job_id for job_id, channel in _channels.items() if channel.expired(now)]
+    for job_id in expired:
+        del _channels[job_id]
+
+
+def get_channel(job_id: str, subscriber: bool = False) -> ProgressChannel:
+    """
+    Return the channel for job_id, creating it (subscribers may connect before the job starts).
+
+    Channels created for a `subscriber` stay pending until their job starts; at most
+    MAX_PENDING_CHANNELS of them exist at a time.
+    """
+    with _channels_lock:
+        _prune_channels(time.time())
+        channel = _channels.get(job_id)
+        if channel is None:
+            if len(_channels) >= MAX_CHANNELS:
+                raise RuntimeError("Too many active progress channels")
+            if subscriber and sum(1 for c in _channels.values() if not c.started_at) >= MAX_PENDING_CHANNELS:
+                raise RuntimeError("Too many progress channels waiting for their job")
+            channel = ProgressChannel(job_id)
+            _channels[job_id] = channel
+        return channel
+
+
+@contextmanager
+def track(job_id: str = None):
+    """
+    Attach a progress channel to the job executed inside the block.
+
+    Every timer_step boundary and partial result reported by processors while the
+    block runs goes to the channel of `job_id`. Without a (valid) job id this is a no-op.
+
+    Example:
+        with progress.track(progress_id):
+            results = await image_processor.person_swap_separate(people, backgrounds, file_id)
+    """
+    if not is_valid_job_id(job_id):
+        yield None
+        return
+
+    try:
+        channel = get_channel(job_id)
+    except RuntimeError as e:
+        logger.warning(f"[{job_id}] ⚠️ Progress tracking disabled: {e}")
+        yield None
+        return
+
+    token = _current_channel.set(channel)
+    channel.start()
+    try:
+        yield channel
+    except Exception as e:
+        channel.finish(error=str(e))
+        raise
+    else:
+        channel.finish()
+    finally:
+        _current_channel.reset(token)
+
+
+# Hooks called by processors; all of them are no-ops when no channel is attached
+
+def stage_started(stage: str):
+    channel = _current_channel.get()
+    if channel is not None:
+        channel.stage_started(stage)
+
+
+def stage_finished(stage: str, duration: float):
+    channel = _current_channel.get()
+    if channel is not None:
+        channel.stage_finished(stage, duration)
+
+
+def set_total(total_units: int):
+    channel = _current_channel.get()
+    if channel is not None:
+        channel.set_total(total_units)
+
+
+def partial_result(path: str, **info):
+    channel = _current_channel.get()
+    if channel is not None:
+        channel.partial_result(path, **info)
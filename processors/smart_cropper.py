@@ -1,26 +1,17 @@
 import os
 import logging
-from contextlib import contextmanager
-import time
 from PIL import Image, ImageFilter
 import cv2
 import numpy as np
 
+from processors.instrumentation import timer_step, observe_image
+from processors.encoding import save_image
+from processors.storage import result_store
+from processors.tiling import parallel_rows
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function for timing operations
-@contextmanager
-def timer_step(step_name: str, file_id: str = None):
-    start_time = time.time()
-    request_prefix = f"[{file_id}] " if file_id else ""
-    logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
-    try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
-
 class SmartCropper:
     """
     Intelligent image cropping system with face detection and composition analysis.
@@ -79,6 +70,7 @@ class SmartCropper:
             with timer_step("Loading image for cropping", file_id):
                 img = Image.open(image_path)
                 original_size = img.size
+                observe_image(original_size)
                 logger.info(f"[{file_id}] 📖 Original image size: {original_size}")
             
             with timer_step("Calculating target dimensions", file_id):
@@ -115,9 +107,8 @@ class SmartCropper:
                 logger.info(f"[{file_id}] ✅ Cropping completed")
             
             with timer_step("Saving cropped result", file_id):
-                output_path = f"processed/{file_id}_cropped_{aspect_ratio.replace(':', '_')}.jpg"
-                os.makedirs("processed", exist_ok=True)
-                cropped_img.save(output_path, 'JPEG', quality=90, optimize=True)
+                with result_store.writing(f"{file_id}_cropped_{aspect_ratio.replace(':', '_')}.jpg") as output_path:
+                    save_image(cropped_img, output_path)
                 logger.info(f"[{file_id}] 💾 Cropped image saved to: {output_path}")
             
             logger.info(f"[{file_id}] ✅ Smart crop completed successfully: {output_path}")
@@ -160,9 +151,8 @@ class SmartCropper:
         width, height = img.size
         
         try:
-            # Convert PIL to OpenCV format for face detection
-            img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-            gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+            # Grayscale for face detection (RGB->GRAY directly, in parallel strips on large images)
+            gray = parallel_rows(lambda strip: cv2.cvtColor(strip, cv2.COLOR_RGB2GRAY), np.asarray(img))
             
             # Load face cascade
             face_cascade = self._load_face_cascade()
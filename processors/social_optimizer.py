@@ -1,24 +1,16 @@
 import os
+import asyncio
 import logging
-from contextlib import contextmanager
-import time
 from PIL import Image
 
+from processors import progress
+from processors.instrumentation import timer_step, observe_image
+from processors.encoding import save_image
+from processors.storage import result_store
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function for timing operations
-@contextmanager
-def timer_step(step_name: str, file_id: str = None):
-    start_time = time.time()
-    request_prefix = f"[{file_id}] " if file_id else ""
-    logger.info(f"{request_prefix}🔧 STEP START: {step_name}")
-    try:
-        yield
-    finally:
-        duration = time.time() - start_time
-        logger.info(f"{request_prefix}✅ STEP DONE: {step_name} - Duration: {duration:.2f}s")
-
 class SocialOptimizer:
     """
     Professional social media image optimization system for all major platforms.
@@ -67,32 +59,22 @@ class SocialOptimizer:
         try:
             with timer_step("Loading original image", file_id):
                 original_img = Image.open(image_path)
+                observe_image(original_img.size)
                 logger.info(f"[{file_id}] 📖 Original size: {original_img.size}")
             
             results = {}
+            progress.set_total(len(self.platform_specs))
             
             with timer_step("Creating platform-specific versions", file_id):
                 for platform, specs in self.platform_specs.items():
                     try:
-                        optimized_img = self._optimize_for_platform(original_img, specs, file_id, platform)
-                        
-                        output_path = f"processed/{file_id}_{platform}_optimized.{specs['format'].lower()}"
-                        os.makedirs("processed", exist_ok=True)
-                        
-                        optimized_img.save(output_path, specs['format'], 
-                                         quality=specs['quality'], optimize=True)
-                        
-                        # Get file size
-                        file_size = self._get_file_size(output_path)
+                        # Resize/encode in a worker thread so the loop keeps streaming progress meanwhile
+                        version = await asyncio.to_thread(self._create_version, original_img, specs, file_id, platform)
+                        results[platform] = version
+                        progress.partial_result(version['path'], platform=platform,
+                                                size=list(version['size']), file_size=version['file_size'])
                         
-                        results[platform] = {
-                            'path': output_path,
-                            'size': optimized_img.size,
-                            'file_size': file_size,
-                            'format': specs['format']
-                        }
-                        
-                        logger.info(f"[{file_id}] ✅ {platform.capitalize()} version created: {optimized_img.size}, {file_size}")
+                        logger.info(f"[{file_id}] ✅ {platform.capitalize()} version created: {version['size']}, {version['file_size']}")
                         
                     except Exception as e:
                         logger.error(f"[{file_id}] ❌ Error creating {platform} version: {e}")
@@ -104,6 +86,21 @@ class SocialOptimizer:
             logger.error(f"[{file_id}] ❌ Error in social media optimization: {e}")
             raise
     
+    def _create_version(self, original_img: Image.Image, specs: dict, file_id: str, platform: str) -> dict:
+        """Optimize and save one platform version (blocking; runs in a worker thread)"""
+        optimized_img = self._optimize_for_platform(original_img, specs, file_id, platform)
+        
+        output_name = f"{file_id}_{platform}_optimized.{specs['format'].lower()}"
+        with result_store.writing(output_name) as output_path:
+            save_image(optimized_img, output_path, specs['format'], quality=specs['quality'])
+        
+        return {
+            'path': output_path,
+            'size': optimized_img.size,
+            'file_size': self._get_file_size(output_path),
+            'format': specs['format']
+        }
+    
     def _optimize_for_platform(self, img: Image.Image, specs: dict, file_id: str, platform: str) -> Image.Image:
         """Optimize image for specific platform"""
         target_width, target_height = specs['size']
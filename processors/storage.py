@@ -0,0 +1,584 @@
+"""
+Result storage: where processed images are written, found and expired.
+
+Processors never build `processed/...` paths themselves; they write through
+result_store.writing(name), which places the file in a hash-prefix shard
+(processed/3f/a2/<name>) so no directory grows past a few hundred entries, and
+records its size and age in a small SQLite index (processed/.index.sqlite3).
+
+A background sweeper (started with the app) deletes results older than
+RESULT_TTL_HOURS, evicts least recently served results while the directory is
+over RESULT_QUOTA_MB, and removes uploads/ leftovers older than UPLOAD_TTL_HOURS.
+Results saved to a user's history are kept: the app registers a retention filter.
+
+With STORAGE_BACKEND=s3 every result is also uploaded to an S3-compatible bucket
+(AWS, MinIO, Ceph...; needs `pip install boto3`). The local copy then becomes a
+cache: quota eviction only drops local files, and results missing locally are
+downloaded again on request.
+
+Clients get results through signed, expiring URLs (result_store.url): presigned
+bucket URLs with the S3 backend, so the app serves no image bytes and any replica
+can hand out links; HMAC-signed /processed/<name>?expires=...&sig=... links with
+the local backend (served by the app or, with SENDFILE_HEADER, by nginx).
+"""
+import os
+import hmac
+import math
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "processed")
+UPLOADS_DIR = "uploads"
+VARIANT_DIR_NAME = ".variants"
+INDEX_NAME = ".index.sqlite3"
+PRECOMPRESSED_SUFFIXES = (".br", ".gz")
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()  # local | s3 | memory (tests)
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "processed/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. http://minio:9000; credentials from AWS_* env vars
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "4"))
+# Endpoint as browsers see it, when it differs from S3_ENDPOINT_URL (e.g. http://localhost:9000 for MinIO)
+S3_PUBLIC_ENDPOINT_URL = os.getenv("S3_PUBLIC_ENDPOINT_URL") or None
+
+URL_PATH_PREFIX = "/processed/"
+RESULT_URL_TTL = int(os.getenv("RESULT_URL_TTL") or 3600)  # lifetime of signed result URLs, seconds
+# Expiry times are rounded up to a multiple of this, so every link to a result handed out
+# within one window is the same URL and browser/CDN caches keep hitting
+URL_EXPIRY_WINDOW = max(1, RESULT_URL_TTL // 4)
+URL_SIGNING_KEY = (os.getenv("URL_SIGNING_KEY") or os.getenv("SECRET_KEY", "your-secret-key-here")).encode()
+# Reject unsigned /processed/ requests (turn on once every client uses signed URLs)
+REQUIRE_SIGNED_URLS = os.getenv("REQUIRE_SIGNED_URLS", "false").lower() in ("1", "true", "yes")
+
+RESULT_TTL_HOURS = float(os.getenv("RESULT_TTL_HOURS") or 168)  # 0 = keep forever
+RESULT_QUOTA_MB = float(os.getenv("RESULT_QUOTA_MB") or 0)  # local disk budget for results, 0 = unlimited
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS") or 1)  # uploads/ leftovers of crashed requests
+SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL") or 600)  # seconds between sweeps
+TOUCH_INTERVAL = 300  # seconds between last-access updates of one result
+SWEEP_BATCH = 500
+
+
+def shard_of(name: str) -> str:
+    """Two-level shard directory of a result name: 'ab/cd'"""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
+
+
+def _signature(name: str, expires: int, prefix: str) -> str:
+    # The route prefix is signed too: a /thumbs/480/ link cannot be replayed at /thumbs/1280/ or /processed/
+    message = f"{prefix}{name}\n{expires}"
+    return hmac.new(URL_SIGNING_KEY, message.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def signed_path(name: str, expires_in: int = RESULT_URL_TTL, now: float = None, prefix: str = URL_PATH_PREFIX) -> str:
+    """
+    App-served URL of a result (or, with `prefix`, of a file derived from it) valid for at least `expires_in` seconds.
+
+    The expiry is rounded up to the next multiple of URL_EXPIRY_WINDOW, so links stay
+    identical (and cacheable) within a window and live at most one window longer.
+    """
+    expires = math.ceil(((now or time.time()) + expires_in) / URL_EXPIRY_WINDOW) * URL_EXPIRY_WINDOW
+    return f"{prefix}{name}?expires={expires}&sig={_signature(name, expires, prefix)}"
+
+
+def verify_signature(name: str, expires, signature, now: float = None, prefix: str = URL_PATH_PREFIX) -> bool:
+    """Whether `expires`/`signature` (query parameters of a signed_path URL) are valid for `name` under `prefix` now"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < (now or time.time()):
+        return False
+    return hmac.compare_digest(str(signature or ""), _signature(name, expires, prefix))
+
+
+class LocalBackend:
+    """No remote copy: the local file is the only one."""
+
+    name = "local"
+    remote = False
+
+    def upload(self, name: str, path: str):
+        pass
+
+    def url_for(self, name: str, expires_in: int):
+        return None  # served by the app at signed_path()
+
+    def download(self, name: str, path: str) -> bool:
+        return False
+
+    def delete(self, name: str):
+        pass
+
+
+class S3Backend:
+    """
+    Remote copy of every result in an S3-compatible bucket.
+
+    Any S3 API works through `endpoint_url`: a MinIO container in development
+    (see docker-compose.dev.yml), AWS S3 or a Ceph gateway in production.
+    """
+
+    name = "s3"
+    remote = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, public_endpoint_url: str = None):
+        if not bucket:
+            raise ValueError("S3_BUCKET is required for STORAGE_BACKEND=s3")
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise ImportError("STORAGE_BACKEND=s3 requires boto3: pip install boto3") from e
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client("s3", endpoint_url=endpoint_url)
+        # Presigned URLs embed the host they were signed for; signing is local, no request is made
+        self._signing_client = (boto3.client("s3", endpoint_url=public_endpoint_url)
+                                if public_endpoint_url else self._client)
+        self._client_error = ClientError
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}{shard_of(name)}/{name}"
+
+    def upload(self, name: str, path: str):
+        self._client.upload_file(path, self.bucket, self.key(name))
+
+    def download(self, name: str, path: str) -> bool:
+        temp_path = f"{path}.{os.getpid()}.part"
+        try:
+            self._client.download_file(self.bucket, self.key(name), temp_path)
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        os.replace(temp_path, path)
+        return True
+
+    def delete(self, name: str):
+        self._client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def url_for(self, name: str, expires_in: int) -> str:
+        """Presigned GET URL: the client downloads straight from the bucket"""
+        return self._signing_client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.key(name)}, ExpiresIn=expires_in)
+
+
+class MemoryBackend:
+    """
+    In-process stand-in for a bucket (STORAGE_BACKEND=memory).
+
+    Exercises the remote code paths (upload, local eviction, re-download) without
+    an S3 server; objects live only as long as the process.
+    """
+
+    name = "memory"
+    remote = True
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def upload(self, name: str, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        with self._lock:
+            self.objects[name] = data
+
+    def download(self, name: str, path: str) -> bool:
+        with self._lock:
+            data = self.objects.get(name)
+        if data is None:
+            return False
+        with open(path, "wb") as f:
+            f.write(data)
+        return True
+
+    def delete(self, name: str):
+        with self._lock:
+            self.objects.pop(name, None)
+
+    def url_for(self, name: str, expires_in: int) -> str:
+        return signed_path(name, expires_in)  # the app fetches it back on request
+
+
+def create_backend(kind: str = STORAGE_BACKEND):
+    if kind == "local":
+        return LocalBackend()
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "s3":
+        return S3Backend(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_PUBLIC_ENDPOINT_URL)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}. Available: local, s3, memory")
+
+
+class ResultIndex:
+    """Size, age and last access of every stored result (SQLite, one connection per thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")  # several app workers write to the same index
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " name TEXT PRIMARY KEY, size INTEGER NOT NULL, created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL, local INTEGER NOT NULL DEFAULT 1, remote INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (local, accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def add(self, name: str, size: int, created_at: float = None):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO results (name, size, created_at, accessed_at, local, remote) VALUES (?, ?, ?, ?, 1, 0)",
+            (name, size, created_at or now, created_at or now))
+
+    def touch(self, name: str, when: float = None):
+        self._connect().execute("UPDATE results SET accessed_at = ? WHERE name = ?", (when or time.time(), name))
+
+    def set_flags(self, name: str, **flags):
+        assignments = ", ".join(f"{column} = ?" for column in flags)
+        self._connect().execute(f"UPDATE results SET {assignments} WHERE name = ?",
+                                (*[int(value) for value in flags.values()], name))
+
+    def get(self, name: str):
+        """(size, created_at, accessed_at, local, remote) or None"""
+        return self._connect().execute(
+            "SELECT size, created_at, accessed_at, local, remote FROM results WHERE name = ?", (name,)).fetchone()
+
+    def remove(self, name: str):
+        self._connect().execute("DELETE FROM results WHERE name = ?", (name,))
+
+    def created_before(self, cutoff: float, limit: int = SWEEP_BATCH, offset: int = 0) -> list:
+        return [row[0] for row in self._connect().execute(
+            "SELECT name FROM results WHERE created_at < ? ORDER BY created_at LIMIT ? OFFSET ?",
+            (cutoff, limit, offset))]
+
+    def least_recently_used(self, limit: int = SWEEP_BATCH, offset: int = 0) -> list:
+        """(name, size, remote) of local results, least recently served first"""
+        return self._connect().execute(
+            "SELECT name, size, remote FROM results WHERE local = 1 ORDER BY accessed_at LIMIT ? OFFSET ?",
+            (limit, offset)).fetchall()
+
+    def with_prefix(self, prefix: str) -> list:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return [row[0] for row in self._connect().execute(
+            "SELECT name FROM results WHERE name LIKE ? ESCAPE '\\'", (escaped + "%",))]
+
+    def stats(self) -> dict:
+        count, local_bytes, total_bytes = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size * local), 0), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"results": count, "local_bytes": local_bytes, "total_bytes": total_bytes}
+
+
+class ResultStore:
+    """Sharded result directory + index + backend, with a periodic TTL/quota sweeper."""
+
+    def __init__(self, root: str = STORAGE_ROOT, backend=None, ttl_hours: float = RESULT_TTL_HOURS,
+                 quota_mb: float = RESULT_QUOTA_MB, upload_ttl_hours: float = UPLOAD_TTL_HOURS,
+                 sweep_interval: float = SWEEP_INTERVAL, uploads_dir: str = UPLOADS_DIR):
+        self.root = root
+        self.variant_root = os.path.join(root, VARIANT_DIR_NAME)
+        self.uploads_dir = uploads_dir
+        self.ttl_hours = ttl_hours
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.upload_ttl_hours = upload_ttl_hours
+        self.sweep_interval = sweep_interval
+        self.index = ResultIndex(os.path.join(root, INDEX_NAME))
+        self._backend = backend
+        self._uploads = None
+        self._pending_uploads = {}  # name -> upload future
+        self._touched = {}  # name -> last index update, so serving a result is not a write per request
+        self._retention_filter = None
+        self._commit_hooks = []
+        self._task = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+
+    def path_for(self, name: str) -> str:
+        """Sharded local path of result `name` (the file may not exist)"""
+        return os.path.join(self.root, shard_of(name), name)
+
+    def variant_dir(self, name: str) -> str:
+        """Directory for derived files of result `name` (format variants)"""
+        return os.path.join(self.variant_root, shard_of(name))
+
+    @contextmanager
+    def writing(self, name: str):
+        """
+        Path to write result `name` to; the result is stored when the block exits cleanly.
+
+        Example:
+            with result_store.writing(f"{file_id}_retouched.jpg") as output_path:
+                save_image(enhanced_img, output_path)
+        """
+        path = self.path_for(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            yield path
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        self.commit(name)
+
+    def commit(self, name: str):
+        """Index a result written to path_for(name) and hand it to the backend"""
+        path = self.path_for(name)
+        self.index.add(name, os.path.getsize(path))
+        if self.backend.remote:
+            if self._uploads is None:
+                self._uploads = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="result-upload")
+            upload = self._uploads.submit(self._upload, name, path)
+            self._pending_uploads[name] = upload
+            upload.add_done_callback(lambda _: self._pending_uploads.pop(name, None))
+        for hook in self._commit_hooks:
+            hook(name, path)
+
+    def add_commit_hook(self, func):
+        """Call `func(name, path)` after each result is stored (e.g. to render previews); must not block"""
+        self._commit_hooks.append(func)
+
+    def _upload(self, name: str, path: str):
+        try:
+            self.backend.upload(name, path)
+            self.index.set_flags(name, remote=True)
+        except Exception as e:
+            logger.error(f"❌ Upload of {name} to {self.backend.name} failed: {e}")
+
+    async def url(self, name: str, expires_in: int = RESULT_URL_TTL) -> str:
+        """
+        Signed URL of a stored result, valid for `expires_in` seconds.
+
+        With a remote backend this waits for the result's upload and returns a
+        presigned bucket URL; if the upload failed, or the backend is local, an
+        app-served signed_path() link.
+
+        Example:
+            return {"success": True, "output_path": await result_store.url(f"{file_id}_retouched.jpg")}
+        """
+        if self.backend.remote:
+            upload = self._pending_uploads.get(name)
+            if upload is not None:
+                await asyncio.wrap_future(upload)
+            row = self.index.get(name)
+            if row is None or row[4]:  # no row: made by another replica, the bucket has it
+                return self.backend.url_for(name, expires_in)
+        return signed_path(name, expires_in)
+
+    def resolve(self, name: str):
+        """Local path of a stored result, or None when it is not on this disk"""
+        path = self.path_for(name)
+        if not os.path.isfile(path):
+            legacy_path = os.path.join(self.root, name)  # written before sharding, not adopted yet
+            return legacy_path if os.path.isfile(legacy_path) else None
+        now = time.time()
+        if now - self._touched.get(name, 0) > TOUCH_INTERVAL:
+            self._touched[name] = now
+            self.index.touch(name, now)
+        return path
+
+    def fetch(self, name: str):
+        """Download a result the local disk no longer holds; its path, or None (blocking)"""
+        if not self.backend.remote:
+            return None
+        path = self.path_for(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not self.backend.download(name, path):
+            return None
+        if self.index.get(name) is None:
+            self.index.add(name, os.path.getsize(path))
+        self.index.set_flags(name, local=True, remote=True)
+        self.index.touch(name)
+        logger.info(f"📥 Restored {name} from {self.backend.name}")
+        return path
+
+    def _remove_local(self, name: str) -> int:
+        """Delete the local file of `name` with its variants and precompressed siblings; bytes freed"""
+        freed = 0
+        path = self.path_for(name)
+        candidates = [path, os.path.join(self.root, name)]
+        candidates += [path + suffix for suffix in PRECOMPRESSED_SUFFIXES]
+        variant_dir = self.variant_dir(name)
+        if os.path.isdir(variant_dir):
+            candidates += [os.path.join(variant_dir, entry) for entry in os.listdir(variant_dir)
+                           if entry.startswith(name + ".")]
+        for candidate in candidates:
+            try:
+                freed += os.path.getsize(candidate)
+                os.remove(candidate)
+            except FileNotFoundError:
+                pass
+        self._touched.pop(name, None)
+        return freed
+
+    def delete(self, name: str) -> int:
+        """Delete a result everywhere (local, remote, index); bytes freed locally"""
+        freed = self._remove_local(name)
+        if self.backend.remote:
+            try:
+                self.backend.delete(name)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not delete {name} from {self.backend.name}: {e}")
+        self.index.remove(name)
+        return freed
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Delete every result whose name starts with `prefix` (e.g. a file_id); count deleted"""
+        names = self.index.with_prefix(prefix)
+        for name in names:
+            self.delete(name)
+        return len(names)
+
+    def set_retention_filter(self, func):
+        """
+        Register `func(names) -> set of names to keep`, consulted before a sweep deletes anything.
+
+        The app uses it to keep results referenced by users' processing history.
+        """
+        self._retention_filter = func
+
+    def _kept(self, names: list) -> set:
+        if not names or self._retention_filter is None:
+            return set()
+        try:
+            return set(self._retention_filter(names))
+        except Exception as e:
+            # Without the filter we cannot tell saved results from anonymous ones: keep everything
+            logger.error(f"❌ Retention filter failed, skipping deletion: {e}")
+            return set(names)
+
+    def adopt_legacy(self) -> int:
+        """Move flat processed/<name> files into their shards and index them; count moved"""
+        adopted = 0
+        if not os.path.isdir(self.root):
+            return 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat_result = entry.stat()
+                path = self.path_for(entry.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(entry.path, path)
+                self.index.add(entry.name, stat_result.st_size, created_at=stat_result.st_mtime)
+                adopted += 1
+        if adopted:
+            logger.info(f"📦 Moved {adopted} results from {self.root}/ into shards")
+        return adopted
+
+    def sweep(self, now: float = None) -> dict:
+        """One retention pass: TTL, then quota, then stale uploads (blocking)"""
+        now = now or time.time()
+        expired = evicted = freed = uploads = 0
+
+        if self.ttl_hours > 0:
+            cutoff = now - self.ttl_hours * 3600
+            offset = 0
+            while True:
+                names = self.index.created_before(cutoff, offset=offset)
+                if not names:
+                    break
+                kept = self._kept(names)
+                for name in names:
+                    if name not in kept:
+                        freed += self.delete(name)
+                        expired += 1
+                offset += len(kept)
+
+        if self.quota_bytes > 0:
+            excess = self.index.stats()["local_bytes"] - self.quota_bytes
+            offset = 0
+            while excess > 0:
+                rows = self.index.least_recently_used(offset=offset)
+                if not rows:
+                    logger.warning(f"⚠️ Results over quota by {excess / 1e6:.1f} MB, all remaining are retained")
+                    break
+                kept = self._kept([name for name, _, remote in rows if not remote])
+                for name, size, remote in rows:
+                    if excess <= 0:
+                        break
+                    if remote:
+                        # The bucket still has it: only drop the local copy
+                        freed += self._remove_local(name)
+                        self.index.set_flags(name, local=False)
+                    elif name in kept:
+                        offset += 1
+                        continue
+                    else:
+                        freed += self.delete(name)
+                    excess -= size
+                    evicted += 1
+
+        if self.upload_ttl_hours > 0 and os.path.isdir(self.uploads_dir):
+            cutoff = now - self.upload_ttl_hours * 3600
+            with os.scandir(self.uploads_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            uploads += 1
+                    except FileNotFoundError:
+                        pass
+
+        stats = {"expired": expired, "evicted": evicted, "freed_bytes": freed, "stale_uploads": uploads}
+        if expired or evicted or uploads:
+            logger.info(f"🧹 Storage sweep: {expired} expired, {evicted} evicted, "
+                        f"{freed / 1e6:.1f} MB freed, {uploads} stale uploads removed")
+        return stats
+
+    def start(self):
+        """Start the periodic sweeper on the running loop (call from a startup handler)"""
+        if self._task is not None or self.sweep_interval <= 0:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._sweeper())
+        logger.info(f"🗄️ Result storage: backend {self.backend.name}, TTL {self.ttl_hours or 'off'} h, "
+                    f"quota {self.quota_bytes // (1024 * 1024) or 'off'} MB, sweep every {self.sweep_interval:.0f}s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._uploads is not None:
+            await asyncio.to_thread(self._uploads.shutdown, wait=True)
+            self._uploads = None
+
+    async def _sweeper(self):
+        await asyncio.to_thread(self.adopt_legacy)
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"❌ Storage sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+
+result_store = ResultStore()
@@ -0,0 +1,170 @@
+import os
+import math
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+# Threads shared by all requests for tile work; Pillow and OpenCV release the GIL in their pixel loops
+TILE_POOL_WORKERS = int(os.getenv("TILE_POOL_WORKERS") or os.cpu_count() or 1)
+# Below this many pixels per tile, thread hand-off costs more than the parallel speedup
+MIN_TILE_PIXELS = int(os.getenv("MIN_TILE_PIXELS", str(512 * 512)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_tile_executor() -> ThreadPoolExecutor:
+    """
+    Shared thread pool for tile work.
+
+    One pool for the whole process keeps concurrent requests from oversubscribing
+    the cores. Tile functions must not submit work to this pool themselves.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=TILE_POOL_WORKERS, thread_name_prefix="tile")
+    return _executor
+
+
+def plan_workers(pixels: int, workers: int = None) -> int:
+    """How many tiles are worth processing in parallel for an image of `pixels` (1 = run inline)"""
+    workers = workers or TILE_POOL_WORKERS
+    return max(1, min(workers, pixels // MIN_TILE_PIXELS))
+
+
+def plan_tile_size(size: tuple, workers: int, tile_size: int = DEFAULT_TILE_SIZE) -> int:
+    """Tile edge giving every worker at least one tile, capped by `tile_size` to bound memory"""
+    side = math.ceil(math.sqrt(size[0] * size[1] / max(1, workers)))
+    return min(tile_size, max(int(math.sqrt(MIN_TILE_PIXELS)), side))
+
+
+def iter_tiles(size: tuple, tile_size: int = DEFAULT_TILE_SIZE, overlap: int = 0) -> list:
+    """
+    Split an image of `size` into a grid of tiles.
+
+    Returns (inner_box, padded_box) pairs: inner boxes cover the image exactly once,
+    padded boxes extend them by `overlap` pixels on every side, clipped to the image.
+    """
+    width, height = size
+    tiles = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            inner = (left, top, min(left + tile_size, width), min(top + tile_size, height))
+            padded = (max(0, inner[0] - overlap), max(0, inner[1] - overlap),
+                      min(width, inner[2] + overlap), min(height, inner[3] + overlap))
+            tiles.append((inner, padded))
+    return tiles
+
+
+def map_tiles(source: Image.Image, func, tile_size: int = DEFAULT_TILE_SIZE, overlap: int = 0, workers: int = 1):
+    """
+    Apply `func` to every (padded) tile of `source` and yield (inner_box, padded_box, result) in tile order.
+
+    With workers > 1 tiles run on the shared tile pool. At most 2 * workers tiles are
+    in flight, so memory stays bounded by tile size no matter how large the image is.
+    """
+    # Lazy loaders are not thread safe: decode once before tiles are cropped concurrently
+    source.load()
+    tiles = iter_tiles(source.size, tile_size, overlap)
+
+    def run(tile):
+        inner, padded = tile
+        return inner, padded, func(source.crop(padded))
+
+    if workers <= 1 or len(tiles) == 1:
+        for tile in tiles:
+            yield run(tile)
+        return
+
+    executor = get_tile_executor()
+    pending = deque()
+    try:
+        for tile in tiles:
+            pending.append(executor.submit(run, tile))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def process_tiled(source: Image.Image, func, tile_size: int = DEFAULT_TILE_SIZE, overlap: int = 0,
+                  workers: int = 1, mode: str = "RGB") -> Image.Image:
+    """
+    Run a local image filter chain tile by tile into a preallocated output image.
+
+    `func` receives a padded tile and must return an image of the same size. Each
+    result is trimmed back to its inner box and pasted into the output. When
+    `overlap` is at least the combined radius of the filters in `func`, the output
+    is identical to applying `func` to the whole image.
+
+    Args:
+        source (Image.Image): Input image (any mode accepted by `func`)
+        func (callable): Tile -> processed tile of the same size
+        tile_size (int): Inner tile edge in pixels
+        overlap (int): Context pixels added on each side of a tile
+        workers (int): Threads processing tiles concurrently
+        mode (str): Mode of the output image
+
+    Returns:
+        Image.Image: Processed image of the same size as `source`
+
+    Example:
+        result = process_tiled(img, lambda tile: tile.filter(ImageFilter.GaussianBlur(2)), overlap=6)
+    """
+    output = Image.new(mode, source.size)
+    for inner, padded, result in map_tiles(source, func, tile_size, overlap, workers):
+        if result.size != (padded[2] - padded[0], padded[3] - padded[1]):
+            raise ValueError(f"Tile function changed tile size from {padded} to {result.size}")
+        trim = (inner[0] - padded[0], inner[1] - padded[1], inner[2] - padded[0], inner[3] - padded[1])
+        output.paste(result.crop(trim), inner[:2])
+    return output
+
+
+def parallel_rows(func, array: np.ndarray, overlap: int = 0, workers: int = None) -> np.ndarray:
+    """
+    Run a per-pixel (or small-kernel) NumPy/OpenCV operation on horizontal strips in parallel.
+
+    `func` maps an (h, w, ...) array to an array with the same height and width
+    (channels and dtype may change, e.g. cv2.cvtColor to grayscale). `overlap` rows of
+    context are added around each strip for neighbourhood filters, so the result is
+    identical to func(array). Small images run inline: see plan_workers.
+
+    Example:
+        gray = parallel_rows(lambda strip: cv2.cvtColor(strip, cv2.COLOR_RGB2GRAY), rgb)
+        smooth = parallel_rows(lambda strip: cv2.bilateralFilter(strip, 9, 75, 75), bgr, overlap=4)
+    """
+    height, width = array.shape[:2]
+    count = min(height, plan_workers(height * width, workers))
+    if count <= 1:
+        return func(array)
+
+    bounds = np.linspace(0, height, count + 1).astype(int)
+
+    def run(index):
+        top, bottom = int(bounds[index]), int(bounds[index + 1])
+        padded_top, padded_bottom = max(0, top - overlap), min(height, bottom + overlap)
+        result = func(array[padded_top:padded_bottom])
+        return top, bottom, result[top - padded_top:bottom - padded_top]
+
+    executor = get_tile_executor()
+    futures = [executor.submit(run, index) for index in range(count)]
+    output = None
+    for future in futures:
+        top, bottom, strip = future.result()
+        if output is None:
+            output = np.empty((height,) + strip.shape[1:], dtype=strip.dtype)
+        output[top:bottom] = strip
+    return output
@@ -0,0 +1,174 @@
+"""
+Request logging configuration: text or JSON-lines output through a background
+queue listener, per-route sampling and one summary line per request.
+"""
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" or "json"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Processor step logs are redundant with the per-request summary in json mode
+PROCESSOR_LOG_LEVEL = os.getenv("PROCESSOR_LOG_LEVEL", "WARNING" if LOG_FORMAT == "json" else LOG_LEVEL).upper()
+LOG_REQUEST_HEADERS = os.getenv("LOG_REQUEST_HEADERS", "0") == "1"
+# Requests slower than this are always logged, whatever the sampling rate
+LOG_SLOW_REQUEST_SECONDS = float(os.getenv("LOG_SLOW_REQUEST_SECONDS", "5"))
+# Comma separated "path_prefix=rate" pairs, longest prefix wins, e.g. "/static=0,/api/progress=0.05,default=1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "/static=0,/processed=0.01,/metrics=0,default=1")
+
+REDACTED_HEADERS = {"authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key", "x-telegram-bot-api-secret-token"}
+
+request_logger = logging.getLogger("request")
+
+_listener = None
+
+
+def _parse_sample_rates(spec: str) -> list:
+    rates = []
+    default = 1.0
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        prefix, rate = item.split("=", 1)
+        prefix = prefix.strip()
+        try:
+            rate = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+        if prefix == "default":
+            default = rate
+        else:
+            rates.append((prefix, rate))
+    # Longest prefix first so "/api/progress" beats "/api"
+    rates.sort(key=lambda pair: len(pair[0]), reverse=True)
+    rates.append(("", default))
+    return rates
+
+
+SAMPLE_RATES = _parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line; `extra={...}` fields passed to the logger become top-level keys"""
+
+    RESERVED = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging():
+    """
+    Configure root logging for the app.
+
+    Formatting and I/O happen on a QueueListener thread; request handlers only
+    enqueue records, so slow stdout/disk never stalls the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonLinesFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s:%(lineno)d] - %(message)s'
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    for name in ("processors", "image_processor"):
+        logging.getLogger(name).setLevel(PROCESSOR_LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def sample_rate(path: str) -> float:
+    for prefix, rate in SAMPLE_RATES:
+        if path.startswith(prefix):
+            return rate
+    return 1.0
+
+
+def redact_headers(headers) -> dict:
+    return {
+        name: ("[REDACTED]" if name.lower() in REDACTED_HEADERS else value)
+        for name, value in headers.items()
+    }
+
+
+def log_request_summary(request, status_code: int, duration: float, stages: list):
+    """
+    Emit the single summary line of a request, subject to per-route sampling.
+
+    Server errors and requests slower than LOG_SLOW_REQUEST_SECONDS are always logged.
+
+    Args:
+        request: Starlette request
+        status_code (int): Response status (500 if the handler raised)
+        duration (float): Total handling time in seconds
+        stages (list): (stage_name, seconds) pairs collected from timer_step
+    """
+    if status_code < 500 and duration < LOG_SLOW_REQUEST_SECONDS:
+        rate = sample_rate(request.url.path)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+    level = logging.ERROR if status_code >= 500 else logging.INFO
+    if not request_logger.isEnabledFor(level):
+        return
+
+    if LOG_FORMAT == "json":
+        summary = {
+            "method": request.method,
+            "path": request.url.path,
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 1),
+            "client": request.client.host if request.client else None,
+            "stages": [{"stage": name, "ms": round(seconds * 1000, 1)} for name, seconds in stages],
+        }
+        if LOG_REQUEST_HEADERS:
+            summary["headers"] = redact_headers(request.headers)
+        request_logger.log(level, "request", extra=summary)
+    else:
+        stage_text = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stages)
+        message = f"📤 {request.method} {request.url.path} -> {status_code} - Duration: {duration:.2f}s"
+        if stage_text:
+            message += f" | stages: {stage_text}"
+        if LOG_REQUEST_HEADERS:
+            message += f" | headers: {redact_headers(request.headers)}"
+        request_logger.log(level, message)
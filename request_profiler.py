@@ -0,0 +1,192 @@
+"""
+Opt-in per-request profiling: cProfile + tracemalloc around a single request,
+artifacts stored under PROFILE_DIR, and a ring buffer of the slowest profiles.
+"""
+import io
+import os
+import time
+import uuid
+import heapq
+import pstats
+import random
+import asyncio
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# How many profiles to keep: N slowest overall plus N most recent explicitly requested ones
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+# Fraction of requests profiled automatically (feeds the slowest-requests buffer); 0 disables
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+REPORT_LINES = 40
+
+
+class ProfileRecord:
+    """Metadata of one stored profile."""
+
+    def __init__(self, profile_id: str, method: str, path: str, status: int, duration: float,
+                 peak_memory: int, explicit: bool):
+        self.profile_id = profile_id
+        self.method = method
+        self.path = path
+        self.status = status
+        self.duration = duration
+        self.peak_memory = peak_memory
+        self.explicit = explicit
+        self.created_at = time.time()
+
+    @property
+    def prof_path(self) -> str:
+        return os.path.join(PROFILE_DIR, f"{self.profile_id}.prof")
+
+    @property
+    def report_path(self) -> str:
+        return os.path.join(PROFILE_DIR, f"{self.profile_id}.txt")
+
+    def to_dict(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration": round(self.duration, 3),
+            "peak_memory_mb": round(self.peak_memory / (1024 ** 2), 2),
+            "explicit": self.explicit,
+            "created_at": self.created_at,
+        }
+
+
+class ProfileStore:
+    """
+    Keeps the PROFILE_KEEP slowest profiles and the PROFILE_KEEP latest explicitly
+    requested ones; artifacts of profiles dropped from both are deleted from disk.
+    """
+
+    def __init__(self, keep: int = PROFILE_KEEP):
+        self.keep = keep
+        self._slowest = []  # min-heap of (duration, profile_id)
+        self._recent = deque(maxlen=keep)
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def add(self, record: ProfileRecord):
+        with self._lock:
+            self._records[record.profile_id] = record
+            heapq.heappush(self._slowest, (record.duration, record.profile_id))
+            if len(self._slowest) > self.keep:
+                heapq.heappop(self._slowest)
+            if record.explicit:
+                self._recent.append(record.profile_id)
+
+            kept = {profile_id for _, profile_id in self._slowest} | set(self._recent)
+            dropped = [self._records.pop(profile_id) for profile_id in list(self._records) if profile_id not in kept]
+
+        for old in dropped:
+            for path in (old.prof_path, old.report_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return record.profile_id in kept
+
+    def get(self, profile_id: str):
+        with self._lock:
+            return self._records.get(profile_id)
+
+    def list(self) -> list:
+        with self._lock:
+            records = list(self._records.values())
+        return [record.to_dict() for record in sorted(records, key=lambda r: r.duration, reverse=True)]
+
+
+profile_store = ProfileStore()
+
+# tracemalloc and the thread profiler are process-wide: profile one request at a time
+_profile_lock = asyncio.Lock()
+
+
+def profile_requested(request) -> bool:
+    """True when the client asked for a profile with `X-Profile: 1` or `?profile=1`"""
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    return flag is not None and flag.lower() in ("1", "true", "yes")
+
+
+def should_sample() -> bool:
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _write_artifacts(record: ProfileRecord, profiler: cProfile.Profile, snapshot):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(record.prof_path)
+
+    report = io.StringIO()
+    report.write(f"{record.method} {record.path} -> {record.status}\n")
+    report.write(f"Duration: {record.duration:.3f}s, peak traced memory: {record.peak_memory / (1024 ** 2):.2f} MB\n\n")
+    report.write("Allocations still live at the end of the request (tracemalloc):\n")
+    for stat in snapshot.statistics("lineno")[:15]:
+        report.write(f"  {stat}\n")
+    report.write("\n")
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(REPORT_LINES)
+
+    with open(record.report_path, "w") as f:
+        f.write(report.getvalue())
+
+
+async def profile_request(request, call_next, explicit: bool):
+    """
+    Run the rest of the middleware chain under cProfile and tracemalloc.
+
+    The profiler covers the event-loop thread for the duration of the request, so
+    work of other coroutines interleaved on the loop shows up too; work pushed to
+    worker threads does not. Adds X-Profile-Id / X-Profile-Url headers when the
+    profile is kept, X-Profile-Status: busy when another profile is running.
+    """
+    if _profile_lock.locked():
+        response = await call_next(request)
+        if explicit:
+            response.headers["X-Profile-Status"] = "busy"
+        return response
+
+    async with _profile_lock:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+        profiler = cProfile.Profile()
+        status_code = 500
+        start_time = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start_time
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            snapshot = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+
+            record = ProfileRecord(uuid.uuid4().hex, request.method, request.url.path, status_code,
+                                   duration, max(0, peak), explicit)
+            try:
+                _write_artifacts(record, profiler, snapshot)
+                kept = profile_store.add(record)
+            except Exception as e:
+                logger.error(f"❌ Could not store profile for {request.url.path}: {e}")
+                kept = False
+
+    if kept:
+        logger.info(f"🔬 Profile {record.profile_id} stored for {request.method} {request.url.path} ({duration:.2f}s)")
+        if explicit:
+            response.headers["X-Profile-Id"] = record.profile_id
+            response.headers["X-Profile-Url"] = f"/api/admin/profiles/{record.profile_id}"
+    return response
@@ -525,21 +525,32 @@ async function processPersonSwap() {
         formData.append('background_files', file);
     });
     
-    updateProgress(50, 'Обрабатываем изображения...');
+    // Прогресс и готовые варианты приходят через Server-Sent Events
+    const progressId = createProgressId();
+    formData.append('progress_id', progressId);
+    const progressStream = subscribeToProgress(progressId, (partial) => {
+        updateProgress(partial.percent, `Готово вариантов: ${partial.done} из ${partial.total || '?'}`);
+    });
+    
+    updateProgress(20, 'Обрабатываем изображения...');
     
     // Добавляем токен аутентификации если есть
     const token = localStorage.getItem('token');
     const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
     
-    const response = await fetch('/api/person-swap', {
-        method: 'POST',
-        headers: headers,
-        body: formData
-    });
-    
-    if (response.ok) {
-        const result = await response.json();
-        results.push(...result.results);
+    try {
+        const response = await fetch('/api/person-swap', {
+            method: 'POST',
+            headers: headers,
+            body: formData
+        });
+        
+        if (response.ok) {
+            const result = await response.json();
+            results.push(...result.results);
+        }
+    } finally {
+        progressStream.close();
     }
     
     updateProgress(100, 'Завершено!');
@@ -858,7 +869,7 @@ function showResults(result) {
                 imagesHTML += `
                     <div class="col-lg-3 col-md-4 col-sm-6 mb-3">
                         <div class="card h-100">
-                            <img src="${info.path}" class="card-img-top result-image" alt="${info.name}" style="height: 150px; object-fit: cover;">
+                            <img src="${info.thumbnail_url || info.path}" class="card-img-top result-image" alt="${info.name}" style="height: 150px; object-fit: cover;">
                             <div class="card-body p-2">
                                 <h6 class="card-title mb-1" style="font-size: 0.85rem;">${info.name}</h6>
                                 <small class="text-muted d-block">${info.dimensions}</small>
@@ -899,13 +910,15 @@ function showResults(result) {
             
             // Поддержка разных форматов ответа API
             const outputPath = res.output_path || res.processed_path || (res.success && res.output_path);
+            // Preview from /thumbs/ for display; the download link keeps the full-size result
+            const previewPath = res.thumbnail_url || outputPath;
             
             console.log(`Output path for result ${index}:`, outputPath);
             
             if (outputPath) {
                 imagesHTML += `
                     <div class="col-md-6 mb-3">
-                        <img src="${outputPath}" class="result-image w-100" alt="Обработанное изображение ${index + 1}">
+                        <img src="${previewPath}" class="result-image w-100" alt="Обработанное изображение ${index + 1}">
                     </div>
                 `;
                 downloadButtons += `
@@ -1109,16 +1122,27 @@ async function processSocialMediaOptimization() {
     const formData = new FormData();
     formData.append('file', selectedFiles[0]);
     
+    const progressId = createProgressId();
+    formData.append('progress_id', progressId);
+    const progressStream = subscribeToProgress(progressId, (partial) => {
+        updateProgress(partial.percent, `Готова версия: ${partial.platform}`);
+    });
+    
     updateProgress(30, 'Создание версий для разных платформ...');
     
     const token = localStorage.getItem('token');
     const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
     
-    const response = await fetch('/api/social-media-optimize', {
-        method: 'POST',
-        headers: headers,
-        body: formData
-    });
+    let response;
+    try {
+        response = await fetch('/api/social-media-optimize', {
+            method: 'POST',
+            headers: headers,
+            body: formData
+        });
+    } finally {
+        progressStream.close();
+    }
     
     if (!response.ok) {
         throw new Error('Ошибка при оптимизации для социальных сетей');
@@ -1130,6 +1154,48 @@ async function processSocialMediaOptimization() {
     return result;
 }
 
+// Progress streaming for long-running jobs (Server-Sent Events)
+function createProgressId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return 'job-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 10);
+}
+
+function subscribeToProgress(progressId, onPartial) {
+    if (!window.EventSource) {
+        return { close() {} };
+    }
+    
+    const events = new EventSource(`/api/progress/${progressId}`);
+    let done = 0;
+    let total = null;
+    
+    events.addEventListener('progress', (event) => {
+        total = JSON.parse(event.data).total;
+    });
+    
+    events.addEventListener('stage', (event) => {
+        const data = JSON.parse(event.data);
+        if (data.state === 'started') {
+            updateProgress(data.percent, `${data.stage}... (${data.elapsed.toFixed(1)}с)`);
+        }
+    });
+    
+    events.addEventListener('partial', (event) => {
+        const data = JSON.parse(event.data);
+        done += 1;
+        if (onPartial) {
+            onPartial({ ...data, done, total });
+        }
+    });
+    
+    events.addEventListener('done', () => events.close());
+    events.addEventListener('failed', () => events.close());
+    
+    return events;
+}
+
 // Export functions for global access
 window.removeFile = removeFile;
 window.resetForm = resetForm;
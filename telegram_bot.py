@@ -15,6 +15,7 @@ logger = logging.getLogger(__name__)
 class TelegramBot:
     def __init__(self):
         self.token = os.getenv("TELEGRAM_BOT_TOKEN", "your-bot-token-here")
+        self.api_url = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
         self.image_processor = ImageProcessor()
         self.user_states = {}  # Store user states for multi-step operations
         self.application = None
@@ -27,7 +28,13 @@ class TelegramBot:
             
         try:
             if not self.application:
-                self.application = Application.builder().token(self.token).build()
+                self.application = (
+                    Application.builder()
+                    .token(self.token)
+                    .base_url(f"{self.api_url}/bot")
+                    .base_file_url(f"{self.api_url}/file/bot")
+                    .build()
+                )
             
             # Add handlers
             self.application.add_handler(CommandHandler("start", self.start_command))